@@ -0,0 +1,11 @@
+"""
+Benchmarks for the RDI web generator.
+
+Run the benchmarks from the repository root as modules, e.g.
+
+    python -m benchmarks.endpoints --mode client --requests 50
+    python -m benchmarks.compare old.json new.json
+
+Benchmarks that accept --output write their results as JSON so runs from
+different commits can be compared with benchmarks.compare.
+"""
@@ -0,0 +1,113 @@
+"""
+Benchmark the in-process BPS encoder against the flips CLI.
+
+Run from the repository root:
+
+    python -m benchmarks.bps_create --source ct.sfc --target seed.sfc
+
+If no target ROM is given, a synthetic one is made by scattering random
+changes over the source and expanding it, which roughly matches the shape
+of a randomized ROM.  If no source ROM is given, random data is used.
+"""
+
+from . import common
+
+import argparse
+import os
+import shutil
+import statistics
+import subprocess
+import tempfile
+import time
+
+from generator import bps
+
+
+def time_python(source: bytes, target: bytes, iterations: int):
+    times = []
+    patch = b''
+    for _ in range(iterations):
+        start = time.perf_counter()
+        patch = bps.create_patch(source, target)
+        times.append(time.perf_counter() - start)
+
+    return times, patch
+
+
+def time_flips(flips: str, source: bytes, target: bytes, iterations: int):
+    """
+    Time the flips path the way the view used to run it: write the ROMs to
+    disk, run flips and read the patch back.
+    """
+    times = []
+    patch = b''
+    with tempfile.TemporaryDirectory() as temp_dir:
+        source_path = os.path.join(temp_dir, 'source.sfc')
+        target_path = os.path.join(temp_dir, 'target.sfc')
+        patch_path = os.path.join(temp_dir, 'target.bps')
+        with open(source_path, 'wb') as file:
+            file.write(source)
+
+        for _ in range(iterations):
+            start = time.perf_counter()
+            with open(target_path, 'wb') as file:
+                file.write(target)
+            subprocess.run(
+                [flips, '--create', source_path, target_path, patch_path],
+                check=True, stdout=subprocess.DEVNULL)
+            with open(patch_path, 'rb') as file:
+                patch = file.read()
+            os.remove(patch_path)
+            times.append(time.perf_counter() - start)
+
+    return times, patch
+
+
+def report(name: str, times: list[float], patch: bytes) -> dict:
+    print(f'{name:>8}: mean {statistics.mean(times) * 1000:8.1f} ms  '
+          f'min {min(times) * 1000:8.1f} ms  size {len(patch):>9} bytes')
+    result = common.percentiles(times)
+    result['patch_size'] = len(patch)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--source', help='Vanilla ROM (default: random data)')
+    parser.add_argument('--target', help='Randomized ROM (default: synthetic)')
+    parser.add_argument('--iterations', type=int, default=10)
+    parser.add_argument('--flips', default=shutil.which('flips'),
+                        help='Path to the flips binary')
+    parser.add_argument('--output', help="JSON results file, or '-' for stdout")
+    args = parser.parse_args()
+
+    if args.source:
+        with open(args.source, 'rb') as file:
+            source = file.read()
+    else:
+        source = common.make_synthetic_rom()
+
+    if args.target:
+        with open(args.target, 'rb') as file:
+            target = file.read()
+    else:
+        target = common.make_synthetic_target(source)
+
+    times, patch = time_python(source, target, args.iterations)
+    if bps.apply_patch(source, patch) != target:
+        raise RuntimeError('Python BPS patch does not reproduce the target')
+    results = {'python': report('python', times, patch)}
+
+    if args.flips is None:
+        print('   flips: not found, skipping')
+    else:
+        times, patch = time_flips(args.flips, source, target, args.iterations)
+        if bps.apply_patch(source, patch) != target:
+            raise RuntimeError('Flips BPS patch does not reproduce the target')
+        results['flips'] = report('flips', times, patch)
+
+    common.write_results('bps_create', vars(args), results, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+"""
+Shared helpers for the benchmarks
+"""
+
+import datetime
+import json
+import os
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import typing
+
+REPO_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+WEBAPP_DIR = os.path.join(REPO_DIR, 'rdi_webgen')
+
+if WEBAPP_DIR not in sys.path:
+    sys.path.insert(0, WEBAPP_DIR)
+
+ROM_SIZE = 4 * 1024 * 1024
+
+
+def make_synthetic_rom(seed: int = 1) -> bytes:
+    """
+    Random data the size of the vanilla ROM.  Good enough for anything that
+    doesn't need the randomizer to understand the ROM.
+    """
+    return random.Random(seed).randbytes(ROM_SIZE)
+
+
+def make_synthetic_target(source: bytes, seed: int = 0) -> bytes:
+    """
+    Scatter random edits over a copy of the source and expand it to 6MB,
+    which roughly matches the shape of a randomized ROM.
+    """
+    rng = random.Random(seed)
+    target = bytearray(source)
+    for _ in range(2000):
+        pos = rng.randrange(len(target))
+        length = rng.randrange(1, 256)
+        target[pos:pos + length] = rng.randbytes(min(length, len(target) - pos))
+
+    expanded_size = 6 * 1024 * 1024
+    if len(target) < expanded_size:
+        target += b'\xFF' * (expanded_size - len(target) - 0x8000)
+        target += rng.randbytes(0x8000)
+
+    return bytes(target)
+
+
+def get_rom_path() -> tuple[str, bool]:
+    """
+    Get the path of the vanilla ROM to benchmark with.  If ct.sfc isn't in
+    the webapp directory, a synthetic ROM is written to a temp file instead.
+
+    Returns the path and whether the ROM is synthetic.
+    """
+    rom_path = os.environ.get(
+        'RDI_VANILLA_ROM_PATH', os.path.join(WEBAPP_DIR, 'ct.sfc'))
+    if os.path.exists(rom_path):
+        return os.path.abspath(rom_path), False
+
+    temp_file = tempfile.NamedTemporaryFile(
+        prefix='rdi-bench-', suffix='.sfc', delete=False)
+    with temp_file:
+        temp_file.write(make_synthetic_rom())
+    return temp_file.name, True
+
+
+def setup_django(**overrides: str):
+    """
+    Configure the environment for the webapp and set up Django.  The
+    webapp's paths are relative to rdi_webgen, so this changes into it.
+    """
+    os.chdir(WEBAPP_DIR)
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'rdi.settings')
+    os.environ.setdefault('SECRET_KEY', 'benchmark')
+    os.environ.setdefault('DJANGO_ALLOWED_HOSTS', 'testserver localhost 127.0.0.1')
+    os.environ.update(overrides)
+
+    import django
+    django.setup()
+
+
+def percentiles(samples: list[float]) -> dict[str, float]:
+    """
+    Summarize a list of latencies (in seconds) in milliseconds
+    """
+    if not samples:
+        return {}
+
+    ordered = sorted(samples)
+
+    def pick(quantile: float) -> float:
+        return ordered[min(len(ordered) - 1, int(quantile * len(ordered)))]
+
+    return {
+        'mean_ms': statistics.mean(ordered) * 1000,
+        'p50_ms': pick(0.5) * 1000,
+        'p95_ms': pick(0.95) * 1000,
+        'p99_ms': pick(0.99) * 1000,
+        'max_ms': ordered[-1] * 1000,
+    }
+
+
+def get_peak_rss(pid: typing.Optional[int] = None) -> int:
+    """
+    Get the peak RSS in bytes of a process (this one by default)
+    """
+    if pid is None:
+        # ru_maxrss is in KiB on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    with open(f'/proc/{pid}/status') as file:
+        for line in file:
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+def get_commit() -> str:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR,
+            capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def write_results(
+        name: str,
+        config: dict[str, typing.Any],
+        results: dict[str, typing.Any],
+        output: typing.Optional[str]):
+    """
+    Write benchmark results as JSON.  Pass output='-' for stdout.
+    """
+    if output is None:
+        return
+
+    data = {
+        'benchmark': name,
+        'commit': get_commit(),
+        'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'config': {
+            key: value for key, value in config.items() if key != 'output'
+        },
+        'results': results,
+    }
+
+    if output == '-':
+        json.dump(data, sys.stdout, indent=2)
+        print()
+        return
+
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as file:
+        json.dump(data, file, indent=2)
+    print(f'Results written to {output}')
+
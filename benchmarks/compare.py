@@ -0,0 +1,65 @@
+"""
+Compare two benchmark result files.
+
+    python -m benchmarks.compare old.json new.json
+
+Every number that appears in both results is listed with the relative
+change.  Changes larger than --threshold are flagged.
+"""
+
+import argparse
+import json
+import typing
+
+
+def flatten(data: typing.Any, prefix: str = '') -> dict[str, float]:
+    """
+    Flatten nested results into dotted names
+    """
+    values = {}
+    if isinstance(data, dict):
+        for key, value in data.items():
+            values.update(flatten(value, f'{prefix}{key}.'))
+    elif isinstance(data, (int, float)) and not isinstance(data, bool):
+        values[prefix.rstrip('.')] = data
+    return values
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('old')
+    parser.add_argument('new')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='Relative change to flag (default 0.1)')
+    args = parser.parse_args()
+
+    with open(args.old) as file:
+        old = json.load(file)
+    with open(args.new) as file:
+        new = json.load(file)
+
+    if old['benchmark'] != new['benchmark']:
+        parser.error(f'Can\'t compare {old["benchmark"]} to {new["benchmark"]}')
+
+    print(f'{old["benchmark"]}: {old["commit"]} -> {new["commit"]}')
+    if old['config'] != new['config']:
+        print('Warning: the runs used different configurations')
+
+    old_values = flatten(old['results'])
+    new_values = flatten(new['results'])
+    # Peak memory is keyed by pid, which never matches between runs
+    names = [name for name in old_values
+             if name in new_values and not name.startswith('peak_rss.')]
+    width = max((len(name) for name in names), default=0)
+
+    for name in names:
+        before = old_values[name]
+        after = new_values[name]
+        change = (after - before) / before if before else 0.0
+        flag = '  <--' if abs(change) > args.threshold else ''
+        print(f'{name:<{width}}  {before:14.3f}  {after:14.3f}  '
+              f'{change:+8.1%}{flag}')
+
+
+if __name__ == "__main__":
+    main()
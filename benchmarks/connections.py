@@ -0,0 +1,190 @@
+"""
+Compare how many concurrent connections the WSGI and ASGI servers handle.
+
+Both servers run under gunicorn with the production config and the same
+number of workers: sync workers serving rdi.wsgi, and uvicorn workers
+serving rdi.asgi with the async views.  For each --slow-clients level, that
+many clients open a POST and trickle its body in over --hold seconds, like
+an upload on a slow connection.  While they're connected, --requests preset
+fetches are timed.
+
+A sync worker is tied up by a slow client until its request finishes, so
+once every worker is reading a slow upload, the other requests wait for one
+of them.  The kernel buffers the bodies of connections still waiting to be
+accepted, so uploads queued behind those are read at once: the wait is
+about one --hold whatever the number of slow clients.  The ASGI server
+reads request bodies on the event loop and keeps serving.  The ASGI run
+needs uvicorn and uvicorn-worker installed and is skipped without them.
+
+    python -m benchmarks.connections --workers 2 --slow-clients 0 4 16 64
+"""
+
+from . import common
+from .endpoints import HttpTransport, start_gunicorn
+
+import argparse
+import concurrent.futures
+import importlib.util
+import os
+import socket
+import threading
+import time
+
+SERVERS = {
+    'wsgi': ('rdi.wsgi:application', 'sync'),
+    'asgi': ('rdi.asgi:application', 'uvicorn_worker.UvicornWorker'),
+}
+
+
+def slow_upload(port: int, csrf_token: str, size: int, hold: float,
+                pieces: int = 10) -> bool:
+    """
+    POST a JSON body of size bytes in pieces spread over hold seconds.
+    Returns whether the server answered.
+    """
+    body = b'{}'.rjust(size)
+    headers = (
+        'POST /validate_settings HTTP/1.1\r\n'
+        'Host: 127.0.0.1\r\n'
+        'Content-Type: application/json\r\n'
+        f'Content-Length: {len(body)}\r\n'
+        f'Cookie: csrftoken={csrf_token}\r\n'
+        f'X-CSRFToken: {csrf_token}\r\n'
+        'Connection: close\r\n'
+        '\r\n'
+    )
+    piece_size = -(-len(body) // pieces)
+    try:
+        with socket.create_connection(('127.0.0.1', port), timeout=hold + 60) as sock:
+            sock.sendall(headers.encode())
+            for start in range(0, len(body), piece_size):
+                time.sleep(hold / pieces)
+                sock.sendall(body[start:start + piece_size])
+            return sock.recv(16).startswith(b'HTTP/1.1 200')
+    except OSError:
+        return False
+
+
+def run_level(transport: HttpTransport, port: int, slow_clients: int,
+              args) -> dict:
+    """
+    Time the fast requests while slow_clients uploads are in progress
+    """
+    slow_results = []
+    threads = [
+        threading.Thread(target=lambda: slow_results.append(slow_upload(
+            port, transport.csrf_token, args.upload_size, args.hold)))
+        for _ in range(slow_clients)
+    ]
+    for thread in threads:
+        thread.start()
+    # Let the slow clients connect before the fast requests start
+    time.sleep(min(1.0, args.hold / 4))
+
+    errors = 0
+    lock = threading.Lock()
+
+    def timed_request(_):
+        nonlocal errors
+        start = time.perf_counter()
+        try:
+            ok = transport.request(
+                'GET', f'/fetch_preset/{args.preset}').status == 200
+        except OSError:
+            ok = False
+        if not ok:
+            with lock:
+                errors += 1
+        return time.perf_counter() - start
+
+    with concurrent.futures.ThreadPoolExecutor(args.concurrency) as executor:
+        latencies = list(executor.map(timed_request, range(args.requests)))
+
+    for thread in threads:
+        thread.join()
+
+    return {
+        'latency': common.percentiles(latencies),
+        'errors': errors,
+        'slow_completed': sum(slow_results),
+    }
+
+
+def run_server(name: str, args, env: dict[str, str]) -> dict:
+    app, worker_class = SERVERS[name]
+    server_env = dict(os.environ)
+    server_env.setdefault('SECRET_KEY', 'benchmark')
+    server_env['RDI_RATE_LIMIT_PER_MINUTE'] = '0'
+    server_env['GUNICORN_WORKER_CLASS'] = worker_class
+    server_env.update(env)
+
+    server, port = start_gunicorn(args, server_env, app)
+    try:
+        transport = HttpTransport('127.0.0.1', port)
+        levels = {}
+        for slow_clients in args.slow_clients:
+            result = run_level(transport, port, slow_clients, args)
+            levels[str(slow_clients)] = result
+            latency = result['latency']
+            print(f'{name}: {slow_clients:>4} slow clients  '
+                  f'p50 {latency.get("p50_ms", 0):8.1f} ms  '
+                  f'p95 {latency.get("p95_ms", 0):8.1f} ms  '
+                  f'max {latency.get("max_ms", 0):8.1f} ms  '
+                  f'errors {result["errors"]}  '
+                  f'slow completed {result["slow_completed"]}/{slow_clients}')
+        return {'worker_class': worker_class, 'levels': levels}
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--servers', nargs='+', choices=SERVERS,
+                        default=list(SERVERS))
+    parser.add_argument('--slow-clients', type=int, nargs='+',
+                        default=[0, 4, 16, 64],
+                        help='Numbers of slow uploads to hold open')
+    parser.add_argument('--hold', type=float, default=5.0,
+                        help='Seconds each slow upload takes')
+    parser.add_argument('--upload-size', type=int, default=16 * 1024,
+                        help='Bytes sent by each slow upload')
+    parser.add_argument('--requests', type=int, default=40,
+                        help='Preset fetches timed per level')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--workers', type=int, default=2,
+                        help='Gunicorn workers')
+    parser.add_argument('--port', type=int)
+    parser.add_argument('--gunicorn-arg', action='append', default=[],
+                        help='Extra argument passed to gunicorn')
+    parser.add_argument('--preset', default='STANDARD')
+    parser.add_argument('--output', help="JSON results file, or '-' for stdout")
+    args = parser.parse_args()
+
+    if args.output not in (None, '-'):
+        args.output = os.path.abspath(args.output)
+
+    rom_path, synthetic_rom = common.get_rom_path()
+    if synthetic_rom:
+        print(f'ct.sfc not found, using a synthetic ROM: {rom_path}')
+
+    results = {'servers': {}}
+    try:
+        for name in args.servers:
+            if name == 'asgi' and importlib.util.find_spec('uvicorn_worker') is None:
+                print('asgi: skipped, uvicorn-worker is not installed')
+                results['servers'][name] = {'skipped': 'uvicorn-worker not installed'}
+                continue
+            results['servers'][name] = run_server(
+                name, args, {'RDI_VANILLA_ROM_PATH': rom_path})
+    finally:
+        if synthetic_rom:
+            os.remove(rom_path)
+
+    config = vars(args).copy()
+    config['synthetic_rom'] = synthetic_rom
+    common.write_results('connections', config, results, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,369 @@
+"""
+Load test the generator endpoints.
+
+Drives /generate, /toml_gen and /fetch_preset/<id> either in-process through
+Django's test client (--mode client) or over HTTP against a local gunicorn
+instance started with the production config (--mode gunicorn).  Reports
+req/s, latency percentiles and peak memory per worker process.
+
+A /generate request is timed from the POST until the zip has been
+downloaded.  If ct.sfc isn't in rdi_webgen a synthetic ROM is used, which
+the randomizer will reject, so only the request handling is measured.
+
+    python -m benchmarks.endpoints --mode gunicorn --workers 2 \\
+        --concurrency 8 --requests 40 --output results.json
+"""
+
+from . import common
+
+import argparse
+import concurrent.futures
+import http.client
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+import tomllib
+import typing
+import uuid
+
+TARGETS = ('generate', 'toml_gen', 'fetch_preset')
+
+
+class Response(typing.NamedTuple):
+    status: int
+    headers: dict[str, str]
+    body: bytes
+
+    def json(self):
+        return json.loads(self.body)
+
+
+def encode_multipart(
+        fields: dict[str, str],
+        files: dict[str, tuple[str, bytes]]) -> tuple[bytes, str]:
+    """
+    Encode form fields and files as multipart/form-data
+    """
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"'
+            f'\r\n\r\n{value}\r\n'.encode())
+    for name, (filename, data) in files.items():
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; '
+            f'filename="{filename}"\r\nContent-Type: application/octet-stream'
+            f'\r\n\r\n'.encode() + data + b'\r\n')
+    parts.append(f'--{boundary}--\r\n'.encode())
+
+    return b''.join(parts), f'multipart/form-data; boundary={boundary}'
+
+
+def toml_to_form_fields(toml_data: dict[str, typing.Any]) -> dict[str, str]:
+    """
+    Convert a settings TOML into the fields the TOML builder form posts
+    """
+    fields = {}
+    for name, value in toml_data.items():
+        if isinstance(value, bool):
+            if value:
+                fields[name] = 'on'
+        elif isinstance(value, list):
+            fields[name] = '[' + ', '.join(str(item) for item in value) + ']'
+        else:
+            fields[name] = str(value)
+    return fields
+
+
+class ClientTransport:
+    """
+    Send requests in-process through Django's test client
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def _client(self):
+        if not hasattr(self._local, 'client'):
+            from django.test import Client
+            self._local.client = Client()
+        return self._local.client
+
+    def request(self, method: str, path: str, body: bytes = b'',
+                content_type: str = '', headers=None) -> Response:
+        client = self._client()
+        headers = headers or {}
+        if method == 'GET':
+            response = client.get(path, headers=headers)
+        else:
+            response = client.generic(
+                method, path, body, content_type=content_type,
+                headers=headers)
+
+        if response.streaming:
+            body = b''.join(response.streaming_content)
+        else:
+            body = response.content
+        return Response(response.status_code, dict(response.items()), body)
+
+
+class HttpTransport:
+    """
+    Send requests over HTTP to a running server
+    """
+
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self.csrf_token = None
+
+        # Get a CSRF cookie to use for the POST requests
+        response = self.request('GET', '/')
+        for header, value in response.headers.items():
+            if header.lower() == 'set-cookie' and 'csrftoken=' in value:
+                self.csrf_token = value.split('csrftoken=')[1].split(';')[0]
+
+    def request(self, method: str, path: str, body: bytes = b'',
+                content_type: str = '', headers=None) -> Response:
+        headers = dict(headers or {})
+        if content_type:
+            headers['Content-Type'] = content_type
+        if self.csrf_token is not None:
+            headers['Cookie'] = f'csrftoken={self.csrf_token}'
+            headers['X-CSRFToken'] = self.csrf_token
+
+        conn = http.client.HTTPConnection(self.host, self.port, timeout=300)
+        try:
+            conn.request(method, path, body=body or None, headers=headers)
+            response = conn.getresponse()
+            return Response(
+                response.status, dict(response.getheaders()), response.read())
+        finally:
+            conn.close()
+
+
+class Scenario:
+    """
+    The requests made for each target
+    """
+
+    def __init__(self, args):
+        self.preset = args.preset
+        self.settings_data = None
+        if args.settings_file:
+            with open(args.settings_file, 'rb') as file:
+                self.settings_data = file.read()
+        self.poll_interval = args.poll_interval
+
+    def generate(self, transport) -> bool:
+        files = {}
+        fields = {'preset_file': self.preset}
+        if self.settings_data is not None:
+            files['settings_file'] = ('settings.toml', self.settings_data)
+            fields['preset_file'] = ''
+
+        body, content_type = encode_multipart(fields, files)
+        response = transport.request(
+            'POST', '/generate', body, content_type,
+            headers={'Accept': 'application/json'})
+        if response.status != 202:
+            return False
+
+        job = response.json()
+        while True:
+            status = transport.request('GET', job['status_url']).json()
+            if status['state'] == 'done':
+                break
+            if status['state'] == 'failed':
+                return False
+            time.sleep(self.poll_interval)
+
+        download = transport.request('GET', job['download_url'])
+        return download.status == 200
+
+    def toml_gen(self, transport) -> bool:
+        if self.settings_data is not None:
+            fields = toml_to_form_fields(tomllib.loads(self.settings_data.decode()))
+        else:
+            fields = {}
+        body, content_type = encode_multipart(fields, {})
+        response = transport.request('POST', '/toml_gen', body, content_type)
+        return response.status == 200 \
+            and 'attachment' in response.headers.get('Content-Disposition', '')
+
+    def fetch_preset(self, transport) -> bool:
+        response = transport.request('GET', f'/fetch_preset/{self.preset}')
+        return response.status == 200
+
+
+def run_target(scenario: Scenario, target: str, transport,
+               requests: int, concurrency: int) -> dict[str, typing.Any]:
+    """
+    Make requests to one target and summarize the results
+    """
+    func = getattr(scenario, target)
+
+    def timed_request(_):
+        start = time.perf_counter()
+        try:
+            ok = func(transport)
+        except Exception:
+            ok = False
+        return ok, time.perf_counter() - start
+
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(concurrency) as executor:
+        results = list(executor.map(timed_request, range(requests)))
+    duration = time.perf_counter() - start
+
+    latencies = [latency for ok, latency in results if ok]
+    return {
+        'requests': requests,
+        'errors': sum(1 for ok, _ in results if not ok),
+        'duration_s': duration,
+        'req_per_s': requests / duration,
+        'latency': common.percentiles(latencies),
+    }
+
+
+def get_descendants(pid: int) -> list[int]:
+    """
+    Get all child processes of a process, recursively
+    """
+    try:
+        with open(f'/proc/{pid}/task/{pid}/children') as file:
+            children = [int(child) for child in file.read().split()]
+    except OSError:
+        return []
+
+    descendants = []
+    for child in children:
+        descendants.append(child)
+        descendants.extend(get_descendants(child))
+    return descendants
+
+
+def get_peak_memory(pid: int) -> dict[str, int]:
+    memory = {}
+    for process in [pid] + get_descendants(pid):
+        try:
+            memory[str(process)] = common.get_peak_rss(process)
+        except OSError:
+            continue
+    return memory
+
+
+def wait_for_port(host: str, port: int, process: subprocess.Popen, timeout: float):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError('gunicorn exited during startup')
+        try:
+            with socket.create_connection((host, port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError('Timed out waiting for gunicorn to start')
+
+
+def get_free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_gunicorn(args, env: dict[str, str],
+                   app: str = 'rdi.wsgi:application') -> tuple[subprocess.Popen, int]:
+    port = args.port or get_free_port()
+    command = [
+        sys.executable, '-m', 'gunicorn', app,
+        '-c', 'gunicorn.conf.py',
+        '--bind', f'127.0.0.1:{port}',
+        '--workers', str(args.workers),
+    ] + args.gunicorn_arg
+    process = subprocess.Popen(command, cwd=common.WEBAPP_DIR, env=env)
+    wait_for_port('127.0.0.1', port, process, timeout=60)
+    return process, port
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--mode', choices=('client', 'gunicorn'),
+                        default='client')
+    parser.add_argument('--targets', nargs='+', choices=TARGETS,
+                        default=list(TARGETS))
+    parser.add_argument('--requests', type=int, default=20,
+                        help='Requests per target')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--workers', type=int, default=2,
+                        help='Gunicorn workers')
+    parser.add_argument('--port', type=int)
+    parser.add_argument('--gunicorn-arg', action='append', default=[],
+                        help='Extra argument passed to gunicorn')
+    parser.add_argument('--preset', default='STANDARD')
+    parser.add_argument('--settings-file',
+                        help='Settings TOML to use instead of a preset')
+    parser.add_argument('--poll-interval', type=float, default=0.1)
+    parser.add_argument('--output', help="JSON results file, or '-' for stdout")
+    args = parser.parse_args()
+
+    # Client mode runs from rdi_webgen, so resolve paths first
+    if args.output not in (None, '-'):
+        args.output = os.path.abspath(args.output)
+    if args.settings_file:
+        args.settings_file = os.path.abspath(args.settings_file)
+
+    rom_path, synthetic_rom = common.get_rom_path()
+    if synthetic_rom:
+        print(f'ct.sfc not found, using a synthetic ROM: {rom_path}')
+
+    env = {'RDI_VANILLA_ROM_PATH': rom_path}
+    scenario = Scenario(args)
+    results = {'targets': {}}
+
+    if args.mode == 'client':
+        common.setup_django(**env)
+        transport = ClientTransport()
+        server = None
+    else:
+        server_env = dict(os.environ)
+        server_env.setdefault('SECRET_KEY', 'benchmark')
+        server_env.update(env)
+        server, port = start_gunicorn(args, server_env)
+        transport = HttpTransport('127.0.0.1', port)
+
+    try:
+        for target in args.targets:
+            result = run_target(
+                scenario, target, transport, args.requests, args.concurrency)
+            results['targets'][target] = result
+            latency = result['latency']
+            print(f'{target:>13}: {result["req_per_s"]:8.2f} req/s  '
+                  f'p50 {latency.get("p50_ms", 0):8.1f} ms  '
+                  f'p95 {latency.get("p95_ms", 0):8.1f} ms  '
+                  f'p99 {latency.get("p99_ms", 0):8.1f} ms  '
+                  f'errors {result["errors"]}')
+
+        pid = os.getpid() if server is None else server.pid
+        results['peak_rss'] = get_peak_memory(pid)
+        for process, peak in results['peak_rss'].items():
+            print(f'  pid {process:>7}: peak RSS {peak / (1024 * 1024):8.1f} MiB')
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+        if synthetic_rom:
+            os.remove(rom_path)
+
+    config = vars(args).copy()
+    config['synthetic_rom'] = synthetic_rom
+    common.write_results('endpoints', config, results, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""
+Compare the patch formats on a corpus of seeds.
+
+Every format in generator.patchformats encodes every seed in the corpus,
+including the trusted raw delta formats, so their time can be compared to
+the BPS path.  The encode time and the patch size are recorded, and each
+patch is applied back to the source to check it.
+
+The corpus is one of:
+    --corpus DIR  every .sfc file in DIR, patched against the vanilla ROM
+    generated     --count seeds generated from --preset with the randomizer,
+                  when ct.sfc is available
+    synthetic     --count synthetic targets (see common.make_synthetic_target)
+                  when ct.sfc isn't available
+
+    python -m benchmarks.patch_formats --count 20
+"""
+
+from . import common
+
+import argparse
+import glob
+import os
+import statistics
+import time
+
+
+def load_corpus(args, rom_path: str, synthetic_rom: bool):
+    """
+    Get the source and the list of (name, target) pairs to encode
+    """
+    from generator import artifacts, presets, seedgen
+
+    source = artifacts.get_vanilla_rom()
+
+    if args.corpus:
+        targets = []
+        for path in sorted(glob.glob(os.path.join(args.corpus, '*.sfc'))):
+            with open(path, 'rb') as file:
+                targets.append((os.path.basename(path), file.read()))
+        return source, targets, 'corpus'
+
+    if synthetic_rom:
+        return source, [
+            (f'synthetic-{i}', common.make_synthetic_target(source[:], i))
+            for i in range(args.count)
+        ], 'synthetic'
+
+    targets = []
+    for i in range(args.count):
+        settings_dict = presets.get_settings(args.preset)
+        settings_dict['seed'] = f'patch-formats-{i}'
+        settings_dict['input_file'] = rom_path
+        out_rom, _ = seedgen.generate(settings_dict, None)
+        targets.append((settings_dict['seed'], out_rom.getvalue()))
+    return source, targets, 'generated'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--count', type=int, default=10,
+                        help='Seeds to generate for the corpus')
+    parser.add_argument('--preset', default='STANDARD',
+                        help='Preset to generate the corpus with')
+    parser.add_argument('--corpus', help='Directory of randomized ROMs')
+    parser.add_argument('--output', help="JSON results file, or '-' for stdout")
+    args = parser.parse_args()
+
+    if args.output not in (None, '-'):
+        args.output = os.path.abspath(args.output)
+    if args.corpus:
+        args.corpus = os.path.abspath(args.corpus)
+
+    rom_path, synthetic_rom = common.get_rom_path()
+    if synthetic_rom:
+        print(f'ct.sfc not found, using a synthetic ROM: {rom_path}')
+    common.setup_django(RDI_VANILLA_ROM_PATH=rom_path)
+
+    from generator import patchformats
+
+    source, targets, corpus_type = load_corpus(args, rom_path, synthetic_rom)
+    print(f'Encoding {len(targets)} {corpus_type} seeds')
+
+    results = {'corpus': corpus_type, 'seeds': len(targets), 'formats': {}}
+    for patch_format in patchformats.FORMATS.values():
+        times = []
+        sizes = []
+        skipped = 0
+        # Warm up any per-source state (like the delta encoder's index)
+        patch_format.create_patch(source, targets[0][1])
+
+        for name, target in targets:
+            if not patch_format.supports(source, target):
+                skipped += 1
+                continue
+
+            start = time.perf_counter()
+            patch = patch_format.create_patch(source, target)
+            times.append(time.perf_counter() - start)
+            sizes.append(len(patch))
+
+            if patch_format.apply_patch(source, patch) != target:
+                raise Exception(f'{patch_format.name} patch for {name} '
+                                'does not reproduce the target')
+
+        result = {
+            'encode': common.percentiles(times),
+            'size_mean': statistics.mean(sizes) if sizes else 0,
+            'size_max': max(sizes, default=0),
+            'skipped': skipped,
+        }
+        results['formats'][patch_format.name] = result
+        print(f'{patch_format.name:>10}: '
+              f'encode {result["encode"].get("mean_ms", 0):8.1f} ms mean  '
+              f'{result["encode"].get("p95_ms", 0):8.1f} ms p95  '
+              f'size {result["size_mean"] / 1024:8.1f} KiB mean  '
+              f'{result["size_max"] / 1024:8.1f} KiB max'
+              + (f'  ({skipped} skipped)' if skipped else ''))
+
+    if synthetic_rom:
+        os.remove(rom_path)
+
+    common.write_results('patch_formats', vars(args), results, args.output)
+
+
+if __name__ == "__main__":
+    main()
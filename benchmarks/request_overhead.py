@@ -0,0 +1,212 @@
+"""
+Compare the per-request overhead of the default and stateless profiles.
+
+    default:   the session, authentication and message middleware and apps,
+               backed by the sqlite database
+    stateless: RDI_STATELESS=1, without them (see rdi/settings.py)
+
+Settings are read once per process, so each profile runs in a process of
+its own.  It calls the WSGI application directly, with no server or test
+client in between, so the difference is the middleware and apps alone:
+
+    page:     GET / (the cached index page, which sets the CSRF cookie)
+    preset:   GET /fetch_preset/<preset>
+    validate: POST /validate_settings with a CSRF token
+
+Reports the latency percentiles of each target, the database queries made,
+the time to set up Django and the peak memory of each process.
+
+    python -m benchmarks.request_overhead --iterations 2000
+"""
+
+from . import common
+
+import argparse
+import http.cookies
+import io
+import json
+import os
+import subprocess
+import sys
+import time
+import typing
+
+PROFILES = {
+    'default': '0',
+    'stateless': '1',
+}
+TARGETS = ('page', 'preset', 'validate')
+
+
+def make_environ(method: str, path: str, body: bytes = b'',
+                 headers: typing.Optional[dict[str, str]] = None) -> dict:
+    environ = {
+        'REQUEST_METHOD': method,
+        'PATH_INFO': path,
+        'QUERY_STRING': '',
+        'SERVER_NAME': 'localhost',
+        'SERVER_PORT': '80',
+        'SERVER_PROTOCOL': 'HTTP/1.1',
+        'REMOTE_ADDR': '127.0.0.1',
+        'HTTP_HOST': 'localhost',
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': 'http',
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in (headers or {}).items():
+        key = name.upper().replace('-', '_')
+        if key != 'CONTENT_TYPE':
+            key = f'HTTP_{key}'
+        environ[key] = value
+
+    return environ
+
+
+def call(application, environ: dict) -> tuple[int, list[tuple[str, str]]]:
+    """
+    Run a request through the WSGI application and read the whole response
+    """
+    response_status = []
+
+    def start_response(status, headers, exc_info=None):
+        response_status.append((int(status.split()[0]), headers))
+
+    result = application(environ, start_response)
+    try:
+        for _ in result:
+            pass
+    finally:
+        if hasattr(result, 'close'):
+            result.close()
+
+    return response_status[0]
+
+
+def run_profile(args) -> dict:
+    """
+    Time the targets in this process under the profile in args.profile
+    """
+    start = time.perf_counter()
+    common.setup_django(RDI_STATELESS=PROFILES[args.profile],
+                        RDI_RATE_LIMIT_PER_MINUTE='0')
+    from django.conf import settings
+    from django.core.wsgi import get_wsgi_application
+    from django.db import connections
+    application = get_wsgi_application()
+    setup_time = time.perf_counter() - start
+
+    # Get a CSRF cookie the way a browser would, from the index page
+    status, headers = call(application, make_environ('GET', '/'))
+    cookies = http.cookies.SimpleCookie()
+    for name, value in headers:
+        if name.lower() == 'set-cookie':
+            cookies.load(value)
+    csrf_token = cookies['csrftoken'].value
+
+    body = json.dumps({'ignored_setting': True}).encode()
+    requests = {
+        'page': lambda: make_environ(
+            'GET', '/', headers={'Cookie': f'csrftoken={csrf_token}'}),
+        'preset': lambda: make_environ(
+            'GET', f'/fetch_preset/{args.preset}'),
+        'validate': lambda: make_environ('POST', '/validate_settings', body, {
+            'Content-Type': 'application/json',
+            'Cookie': f'csrftoken={csrf_token}',
+            'X-CSRFToken': csrf_token,
+        }),
+    }
+
+    queries = 0
+
+    def count_queries(execute, sql, params, many, context):
+        nonlocal queries
+        queries += 1
+        return execute(sql, params, many, context)
+
+    targets = {}
+    for name in args.targets:
+        make_request = requests[name]
+        # Warm up caches (the cached page, presets and arg schema)
+        for _ in range(args.warmup):
+            call(application, make_request())
+
+        queries = 0
+        errors = 0
+        times = []
+        with connections['default'].execute_wrapper(count_queries):
+            for _ in range(args.iterations):
+                environ = make_request()
+                start = time.perf_counter()
+                status, _ = call(application, environ)
+                times.append(time.perf_counter() - start)
+                if status >= 400:
+                    errors += 1
+
+        targets[name] = {
+            'latency': common.percentiles(times),
+            'errors': errors,
+            'queries': queries,
+        }
+
+    return {
+        'middleware': list(settings.MIDDLEWARE),
+        'installed_apps': list(settings.INSTALLED_APPS),
+        'setup_ms': setup_time * 1000,
+        'peak_rss': common.get_peak_rss(),
+        'targets': targets,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--profiles', nargs='+', choices=PROFILES,
+                        default=list(PROFILES))
+    parser.add_argument('--targets', nargs='+', choices=TARGETS,
+                        default=list(TARGETS))
+    parser.add_argument('--iterations', type=int, default=2000)
+    parser.add_argument('--warmup', type=int, default=50)
+    parser.add_argument('--preset', default='STANDARD')
+    parser.add_argument('--output', help="JSON results file, or '-' for stdout")
+    # Set when this script runs itself for one profile
+    parser.add_argument('--profile', choices=PROFILES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.profile is not None:
+        json.dump(run_profile(args), sys.stdout)
+        return
+
+    if args.output not in (None, '-'):
+        args.output = os.path.abspath(args.output)
+
+    results = {}
+    for profile in args.profiles:
+        output = subprocess.run(
+            [sys.executable, '-m', 'benchmarks.request_overhead',
+             '--profile', profile, '--targets', *args.targets,
+             '--iterations', str(args.iterations),
+             '--warmup', str(args.warmup), '--preset', args.preset],
+            cwd=common.REPO_DIR, stdout=subprocess.PIPE, check=True).stdout
+        result = json.loads(output)
+        results[profile] = result
+
+        print(f'{profile}: {len(result["middleware"])} middleware, '
+              f'{len(result["installed_apps"])} apps, '
+              f'setup {result["setup_ms"]:.0f} ms, '
+              f'peak RSS {result["peak_rss"] / 2 ** 20:.1f} MiB')
+        for name, target in result['targets'].items():
+            latency = target['latency']
+            print(f'  {name:>8}: mean {latency["mean_ms"] * 1000:7.1f} us  '
+                  f'p50 {latency["p50_ms"] * 1000:7.1f} us  '
+                  f'p99 {latency["p99_ms"] * 1000:7.1f} us  '
+                  f'queries {target["queries"]}  errors {target["errors"]}')
+
+    common.write_results('request_overhead', vars(args), results, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+"""
+Compare the per-worker memory used to hold the ROM artifacts.
+
+    before_preloaded: the ROM files read onto the heap in the parent before
+                      forking the workers (the original artifacts.preload
+                      under gunicorn)
+    before_per_worker: each worker reads the ROM files onto its own heap,
+                       like a worker that wasn't forked from a preloaded
+                       parent
+    after:            the ROM files mapped read-only through
+                      generator.artifacts in the parent
+    after_per_worker: each worker maps the ROM files on its own.  The
+                      mappings still share the page cache.
+
+Each worker then makes the working ROM for a seed and changes a byte in
+every page of it, like the randomizer does.  Once every worker is ready,
+the RSS, PSS and private (USS) memory of each one is read from
+/proc/<pid>/smaps_rollup.  PSS splits shared pages between the processes
+sharing them, so the total PSS is the real memory cost of the workers.
+
+    python -m benchmarks.shared_rom --workers 8
+"""
+
+from . import common
+
+import argparse
+import os
+import statistics
+
+import ctrando.common.ctrom
+
+PAGE_SIZE = 4096
+
+
+def _read_file(path) -> bytes:
+    with open(path, 'rb') as file:
+        return file.read()
+
+
+def load_before(rom_path: str):
+    """
+    Load the artifacts the way the original artifacts module did
+    """
+    raw_data = _read_file(rom_path)
+    rom_data = ctrando.common.ctrom.CTRom.from_file(rom_path).getvalue()
+    base_rom = raw_data if rom_data == raw_data else rom_data
+    return (raw_data, base_rom), lambda: ctrando.common.ctrom.CTRom(base_rom)
+
+
+def load_after(rom_path: str):
+    from generator import artifacts
+    artifacts.get_vanilla_rom()
+    artifacts.get_base_ctrom()
+    return None, artifacts.get_base_ctrom
+
+
+def get_memory(pid: int) -> dict[str, int]:
+    """
+    Get the RSS, PSS and private memory of a process in bytes
+    """
+    fields = {}
+    with open(f'/proc/{pid}/smaps_rollup') as file:
+        for line in file:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                fields[parts[0].rstrip(':')] = int(parts[1]) * 1024
+
+    return {
+        'rss': fields.get('Rss', 0),
+        'pss': fields.get('Pss', 0),
+        'uss': fields.get('Private_Clean', 0) + fields.get('Private_Dirty', 0),
+    }
+
+
+def _worker(ready_fd: int, exit_fd: int, load, rom_path: str, loaded):
+    if loaded is None:
+        loaded = load(rom_path)
+    _, make_working_rom = loaded
+
+    # Touch every page of the working ROM like the randomizer's edits do
+    working_rom = make_working_rom()
+    buffer = working_rom.getbuffer()
+    for pos in range(0, len(buffer), PAGE_SIZE):
+        buffer[pos] ^= 0xFF
+    del buffer
+
+    os.write(ready_fd, b'.')
+    # Hold on to everything until the parent is done measuring
+    os.read(exit_fd, 1)
+    os._exit(0)
+
+
+def measure(load, rom_path: str, workers: int, preload: bool):
+    """
+    Fork the workers and measure each one once they are all ready
+    """
+    loaded = load(rom_path) if preload else None
+
+    ready_read, ready_write = os.pipe()
+    exit_read, exit_write = os.pipe()
+    pids = []
+    for _ in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            os.close(ready_read)
+            os.close(exit_write)
+            _worker(ready_write, exit_read, load, rom_path, loaded)
+        pids.append(pid)
+    os.close(ready_write)
+    os.close(exit_read)
+
+    for _ in range(workers):
+        os.read(ready_read, 1)
+    samples = [get_memory(pid) for pid in pids]
+
+    os.close(exit_write)
+    os.close(ready_read)
+    for pid in pids:
+        os.waitpid(pid, 0)
+
+    return {
+        'rss_mean': statistics.mean(sample['rss'] for sample in samples),
+        'pss_mean': statistics.mean(sample['pss'] for sample in samples),
+        'uss_mean': statistics.mean(sample['uss'] for sample in samples),
+        'pss_total': sum(sample['pss'] for sample in samples),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--output', help="JSON results file, or '-' for stdout")
+    args = parser.parse_args()
+
+    if args.output not in (None, '-'):
+        args.output = os.path.abspath(args.output)
+
+    rom_path, synthetic_rom = common.get_rom_path()
+    if synthetic_rom:
+        print(f'ct.sfc not found, using a synthetic ROM: {rom_path}')
+    common.setup_django(RDI_VANILLA_ROM_PATH=rom_path)
+
+    modes = (
+        ('before_preloaded', load_before, True),
+        ('before_per_worker', load_before, False),
+        ('after', load_after, True),
+        ('after_per_worker', load_after, False),
+    )
+
+    results = {}
+    for name, load, preload in modes:
+        # Each mode runs in its own child so the parent's loaded artifacts
+        # don't carry over into the next mode
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            result = measure(load, rom_path, args.workers, preload)
+            with os.fdopen(write_fd, 'w') as pipe:
+                pipe.write(' '.join(str(int(value)) for value in result.values()))
+            os._exit(0)
+
+        os.close(write_fd)
+        with os.fdopen(read_fd) as pipe:
+            values = map(int, pipe.read().split())
+        os.waitpid(pid, 0)
+
+        result = dict(zip(('rss_mean', 'pss_mean', 'uss_mean', 'pss_total'),
+                          values))
+        results[name] = result
+        print(f'{name:>17}: RSS {result["rss_mean"] / 1024:8.0f} KiB  '
+              f'PSS {result["pss_mean"] / 1024:8.0f} KiB  '
+              f'USS {result["uss_mean"] / 1024:8.0f} KiB  '
+              f'total PSS {result["pss_total"] / 1024:9.0f} KiB')
+
+    if synthetic_rom:
+        os.remove(rom_path)
+
+    common.write_results('shared_rom', vars(args), results, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,240 @@
+"""
+Compare the page weight and render time of the TOML builder page.
+
+    old: the page from --old-rev, where create_toml_gen_form.py writes the
+         HTML of every control, with an inline script per slider and
+         multiselect and a reset line per field
+    new: the page from the working tree, which embeds the compact arg
+         schema and builds the controls with static/generator/js/toml_form.js
+
+Both forms are generated from the installed randomizer into a temporary
+directory.  For each page this reports the bytes sent (raw, gzip and brotli
+if it's installed), the inline scripts and elements in the HTML, the time
+to render the template and the time for Python's HTML parser to read the
+page.  The parse time stands in for the browser's; running the page's
+scripts in a browser isn't measured.  The new page's renderer is a static
+file cached by the browser, so its size is reported separately.
+
+The old generator uses nested f-string quotes, so it needs Python 3.12 or
+later.  Pass --tool-python if the benchmark runs on an older interpreter.
+
+    python -m benchmarks.toml_form --tool-python python3.12 --iterations 50
+"""
+
+from . import common
+
+import argparse
+import gzip
+import html.parser
+import importlib.util
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import typing
+
+common.setup_django()
+
+from django.template import Context, Engine  # noqa: E402
+
+from generator import argschema  # noqa: E402
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+FORM_TOOL = 'tools/create_toml_gen_form.py'
+PAGE_TEMPLATE = 'rdi_webgen/generator/templates/generator/toml_form.html'
+RENDERER = 'rdi_webgen/generator/static/generator/js/toml_form.js'
+
+
+class PageStats(html.parser.HTMLParser):
+    """
+    Count the elements and inline scripts of a page
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.elements = 0
+        self.inline_scripts = 0
+        self.inline_script_bytes = 0
+        self.data_script_bytes = 0
+        self.in_script = None
+
+    def handle_starttag(self, tag, attrs):
+        self.elements += 1
+        if tag == 'script':
+            attrs = dict(attrs)
+            if 'src' in attrs:
+                self.in_script = None
+            elif attrs.get('type') == 'application/json':
+                self.in_script = 'data'
+            else:
+                self.in_script = 'code'
+                self.inline_scripts += 1
+
+    def handle_endtag(self, tag):
+        if tag == 'script':
+            self.in_script = None
+
+    def handle_data(self, data):
+        if self.in_script == 'code':
+            self.inline_script_bytes += len(data.encode())
+        elif self.in_script == 'data':
+            self.data_script_bytes += len(data.encode())
+
+
+def get_old_rev() -> str:
+    """
+    Get the commit before the renderer was added
+    """
+    added = subprocess.run(
+        ['git', 'log', '--diff-filter=A', '--format=%H', '--', RENDERER],
+        cwd=common.REPO_DIR, capture_output=True, text=True,
+        check=True).stdout.split()
+    return f'{added[-1]}^' if added else 'HEAD'
+
+
+def read_file(rev: typing.Optional[str], path: str) -> str:
+    """
+    Read a file from a commit, or the working tree if rev is None
+    """
+    if rev is None:
+        with open(os.path.join(common.REPO_DIR, path)) as file:
+            return file.read()
+
+    return subprocess.run(
+        ['git', 'show', f'{rev}:{path}'], cwd=common.REPO_DIR,
+        capture_output=True, text=True, check=True).stdout
+
+
+def build_page(name: str, rev: typing.Optional[str], work_dir: str,
+               tool_python: str, preset_buttons: str) -> tuple[Engine, dict]:
+    """
+    Generate a version of the form and get a template engine and context
+    that render its page
+    """
+    page_dir = os.path.join(work_dir, name)
+    template_dir = os.path.join(page_dir, 'templates')
+    autogen_dir = os.path.join(template_dir, 'generator', 'toml_gen')
+    os.makedirs(autogen_dir)
+
+    tool_path = os.path.join(page_dir, 'create_toml_gen_form.py')
+    with open(tool_path, 'w') as file:
+        file.write(read_file(rev, FORM_TOOL))
+    result = subprocess.run([tool_python, tool_path], cwd=page_dir,
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(
+            f'The {name} form generator failed (see --tool-python):\n'
+            f'{result.stderr}')
+
+    output_dir = os.path.join(page_dir, 'form_gen_output')
+    html_dir = os.path.join(output_dir, 'html')
+    if os.path.isdir(html_dir):
+        for path in os.listdir(html_dir):
+            shutil.copy(os.path.join(html_dir, path), autogen_dir)
+    shutil.copy(preset_buttons, autogen_dir)
+    with open(os.path.join(template_dir, 'generator', 'toml_form.html'),
+              'w') as file:
+        file.write(read_file(rev, PAGE_TEMPLATE))
+
+    spec = importlib.util.spec_from_file_location(
+        f'toml_gen_form_{name}',
+        os.path.join(output_dir, 'toml_gen_form.py'))
+    form_module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(form_module)
+
+    context = {
+        'form': form_module.TomlGenForm(),
+        'csrf_token': 'benchmark',
+        'arg_schema': argschema.get_page_json(
+            os.path.join(output_dir, 'arg_schema.json')),
+    }
+    engine = Engine(dirs=[template_dir],
+                    libraries={'static': 'django.templatetags.static'})
+    return engine, context
+
+
+def get_sizes(data: bytes) -> dict[str, int]:
+    sizes = {'raw': len(data), 'gzip': len(gzip.compress(data))}
+    if brotli is not None:
+        sizes['br'] = len(brotli.compress(data))
+    return sizes
+
+
+def measure_page(engine: Engine, context: dict, iterations: int) -> dict:
+    template = engine.get_template('generator/toml_form.html')
+    render_times = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        page = template.render(Context(context))
+        render_times.append(time.perf_counter() - start)
+
+    parse_times = []
+    for _ in range(iterations):
+        parser = PageStats()
+        start = time.perf_counter()
+        parser.feed(page)
+        parser.close()
+        parse_times.append(time.perf_counter() - start)
+
+    return {
+        'bytes': get_sizes(page.encode()),
+        'elements': parser.elements,
+        'inline_scripts': parser.inline_scripts,
+        'inline_script_bytes': parser.inline_script_bytes,
+        'schema_bytes': parser.data_script_bytes,
+        'render': common.percentiles(render_times),
+        'parse': common.percentiles(parse_times),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--old-rev',
+                        help='Commit with the old form generator (default: '
+                             'the one before toml_form.js was added)')
+    parser.add_argument('--tool-python', default=sys.executable,
+                        help='Python that runs the form generators')
+    parser.add_argument('--iterations', type=int, default=50)
+    parser.add_argument('--output', help="JSON results file, or '-' for stdout")
+    args = parser.parse_args()
+
+    if args.old_rev is None:
+        args.old_rev = get_old_rev()
+
+    results = {}
+    with tempfile.TemporaryDirectory(prefix='rdi-bench-') as work_dir:
+        subprocess.run(
+            [args.tool_python,
+             os.path.join(common.REPO_DIR, 'tools', 'create_preset_buttons.py')],
+            cwd=work_dir, check=True)
+        preset_buttons = os.path.join(work_dir, 'preset_buttons.html')
+
+        for name, rev in (('old', args.old_rev), ('new', None)):
+            engine, context = build_page(
+                name, rev, work_dir, args.tool_python, preset_buttons)
+            result = measure_page(engine, context, args.iterations)
+            results[name] = result
+            print(f'{name}: {result["bytes"]["raw"]:>9} bytes  '
+                  f'gzip {result["bytes"]["gzip"]:>8}  '
+                  f'inline scripts {result["inline_scripts"]:>4} '
+                  f'({result["inline_script_bytes"]} bytes)  '
+                  f'elements {result["elements"]:>6}  '
+                  f'render {result["render"]["mean_ms"]:7.2f} ms  '
+                  f'parse {result["parse"]["mean_ms"]:7.2f} ms')
+
+    with open(os.path.join(common.REPO_DIR, RENDERER), 'rb') as file:
+        results['new']['renderer_bytes'] = get_sizes(file.read())
+    print(f'new: renderer {results["new"]["renderer_bytes"]["raw"]} bytes, '
+          f'gzip {results["new"]["renderer_bytes"]["gzip"]} (cached)')
+
+    common.write_results('toml_form', vars(args), results, args.output)
+
+
+if __name__ == "__main__":
+    main()
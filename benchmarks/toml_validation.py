@@ -0,0 +1,97 @@
+"""
+Compare the cost of validating TOML builder form submissions.
+
+    before: dump the form data to TOML, load it back and run it through the
+            rando arg parser (the original TomlGenView)
+    after:  build the settings straight from the form data and validate
+            through the memoized validation engine, both on a cache miss
+            and on a resubmission of the same settings
+
+The form data comes from a preset (or --settings-file) run through the
+TOML builder form, like a user loading the preset and submitting it.
+
+    python -m benchmarks.toml_validation --iterations 200
+"""
+
+from . import common
+from .endpoints import toml_to_form_fields
+
+import argparse
+import io
+import time
+import tomllib
+
+common.setup_django()
+
+import ctrando.randomizer  # noqa: E402
+import toml  # noqa: E402
+from ctrando.arguments import tomloptions  # noqa: E402
+
+from generator import presets, validation  # noqa: E402
+from generator.toml_gen_form import TomlGenForm  # noqa: E402
+
+
+def validate_before(cleaned_data):
+    data_dict = validation.form_to_settings_dict(cleaned_data)
+    toml_data = io.StringIO()
+    toml.dump(data_dict, toml_data)
+    toml_dict = tomllib.load(io.BytesIO(toml_data.getvalue().encode()))
+    args = tomloptions.toml_data_to_args(toml_dict)
+    ctrando.randomizer.extract_settings(*args)
+    return toml_data.getvalue()
+
+
+def validate_after_miss(cleaned_data):
+    validation.clear_cache()
+    return validate_after_hit(cleaned_data)
+
+
+def validate_after_hit(cleaned_data):
+    data_dict = validation.form_to_settings_dict(cleaned_data)
+    validation.validate(data_dict)
+    return toml.dumps(data_dict)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--preset', default='STANDARD')
+    parser.add_argument('--settings-file',
+                        help='Settings TOML to use instead of a preset')
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--output', help="JSON results file, or '-' for stdout")
+    args = parser.parse_args()
+
+    if args.settings_file:
+        with open(args.settings_file, 'rb') as file:
+            settings_dict = tomllib.load(file)
+    else:
+        settings_dict = presets.get_settings(args.preset)
+
+    form = TomlGenForm(toml_to_form_fields(settings_dict))
+    if not form.is_valid():
+        raise RuntimeError(f'Form rejected the settings: {form.errors}')
+    cleaned_data = form.cleaned_data
+
+    # The direct conversion has to give the parser the same settings
+    if validate_before(cleaned_data) != validate_after_miss(cleaned_data):
+        raise RuntimeError('Direct conversion changed the TOML output')
+
+    results = {}
+    for name, func in (('before', validate_before),
+                       ('after_miss', validate_after_miss),
+                       ('after_hit', validate_after_hit)):
+        times = []
+        for _ in range(args.iterations):
+            start = time.perf_counter()
+            func(cleaned_data)
+            times.append(time.perf_counter() - start)
+
+        results[name] = common.percentiles(times)
+        print(f'{name:>10}: mean {results[name]["mean_ms"]:8.3f} ms  '
+              f'p95 {results[name]["p95_ms"]:8.3f} ms')
+
+    common.write_results('toml_validation', vars(args), results, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+Compare the memory used to build and send a seed zip.
+
+    before: zip built in a BytesIO from getvalue() copies and sent through
+            FileWrapper in a plain HttpResponse (the original GenerateView)
+    after:  zip entries written straight to the job's result file and sent
+            with a streaming FileResponse
+
+Each approach runs in its own forked process.  The peak RSS growth and the
+peak traced Python allocation while handling one request are reported.
+
+Run from the repository root:
+
+    python -m benchmarks.zip_memory --patch-size 1048576
+"""
+
+from . import common
+
+import argparse
+import io
+import os
+import random
+import resource
+import tempfile
+import tracemalloc
+from wsgiref.util import FileWrapper
+from zipfile import ZipFile
+
+from django.conf import settings
+
+settings.configure()
+
+from django.http import FileResponse, HttpResponse  # noqa: E402
+
+from generator import archive  # noqa: E402
+
+
+def send_before(patch_data: bytes, spoiler_text: str, result_dir: str) -> int:
+    patch_file = io.BytesIO(patch_data)
+    spoiler_log = io.StringIO(spoiler_text)
+
+    zip_buf = io.BytesIO()
+    with ZipFile(zip_buf, 'w') as zip_file:
+        zip_file.writestr('ct-mod.bps', patch_file.getvalue())
+        zip_file.writestr('ct-mod-spoilers.txt', spoiler_log.getvalue())
+    zip_buf.seek(0)
+
+    content = FileWrapper(zip_buf)
+    response = HttpResponse(content, content_type='application/octet-stream')
+    return sum(len(chunk) for chunk in response)
+
+
+def send_after(patch_data: bytes, spoiler_text: str, result_dir: str) -> int:
+    result_path = os.path.join(result_dir, 'ct-mod.zip')
+    with open(result_path, 'wb') as file:
+        archive.write_seed_zip(file, patch_data, spoiler_text)
+
+    response = FileResponse(open(result_path, 'rb'), as_attachment=True,
+                            filename='ct-mod.zip')
+    size = sum(len(chunk) for chunk in response)
+    response.close()
+    return size
+
+
+def measure(send, patch_data: bytes, spoiler_text: str) -> dict[str, int]:
+    """
+    Run one request in a forked child and report its memory use
+    """
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        with tempfile.TemporaryDirectory() as result_dir:
+            rss_start = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            tracemalloc.start()
+            size = send(patch_data, spoiler_text, result_dir)
+            _, traced_peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            rss_end = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+        with os.fdopen(write_fd, 'w') as pipe:
+            # ru_maxrss is in KiB on Linux
+            pipe.write(f'{(rss_end - rss_start) * 1024} {traced_peak} {size}')
+        os._exit(0)
+
+    os.close(write_fd)
+    with os.fdopen(read_fd) as pipe:
+        rss_growth, traced_peak, size = map(int, pipe.read().split())
+    os.waitpid(pid, 0)
+
+    return {'rss_growth': rss_growth, 'traced_peak': traced_peak, 'size': size}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--patch-size', type=int, default=1024 * 1024)
+    parser.add_argument('--spoiler-size', type=int, default=256 * 1024)
+    parser.add_argument('--output', help="JSON results file, or '-' for stdout")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    patch_data = rng.randbytes(args.patch_size)
+    spoiler_text = ''.join(
+        rng.choice('abcdefghijklmnopqrstuvwxyz \n')
+        for _ in range(args.spoiler_size))
+
+    results = {}
+    for name, send in (('before', send_before), ('after', send_after)):
+        result = measure(send, patch_data, spoiler_text)
+        results[name] = result
+        print(f'{name:>6}: peak RSS growth {result["rss_growth"] / 1024:9.0f} KiB  '
+              f'peak traced {result["traced_peak"] / 1024:9.0f} KiB  '
+              f'zip {result["size"]} bytes')
+
+    common.write_results('zip_memory', vars(args), results, args.output)
+
+
+if __name__ == "__main__":
+    main()
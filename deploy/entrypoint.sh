@@ -1,36 +1,15 @@
 #!/bin/bash
 
-# Autogenerate the toml generator html and python form code
-echo "Auto-generating TOML generator form..."
-python tools/create_toml_gen_form.py
+# Autogenerate the toml form and preset buttons, prepatch the ROM, migrate
+# the database (unless RDI_STATELESS is set) and collect static files.
+# Independent steps run in parallel and steps whose inputs haven't changed
+# since the last start are skipped (see generator/buildsteps.py).
+echo "Running startup steps..."
+python manage.py startup
 
 if [[ $? -ne 0 ]]; then
-    echo "Failed to generate toml_gen form"
+    echo "Startup steps failed"
     exit 1
 fi
 
-# Copy over the auto-generated html files
-AUTOGEN_HTML_PATH=generator/templates/generator/toml_gen
-mkdir -p $AUTOGEN_HTML_PATH
-cp form_gen_output/html/* $AUTOGEN_HTML_PATH
-
-# Copy over the auto-generated python form file
-cp form_gen_output/toml_gen_form.py generator/
-rm -r form_gen_output
-
-# Autogenerate the preset buttons based on available preset files
-echo "Creating preset button template..."
-python tools/create_preset_buttons.py
-cp preset_buttons.html $AUTOGEN_HTML_PATH
-rm preset_buttons.html
-
-# Generate the ROM files pre-patched with the base patch.
-# This can be used to speed up subsequent randomizer calls
-echo "Creating prepatched config and ctrom objects..."
-python tools/prepatch_rom.py
-
-# Handle db migrations and static files on container startup
-python manage.py migrate
-python manage.py collectstatic --no-input --clear
-
 exec "$@"
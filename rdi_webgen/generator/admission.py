@@ -0,0 +1,317 @@
+"""
+Admission control for seed generation.
+
+A burst of generate requests (e.g. when a race is announced) would
+otherwise fill every randomizer worker at once and starve the rest of the
+site of CPU.  Requests pass three checks:
+
+  - a token bucket per client IP: RDI_RATE_LIMIT_BURST seeds at once,
+    refilled at RDI_RATE_LIMIT_PER_MINUTE.  A batch costs a token per
+    seed.  An empty bucket gets a 429.
+  - a global limit of RDI_MAX_GENERATIONS seeds generating at the same
+    time.  An admitted job waits in its pool for a free slot before it
+    starts (see jobs.py).  Each seed of a batch takes a slot of its own.
+  - a bounded wait queue: at most RDI_ADMISSION_QUEUE admitted jobs may be
+    waiting for a slot.  Past that, requests get a 503.
+
+Both rejections carry a Retry-After header.
+
+The state is shared by every web worker through a small sqlite database
+(RDI_ADMISSION_DB), so no external service is needed.  Each admitted job
+holds a ticket row until it finishes.  Tickets left behind by a worker
+that died are reclaimed once the worker's process is gone or the ticket has
+waited or run for longer than RDI_ADMISSION_LEASE.  A job that waits that
+long for a slot fails rather than waiting on.
+"""
+
+from django.conf import settings
+
+import math
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+WAITING = 'waiting'
+RUNNING = 'running'
+
+# Seconds between checks for a free generation slot
+_POLL_INTERVAL = 0.25
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS buckets (
+    client TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS tickets (
+    id TEXT PRIMARY KEY,
+    pid INTEGER NOT NULL,
+    state TEXT NOT NULL,
+    created REAL NOT NULL,
+    started REAL
+);
+'''
+
+
+class Rejected(Exception):
+    """
+    Raised when a request isn't admitted.  status is the HTTP status to
+    send and retry_after the seconds the client should wait.
+    """
+
+    def __init__(self, message: str, status: int, retry_after: int):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+class SlotTimeout(Exception):
+    """
+    Raised when an admitted job waits longer than RDI_ADMISSION_LEASE for a
+    generation slot
+    """
+
+
+_local = threading.local()
+
+
+def _connect() -> sqlite3.Connection:
+    """
+    Get this thread's connection to the admission database
+    """
+    conn = getattr(_local, 'conn', None)
+    if conn is None or getattr(_local, 'path', None) != settings.RDI_ADMISSION_DB:
+        # Autocommit mode, so transactions are started explicitly with
+        # BEGIN IMMEDIATE and two workers can't read the same free slot
+        conn = sqlite3.connect(
+            settings.RDI_ADMISSION_DB, timeout=10, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.executescript(_SCHEMA)
+        _local.conn = conn
+        _local.path = settings.RDI_ADMISSION_DB
+
+    return conn
+
+
+class _Transaction:
+    """
+    Write transaction on the admission database
+    """
+
+    def __enter__(self) -> sqlite3.Connection:
+        self.conn = _connect()
+        self.conn.execute('BEGIN IMMEDIATE')
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute('ROLLBACK' if exc_type else 'COMMIT')
+
+
+def get_client_ip(request) -> str:
+    """
+    Get the client's address.  Behind a proxy, RDI_CLIENT_IP_HEADER names
+    the header the proxy puts it in.
+    """
+    if settings.RDI_CLIENT_IP_HEADER:
+        address = request.headers.get(settings.RDI_CLIENT_IP_HEADER, '')
+        # X-Forwarded-For style lists end with the address the proxy saw
+        address = address.split(',')[-1].strip()
+        if address:
+            return address
+
+    return request.META.get('REMOTE_ADDR', '')
+
+
+def check_rate(client: str, cost: int = 1):
+    """
+    Take cost tokens from the client's bucket.  Raises Rejected if it
+    doesn't have them.  A cost larger than the burst needs a full bucket
+    and leaves it in debt, so the client waits for every token it used.
+    """
+    rate = settings.RDI_RATE_LIMIT_PER_MINUTE / 60
+    burst = settings.RDI_RATE_LIMIT_BURST
+    if rate <= 0:
+        return
+
+    needed = min(cost, burst)
+    now = time.time()
+    with _Transaction() as conn:
+        row = conn.execute(
+            'SELECT tokens, updated FROM buckets WHERE client = ?',
+            (client,)).fetchone()
+        tokens = burst
+        if row is not None:
+            tokens = min(burst, row[0] + (now - row[1]) * rate)
+
+        allowed = tokens >= needed
+        if allowed:
+            tokens -= cost
+        conn.execute(
+            'INSERT OR REPLACE INTO buckets (client, tokens, updated) '
+            'VALUES (?, ?, ?)', (client, tokens, now))
+        # Buckets idle long enough to be full again don't need a row
+        conn.execute(
+            'DELETE FROM buckets WHERE tokens + (? - updated) * ? >= ?',
+            (now, rate, burst))
+
+    if not allowed:
+        raise Rejected(
+            'Too many seeds requested, please wait before trying again',
+            status=429, retry_after=math.ceil((needed - tokens) / rate))
+
+
+def pid_alive(pid: int) -> bool:
+    """
+    Check whether a process on this host is still running
+    """
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _reclaim(conn: sqlite3.Connection):
+    """
+    Drop tickets whose worker died or that outlived the lease.  A running
+    ticket's lease counts from when it started running.
+    """
+    conn.execute('DELETE FROM tickets WHERE COALESCE(started, created) < ?',
+                 (time.time() - settings.RDI_ADMISSION_LEASE,))
+    pids = [row[0] for row in conn.execute('SELECT DISTINCT pid FROM tickets')]
+    for pid in pids:
+        if not pid_alive(pid):
+            conn.execute('DELETE FROM tickets WHERE pid = ?', (pid,))
+
+
+def _count(conn: sqlite3.Connection, state: str) -> int:
+    return conn.execute(
+        'SELECT COUNT(*) FROM tickets WHERE state = ?', (state,)).fetchone()[0]
+
+
+def admit() -> str:
+    """
+    Admit a generation job and return its ticket.  Raises Rejected if the
+    wait queue is full.
+    """
+    if settings.RDI_MAX_GENERATIONS <= 0:
+        return ''
+
+    with _Transaction() as conn:
+        _reclaim(conn)
+        running = _count(conn, RUNNING)
+        waiting = _count(conn, WAITING)
+        free_slots = max(0, settings.RDI_MAX_GENERATIONS - running)
+        if waiting >= free_slots + settings.RDI_ADMISSION_QUEUE:
+            raise Rejected(
+                'The generator is busy, please try again shortly',
+                status=503, retry_after=settings.RDI_ADMISSION_RETRY_AFTER)
+
+        return _insert_ticket(conn)
+
+
+def _insert_ticket(conn: sqlite3.Connection) -> str:
+    ticket = str(uuid.uuid4())
+    conn.execute(
+        'INSERT INTO tickets (id, pid, state, created) VALUES (?, ?, ?, ?)',
+        (ticket, os.getpid(), WAITING, time.time()))
+    return ticket
+
+
+def create_ticket() -> str:
+    """
+    Get a ticket for work that was already admitted as part of a larger
+    job, such as one seed of a batch.  It skips the wait queue check but
+    still waits for a generation slot.
+    """
+    if settings.RDI_MAX_GENERATIONS <= 0:
+        return ''
+
+    with _Transaction() as conn:
+        return _insert_ticket(conn)
+
+
+def is_idle() -> bool:
+    """
+    Check whether a generation slot is free with nothing waiting for one
+    """
+    if settings.RDI_MAX_GENERATIONS <= 0:
+        return True
+
+    with _Transaction() as conn:
+        _reclaim(conn)
+        return _count(conn, WAITING) == 0 \
+            and _count(conn, RUNNING) < settings.RDI_MAX_GENERATIONS
+
+
+def wait_for_slot(ticket: str):
+    """
+    Block until the ticket's job may start generating.  This is called
+    when a pool worker picks up the job, so it doesn't wait for older
+    tickets still queued in another web worker's pool.
+
+    Raises SlotTimeout if no slot frees up within RDI_ADMISSION_LEASE, so
+    the job fails instead of holding its pool worker forever.
+    """
+    if not ticket:
+        return
+
+    deadline = time.monotonic() + settings.RDI_ADMISSION_LEASE
+    while True:
+        with _Transaction() as conn:
+            _reclaim(conn)
+            if _count(conn, RUNNING) < settings.RDI_MAX_GENERATIONS:
+                now = time.time()
+                cursor = conn.execute(
+                    'UPDATE tickets SET state = ?, started = ? WHERE id = ?',
+                    (RUNNING, now, ticket))
+                if cursor.rowcount == 0:
+                    # The ticket was reclaimed while it waited.  Take the
+                    # slot with a new row so the job still holds it.
+                    conn.execute(
+                        'INSERT INTO tickets (id, pid, state, created, started) '
+                        'VALUES (?, ?, ?, ?, ?)',
+                        (ticket, os.getpid(), RUNNING, now, now))
+                return
+        if time.monotonic() >= deadline:
+            raise SlotTimeout(
+                'Timed out waiting for a free generation slot, please try '
+                'again later')
+        time.sleep(_POLL_INTERVAL)
+
+
+def release(ticket: str):
+    """
+    Give back a ticket once its job is done
+    """
+    if not ticket:
+        return
+
+    with _Transaction() as conn:
+        conn.execute('DELETE FROM tickets WHERE id = ?', (ticket,))
+
+
+def render_prometheus() -> str:
+    """
+    Get the current number of waiting and running jobs in the Prometheus
+    text format
+    """
+    if settings.RDI_MAX_GENERATIONS <= 0:
+        return ''
+
+    conn = _connect()
+    counts = dict(conn.execute(
+        'SELECT state, COUNT(*) FROM tickets GROUP BY state').fetchall())
+    lines = [
+        '# HELP rdi_admission_jobs Admitted seed generation jobs by state',
+        '# TYPE rdi_admission_jobs gauge',
+    ]
+    for state in (WAITING, RUNNING):
+        lines.append(
+            f'rdi_admission_jobs{{state="{state}"}} {counts.get(state, 0)}')
+
+    return '\n'.join(lines) + '\n'
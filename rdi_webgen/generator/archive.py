@@ -0,0 +1,40 @@
+"""
+Zip archives sent to the user.
+
+Archives are written straight to their destination file one entry at a time
+so the finished zip is never held in memory.
+"""
+
+import typing
+from zipfile import ZipFile
+
+# The patch's extension depends on its format (see generator.patchformats)
+PATCH_STEM = 'ct-mod'
+PATCH_NAME = f'{PATCH_STEM}.bps'
+SPOILER_NAME = 'ct-mod-spoilers.txt'
+
+# Size of the slices written to each zip entry
+_CHUNK_SIZE = 64 * 1024
+
+
+def write_entry(zip_file: ZipFile, name: str, data: typing.Union[bytes, str]):
+    """
+    Write a zip entry from a buffer in chunks, without copying the buffer
+    """
+    if isinstance(data, str):
+        data = data.encode()
+
+    view = memoryview(data)
+    with zip_file.open(name, 'w') as entry:
+        for offset in range(0, len(view), _CHUNK_SIZE):
+            entry.write(view[offset:offset + _CHUNK_SIZE])
+
+
+def write_seed_zip(file: typing.BinaryIO, patch_data: bytes, spoiler_text: str,
+                   patch_name: str = PATCH_NAME):
+    """
+    Write the zip for a seed (patch and spoiler log) to a file object
+    """
+    with ZipFile(file, 'w') as zip_file:
+        write_entry(zip_file, patch_name, patch_data)
+        write_entry(zip_file, SPOILER_NAME, spoiler_text)
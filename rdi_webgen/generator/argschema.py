@@ -0,0 +1,195 @@
+"""
+Per-field validation of TOML builder settings.
+
+tools/create_toml_gen_form.py writes arg_schema.json next to the form it
+generates.  It holds the constraints of every randomizer argument: min, max
+and interval for numbers, and the allowed choices for choice and
+multiselect fields.  Checking a field against the table is a dictionary
+lookup, so the TOML form can validate each change as it is made without
+running the randomizer's settings extraction.
+
+The TOML form page embeds the same file, along with each field's help text
+and default, and builds its controls from it in the browser.
+"""
+
+import json
+import math
+import os
+import threading
+import typing
+
+SCHEMA_PATH = os.path.join(os.path.dirname(__file__), 'arg_schema.json')
+
+# Tolerance when checking that a float lies on the slider interval
+_INTERVAL_TOLERANCE = 1e-9
+
+# Characters that could end or confuse a <script> element holding the schema
+_SCRIPT_ESCAPES = {
+    ord('<'): '\\u003C',
+    ord('>'): '\\u003E',
+    ord('&'): '\\u0026',
+}
+
+
+class SchemaUnavailable(Exception):
+    """
+    Raised when the arg schema hasn't been generated
+    """
+
+
+_schema: typing.Optional[dict[str, dict[str, typing.Any]]] = None
+_schema_lock = threading.Lock()
+
+
+def _load_schema() -> dict[str, dict[str, typing.Any]]:
+    try:
+        with open(SCHEMA_PATH) as file:
+            schema = json.load(file)
+    except FileNotFoundError:
+        raise SchemaUnavailable(
+            'Run tools/create_toml_gen_form.py to generate arg_schema.json')
+
+    # Turn the choice lists into sets for constant time lookups
+    for constraints in schema.values():
+        if 'choices' in constraints:
+            constraints['choices'] = frozenset(constraints['choices'])
+
+    return schema
+
+
+def get_page_json(path: str = SCHEMA_PATH) -> str:
+    """
+    Get the schema as JSON that can be placed in a page's <script> element
+    """
+    try:
+        with open(path) as file:
+            text = file.read()
+    except FileNotFoundError:
+        raise SchemaUnavailable(
+            'Run tools/create_toml_gen_form.py to generate arg_schema.json')
+
+    return text.strip().translate(_SCRIPT_ESCAPES)
+
+
+def get_schema() -> dict[str, dict[str, typing.Any]]:
+    global _schema
+    with _schema_lock:
+        if _schema is None:
+            _schema = _load_schema()
+        return _schema
+
+
+def _parse_list(value: typing.Any) -> list[str]:
+    """
+    Read a multiselect value, either a list or the "[a, b]" string the form
+    posts
+    """
+    if isinstance(value, list):
+        return [str(item) for item in value]
+
+    value = str(value).strip()
+    if not (value.startswith('[') and value.endswith(']')):
+        raise ValueError('Expected a list')
+    if len(value) == 2:
+        return []
+    return [item.replace("'", '').strip() for item in value[1:-1].split(',')]
+
+
+def _check_flag(constraints, value) -> typing.Optional[str]:
+    if isinstance(value, bool):
+        return None
+    if str(value).lower() in ('on', 'true', 'false', ''):
+        return None
+    return 'Expected true or false'
+
+
+def _check_number(constraints, value) -> typing.Optional[str]:
+    if isinstance(value, bool):
+        return 'Expected a number'
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return 'Expected a number'
+
+    if constraints['type'] == 'int' and not number.is_integer():
+        return 'Expected a whole number'
+
+    minimum = constraints['min']
+    maximum = constraints['max']
+    if not minimum <= number <= maximum:
+        return f'Must be between {minimum} and {maximum}'
+
+    interval = constraints.get('interval')
+    if interval:
+        steps = (number - minimum) / interval
+        if not math.isclose(steps, round(steps), abs_tol=_INTERVAL_TOLERANCE):
+            return f'Must be a multiple of {interval} from {minimum}'
+
+    return None
+
+
+def _check_choice(constraints, value) -> typing.Optional[str]:
+    if str(value) not in constraints['choices']:
+        return f'Invalid choice: {value}'
+    return None
+
+
+def _check_multiselect(constraints, value) -> typing.Optional[str]:
+    try:
+        items = _parse_list(value)
+    except ValueError as ex:
+        return str(ex)
+
+    for item in items:
+        if item not in constraints['choices']:
+            return f'Invalid choice: {item}'
+    if not constraints['allow_duplicates'] and len(set(items)) != len(items):
+        return 'Items may only be selected once'
+
+    return None
+
+
+def _check_string(constraints, value) -> typing.Optional[str]:
+    if not isinstance(value, str):
+        return 'Expected text'
+    if len(value) > constraints['max_length']:
+        return f'Must be at most {constraints["max_length"]} characters'
+    return None
+
+
+_CHECKS = {
+    'flag': _check_flag,
+    'int': _check_number,
+    'float': _check_number,
+    'choice': _check_choice,
+    'multiselect': _check_multiselect,
+    'string': _check_string,
+}
+
+
+def validate_field(name: str, value: typing.Any) -> typing.Optional[str]:
+    """
+    Check one field against the arg schema.  Returns the error text, or
+    None if the value is valid.
+    """
+    constraints = get_schema().get(name)
+    if constraints is None:
+        return 'Unknown setting'
+    if value is None or value == '':
+        # Empty fields are left out of the settings file
+        return None
+
+    return _CHECKS[constraints['type']](constraints, value)
+
+
+def validate_delta(delta: dict[str, typing.Any]) -> dict[str, str]:
+    """
+    Check a set of changed fields.  Returns the errors keyed by field name.
+    """
+    errors = {}
+    for name, value in delta.items():
+        error = validate_field(name, value)
+        if error is not None:
+            errors[name] = error
+
+    return errors
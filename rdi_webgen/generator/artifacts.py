@@ -0,0 +1,146 @@
+"""
+Process-wide cache of the static files used to generate seeds.
+
+The vanilla ROM never changes while the server is running, so it is mapped
+read-only instead of being read onto each process's heap.  A file mapping
+lives in the OS page cache, so every web worker and randomizer worker shares
+the same physical pages whether it was forked after preload() (see
+gunicorn.conf.py) or loaded the ROM on its own.  Only the working ROM that
+the randomizer mutates is copied, once per seed.
+
+The prepatched objects (tools/prepatch_rom.py) can't be shared the same
+way.  ctrando.randomizer.get_ctrom_from_config only takes their file paths
+and unpickles them itself for every seed, and the randomizer mutates them,
+so each seed needs objects of its own anyway.  Their files are mapped here
+only to keep them in the page cache.
+"""
+
+import functools
+import logging
+import mmap
+import threading
+import typing
+from collections import Counter
+
+from django.conf import settings
+
+import ctrando.common.ctrom
+
+logger = logging.getLogger(__name__)
+
+
+class ArtifactCache:
+    """
+    Load-once cache of named artifacts with hit/miss counters
+    """
+
+    def __init__(self):
+        self._entries: dict[str, typing.Any] = {}
+        self._lock = threading.RLock()
+        self.hits = Counter()
+        self.misses = Counter()
+
+    def get(self, name: str, loader: typing.Callable[[], typing.Any]):
+        """
+        Get an artifact, calling loader to create it on first use
+        """
+        with self._lock:
+            if name in self._entries:
+                self.hits[name] += 1
+                return self._entries[name]
+
+            self.misses[name] += 1
+            value = self._entries[name] = loader()
+            return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict[str, dict[str, int]]:
+        """
+        Get the hit/miss counts for each artifact
+        """
+        with self._lock:
+            return {
+                name: {'hits': self.hits[name], 'misses': self.misses[name]}
+                for name in sorted(set(self.hits) | set(self.misses))
+            }
+
+
+_cache = ArtifactCache()
+
+
+def _map_file(path) -> mmap.mmap:
+    """
+    Map a file read-only.  The pages are shared with every other process
+    that maps or reads the same file.
+    """
+    with open(path, 'rb') as file:
+        mapping = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    mapping.madvise(mmap.MADV_WILLNEED)
+    return mapping
+
+
+def _share_bytes(data: bytes) -> mmap.mmap:
+    """
+    Copy data into an anonymous shared mapping.  Processes forked after this
+    see the same physical pages.
+    """
+    mapping = mmap.mmap(-1, len(data))
+    mapping.write(data)
+    mapping.seek(0)
+    return mapping
+
+
+def _load_base_rom() -> mmap.mmap:
+    """
+    Load the ROM data the way the randomizer expects it.  If it's identical
+    to the raw file (i.e. there is no copier header), share the vanilla ROM
+    mapping instead of keeping a second copy.
+    """
+    raw_data = get_vanilla_rom()
+    rom_data = ctrando.common.ctrom.CTRom.from_file(
+        settings.RDI_VANILLA_ROM_PATH).getvalue()
+    if memoryview(raw_data) == rom_data:
+        return raw_data
+    return _share_bytes(rom_data)
+
+
+def get_vanilla_rom() -> mmap.mmap:
+    """
+    Get a read-only mapping of the vanilla ROM file.  This is the patch
+    source.  It supports the buffer protocol, len() and slicing.
+    """
+    return _cache.get(
+        'vanilla_rom', lambda: _map_file(settings.RDI_VANILLA_ROM_PATH))
+
+
+def get_base_ctrom() -> ctrando.common.ctrom.CTRom:
+    """
+    Get a new CTRom for the vanilla ROM that the caller is free to modify.
+    This is the only per-seed copy of the ROM data.
+    """
+    base_rom = _cache.get('base_rom', _load_base_rom)
+    return ctrando.common.ctrom.CTRom(base_rom[:])
+
+
+def preload():
+    """
+    Load all artifacts.  Meant to be called once before forking workers.
+
+    The prepatched pickles are read by the randomizer itself from their paths,
+    so they are only mapped here to keep them in the page cache and to fail
+    early if tools/prepatch_rom.py has not been run.
+    """
+    get_vanilla_rom()
+    _cache.get('base_rom', _load_base_rom)
+    for name, path in (('post_config', settings.RDI_POST_CONFIG_PATH),
+                       ('prepatched_rom', settings.RDI_PREPATCHED_ROM_PATH)):
+        _cache.get(name, functools.partial(_map_file, path))
+
+    logger.info('Preloaded generator artifacts: %s', stats())
+
+
+def stats() -> dict[str, dict[str, int]]:
+    return _cache.stats()
@@ -0,0 +1,152 @@
+"""
+Async variants of the generator views for the ASGI server.
+
+Under ASGI the server reads request bodies (including uploaded settings
+files) on the event loop before a view runs, so a slow client only holds
+a connection rather than a worker.  These views keep the rest of the
+request off the threads as well:
+
+  - the cached pages and presets are already in memory, so those views
+    run on the event loop.
+  - views with blocking work (parsing settings, the admission database,
+    writing job files) run it in a pool of RDI_ASYNC_THREADS threads.  The
+    seed itself is still generated and patched in the randomizer worker
+    pool (see jobs.py).
+  - zip downloads are streamed in chunks read by the thread pool.  Django
+    would otherwise read a sync FileResponse into memory before sending it.
+
+Each view subclasses its sync version in views.py and reuses its code.
+urls.py serves these when RDI_ASYNC_VIEWS is set, which rdi/asgi.py does.
+"""
+
+from django.conf import settings
+from django.http import FileResponse
+
+from asgiref.sync import sync_to_async
+
+from . import pagecache, views
+
+import concurrent.futures
+import threading
+
+# Size of the chunks downloads are read in
+_CHUNK_SIZE = 64 * 1024
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor() -> concurrent.futures.ThreadPoolExecutor:
+    """
+    Get this process's thread pool for blocking view work
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=settings.RDI_ASYNC_THREADS,
+                thread_name_prefix='rdi-view')
+        return _executor
+
+
+async def run_blocking(func, *args, **kwargs):
+    """
+    Run a blocking function in the thread pool
+    """
+    return await sync_to_async(
+        func, thread_sensitive=False, executor=get_executor())(*args, **kwargs)
+
+
+async def _read_chunks(file):
+    while chunk := await run_blocking(file.read, _CHUNK_SIZE):
+        yield chunk
+
+
+def stream_async(response):
+    """
+    Make a file response read its file in the thread pool while it's sent.
+    Other responses are returned as is.
+    """
+    if isinstance(response, FileResponse) and response.file_to_stream:
+        # The file is still closed with the response
+        response.streaming_content = _read_chunks(response.file_to_stream)
+
+    return response
+
+
+class IndexView(views.IndexView):
+    @classmethod
+    async def get(cls, request):
+        return pagecache.render_page(
+            request, cls.template_name, cls.get_context_data)
+
+
+class TomlFormView(views.TomlFormView):
+    @classmethod
+    async def get(cls, request):
+        return pagecache.render_page(
+            request, cls.template_name, cls.get_context_data)
+
+
+class FetchPresetView(views.FetchPresetView):
+    @classmethod
+    async def get(cls, request, preset_id):
+        return super().get(request, preset_id)
+
+
+class ThreadedFormMixin:
+    """
+    Run a form view's handlers in the thread pool
+    """
+
+    async def get(self, request, *args, **kwargs):
+        return stream_async(
+            await run_blocking(super().get, request, *args, **kwargs))
+
+    async def post(self, request, *args, **kwargs):
+        return stream_async(
+            await run_blocking(super().post, request, *args, **kwargs))
+
+    async def put(self, request, *args, **kwargs):
+        return await self.post(request, *args, **kwargs)
+
+
+class TomlGenView(ThreadedFormMixin, views.TomlGenView):
+    pass
+
+
+class GenerateView(ThreadedFormMixin, views.GenerateView):
+    pass
+
+
+class BatchGenerateView(ThreadedFormMixin, views.BatchGenerateView):
+    pass
+
+
+class RepersonalizeView(ThreadedFormMixin, views.RepersonalizeView):
+    pass
+
+
+class ValidateSettingsView(views.ValidateSettingsView):
+    @classmethod
+    async def post(cls, request):
+        # The schema may still need to be loaded from disk
+        return await run_blocking(super().post, request)
+
+
+class JobStatusView(views.JobStatusView):
+    @classmethod
+    async def get(cls, request, job_id):
+        return await run_blocking(super().get, request, job_id)
+
+
+class JobDownloadView(views.JobDownloadView):
+    @classmethod
+    async def get(cls, request, job_id):
+        return stream_async(await run_blocking(super().get, request, job_id))
+
+
+class MetricsView(views.MetricsView):
+    @classmethod
+    async def get(cls, request):
+        return await run_blocking(super().get, request)
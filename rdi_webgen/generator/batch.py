@@ -0,0 +1,169 @@
+"""
+Batch seed generation for race organizers.
+
+A batch is one set of settings and a list of seed values.  The settings are
+parsed once and the parsed object is sent to the randomizer worker pool for
+each seed, so a batch doesn't re-parse the settings per seed.  Results are
+written into one zip as they arrive, each seed in its own folder, followed
+by a manifest.json describing the batch.
+"""
+
+from django.conf import settings as django_settings
+
+from . import archive, patchformats, resultcache, seedgen, workerpool
+
+import concurrent.futures
+import functools
+import hashlib
+import json
+import secrets
+import threading
+import time
+import typing
+from zipfile import ZipFile
+
+MANIFEST_NAME = 'manifest.json'
+RESULT_NAME = 'ct-mod-batch.zip'
+
+
+def parse_seeds(seed_text: str) -> list[str]:
+    """
+    Split a comma or whitespace separated list of seed values
+    """
+    return [seed for seed in seed_text.replace(',', ' ').split() if seed]
+
+
+def make_seeds(count: int) -> list[str]:
+    """
+    Make a list of random seed values
+    """
+    return [secrets.token_hex(6) for _ in range(count)]
+
+
+def check_seeds(seeds: list[str]):
+    """
+    Raise ValueError if a list of seeds can't be used for a batch
+    """
+    if not seeds:
+        raise ValueError('A batch needs at least one seed')
+    if len(seeds) > django_settings.RDI_BATCH_MAX_SEEDS:
+        raise ValueError(
+            f'A batch can have at most {django_settings.RDI_BATCH_MAX_SEEDS} '
+            f'seeds')
+    if len(set(seeds)) != len(seeds):
+        raise ValueError('Seeds in a batch must be unique')
+    for seed in seeds:
+        if '/' in seed or '\\' in seed or seed in ('.', '..'):
+            raise ValueError(f'Invalid seed: {seed}')
+
+
+def prepare_settings(
+        settings_dict: dict[str, typing.Any],
+        personal_settings):
+    """
+    Parse the settings for a batch.  The seed comes from the batch, so any
+    seed in the settings is dropped.
+    """
+    settings_dict = dict(settings_dict)
+    settings_dict.pop(resultcache.SEED_KEY, None)
+    settings_dict['input_file'] = django_settings.RDI_VANILLA_ROM_PATH
+
+    try:
+        return seedgen.extract_settings(settings_dict, personal_settings)
+    except ValueError as ve:
+        raise ValueError(f'Invalid args: {str(ve)}')
+
+
+class BatchWriter:
+    """
+    Write the seeds of a batch into a zip as they finish
+    """
+
+    def __init__(self, file: typing.BinaryIO, seeds: list[str],
+                 settings_dict: dict[str, typing.Any],
+                 patch_format: typing.Optional[str] = None):
+        self.patch_format = patchformats.get(patch_format)
+        self._zip_file = ZipFile(file, 'w')
+        self._lock = threading.Lock()
+        self._pending = len(seeds)
+        self.manifest = {
+            'ctrando_version': seedgen.get_ctrando_version(),
+            'created': time.time(),
+            'settings': settings_dict,
+            'patch_format': self.patch_format.name,
+            'seeds': {seed: None for seed in seeds},
+        }
+
+    @property
+    def done(self) -> bool:
+        return self._pending == 0
+
+    @property
+    def completed(self) -> int:
+        return len(self.manifest['seeds']) - self._pending
+
+    @property
+    def failed(self) -> int:
+        return sum(1 for entry in self.manifest['seeds'].values()
+                   if entry is not None and 'error' in entry)
+
+    def add(self, seed: str, future: concurrent.futures.Future) -> bool:
+        """
+        Add a finished seed to the zip.  Returns True once every seed is in
+        and the zip has been finalized.
+        """
+        try:
+            patch_data, spoiler_text, timings = future.result()
+        except workerpool.WorkerTimeout:
+            entry = {'error': 'Seed generation timed out'}
+        except Exception as ex:
+            entry = {'error': str(ex)}
+        else:
+            entry = {
+                'patch': f'{seed}/{self.patch_format.patch_name}',
+                'spoiler': f'{seed}/{archive.SPOILER_NAME}',
+                'patch_sha256': hashlib.sha256(patch_data).hexdigest(),
+                'timings': timings,
+            }
+
+        with self._lock:
+            if 'error' not in entry:
+                archive.write_entry(self._zip_file, entry['patch'], patch_data)
+                archive.write_entry(
+                    self._zip_file, entry['spoiler'], spoiler_text)
+            self.manifest['seeds'][seed] = entry
+            self._pending -= 1
+
+            if self._pending == 0:
+                archive.write_entry(
+                    self._zip_file, MANIFEST_NAME,
+                    json.dumps(self.manifest, indent=2, default=str))
+                self._zip_file.close()
+                return True
+
+        return False
+
+
+def submit(
+        pool: workerpool.RandomizerPool,
+        settings,
+        seeds: list[str],
+        patch_format: str,
+        on_seed_done: typing.Callable[[str, concurrent.futures.Future], None],
+        on_start: typing.Optional[typing.Callable[[str], None]] = None
+) -> list[concurrent.futures.Future]:
+    """
+    Queue every seed of a batch on a worker pool.  on_start is called with
+    the seed when a worker picks it up and on_seed_done with the seed and
+    its future when it's done.
+    """
+    futures = []
+    for seed in seeds:
+        future = pool.submit(
+            seedgen.generate_batch_seed, settings, seed, patch_format,
+            on_start=None if on_start is None
+            else functools.partial(on_start, seed))
+        future.add_done_callback(functools.partial(on_seed_done, seed))
+        futures.append(future)
+
+    return futures
@@ -0,0 +1,397 @@
+"""
+Pure python BPS patch creation and application.
+
+The generator used to shell out to flips for every seed.  This module builds
+BPS patches directly from in-memory buffers so the output ROM never has to
+touch the disk.  The encoder is linear: it walks the source and target in
+lockstep, emitting SourceRead actions for unchanged regions and TargetRead
+actions for changed ones.  Long runs of a single byte in the changed data are
+encoded as overlapping TargetCopy actions.
+
+In delta mode the changed data is also searched for blocks that exist
+elsewhere in the source (data the randomizer moved rather than changed),
+which are encoded as SourceCopy actions instead of being stored in the
+patch.
+
+Format reference: https://www.romhacking.net/documents/746/
+"""
+
+import mmap
+import re
+import threading
+import typing
+import zlib
+
+BPS_MAGIC = b'BPS1'
+
+# BPS action types
+SOURCE_READ = 0
+TARGET_READ = 1
+SOURCE_COPY = 2
+TARGET_COPY = 3
+
+# Block sizes used to narrow down changed regions.  Equal blocks are skipped
+# with a single slice comparison, which keeps the scan cheap for ROMs where
+# most of the data is unchanged.
+_SCAN_BLOCK_SIZES = (4096, 256, 16)
+
+# Unchanged runs shorter than this are folded into the surrounding TargetRead
+# since the extra action headers would cost more than the bytes themselves.
+_MIN_SOURCE_READ = 4
+
+# Runs of a repeated byte at least this long are encoded as a TargetCopy
+_RLE_PATTERN = re.compile(rb'(.)\1{7,}', re.DOTALL)
+
+# Delta mode indexes the source in blocks of this size.  Any moved data at
+# least twice this long contains a whole indexed block, so it is found.
+_DELTA_BLOCK_SIZE = 32
+
+
+def _encode_number(value: int, buffer: bytearray):
+    """
+    Append a BPS variable length integer to the buffer
+    """
+    while True:
+        low_bits = value & 0x7F
+        value >>= 7
+        if value == 0:
+            buffer.append(0x80 | low_bits)
+            break
+        buffer.append(low_bits)
+        value -= 1
+
+
+def _decode_number(data, pos: int) -> tuple[int, int]:
+    """
+    Read a BPS variable length integer.  Returns the value and the new offset.
+    """
+    value = 0
+    shift = 1
+    while True:
+        if pos >= len(data):
+            raise ValueError('Truncated BPS patch')
+        byte = data[pos]
+        pos += 1
+        value += (byte & 0x7F) * shift
+        if byte & 0x80:
+            return value, pos
+        shift <<= 7
+        value += shift
+
+
+def find_changed_ranges(
+        source: bytes,
+        target: bytes,
+        length: int) -> list[list[int]]:
+    """
+    Get a list of [start, end) ranges where the source and target differ
+    within the first length bytes.
+    """
+    ranges = []
+
+    def add_changed_byte(pos: int):
+        if ranges and pos - ranges[-1][1] < _MIN_SOURCE_READ:
+            ranges[-1][1] = pos + 1
+        else:
+            ranges.append([pos, pos + 1])
+
+    def scan(start: int, end: int, level: int):
+        size = _SCAN_BLOCK_SIZES[level]
+        for block_start in range(start, end, size):
+            block_end = min(block_start + size, end)
+            if source[block_start:block_end] == target[block_start:block_end]:
+                continue
+
+            if level + 1 < len(_SCAN_BLOCK_SIZES):
+                scan(block_start, block_end, level + 1)
+            else:
+                for pos in range(block_start, block_end):
+                    if source[pos] != target[pos]:
+                        add_changed_byte(pos)
+
+    scan(0, length, 0)
+    return ranges
+
+
+def _match_length(source, source_pos: int, target: bytes, target_pos: int,
+                  target_end: int) -> int:
+    """
+    Count the bytes that match between source[source_pos:] and
+    target[target_pos:target_end]
+    """
+    limit = min(target_end - target_pos, len(source) - source_pos)
+    length = 0
+    # Skip over equal chunks, then find the first difference in the chunk
+    # that doesn't match
+    for size in _SCAN_BLOCK_SIZES + (1,):
+        while length + size <= limit \
+                and source[source_pos + length:source_pos + length + size] \
+                == target[target_pos + length:target_pos + length + size]:
+            length += size
+    return length
+
+
+class _SourceIndex:
+    """
+    Index of the source's blocks for finding moved data.  The blocks are
+    keyed by their hash so the index doesn't hold a copy of the source.
+    """
+
+    def __init__(self, source):
+        self.source = source
+        self.blocks: dict[int, int] = {}
+        size = _DELTA_BLOCK_SIZE
+        for offset in range(0, len(source) - size + 1, size):
+            block = source[offset:offset + size]
+            # Blocks of a single repeated byte are cheaper as a TargetCopy
+            if block.count(block[:1]) == size:
+                continue
+            self.blocks.setdefault(hash(block), offset)
+
+    def find(self, block: bytes) -> typing.Optional[int]:
+        """
+        Get the source offset of a block, or None if it isn't in the source
+        """
+        offset = self.blocks.get(hash(block))
+        if offset is None \
+                or self.source[offset:offset + len(block)] != block:
+            return None
+        return offset
+
+
+# The source is almost always the vanilla ROM, so keep the index of the
+# last source around.  Keyed by the source's size and CRC.
+_source_index: typing.Optional[tuple[tuple[int, int], _SourceIndex]] = None
+_source_index_lock = threading.Lock()
+
+
+def _get_source_index(source, source_crc: int) -> _SourceIndex:
+    global _source_index
+    key = (len(source), source_crc)
+    with _source_index_lock:
+        if _source_index is None or _source_index[0] != key:
+            _source_index = (key, _SourceIndex(source))
+        return _source_index[1]
+
+
+class _PatchWriter:
+    """
+    Helper to track output state while writing BPS actions
+    """
+
+    def __init__(self, target: bytes,
+                 source_index: typing.Optional[_SourceIndex] = None):
+        self.target = target
+        self.source_index = source_index
+        self.buffer = bytearray()
+        self.source_relative_offset = 0
+        self.target_relative_offset = 0
+
+    def write_action(self, action: int, length: int):
+        _encode_number(((length - 1) << 2) | action, self.buffer)
+
+    def source_read(self, length: int):
+        self.write_action(SOURCE_READ, length)
+
+    def target_read(self, start: int, end: int):
+        self.write_action(TARGET_READ, end - start)
+        self.buffer += self.target[start:end]
+
+    def source_copy(self, copy_from: int, length: int):
+        self.write_action(SOURCE_COPY, length)
+        relative = copy_from - self.source_relative_offset
+        _encode_number((abs(relative) << 1) | (relative < 0), self.buffer)
+        self.source_relative_offset = copy_from + length
+
+    def target_copy(self, copy_from: int, length: int):
+        self.write_action(TARGET_COPY, length)
+        relative = copy_from - self.target_relative_offset
+        _encode_number((abs(relative) << 1) | (relative < 0), self.buffer)
+        self.target_relative_offset = copy_from + length
+
+    def write_literal(self, start: int, end: int):
+        """
+        Write target[start:end], copying any blocks found in the source
+        when running in delta mode
+        """
+        if self.source_index is None:
+            self.target_read(start, end)
+            return
+
+        source = self.source_index.source
+        target = self.target
+        size = _DELTA_BLOCK_SIZE
+        pos = start
+        scan = start
+        while scan + size <= end:
+            copy_from = self.source_index.find(target[scan:scan + size])
+            if copy_from is None:
+                scan += 1
+                continue
+
+            # Grow the match in both directions
+            match_start = scan
+            while match_start > pos and copy_from > 0 \
+                    and source[copy_from - 1] == target[match_start - 1]:
+                match_start -= 1
+                copy_from -= 1
+            match_end = scan + size
+            match_end += _match_length(
+                source, copy_from + (match_end - match_start),
+                target, match_end, end)
+
+            if match_start > pos:
+                self.target_read(pos, match_start)
+            self.source_copy(copy_from, match_end - match_start)
+            pos = match_end
+            scan = match_end
+
+        if pos < end:
+            self.target_read(pos, end)
+
+    def write_target_data(self, start: int, end: int):
+        """
+        Write target[start:end] using TargetRead actions, with repeated
+        byte runs stored as overlapping TargetCopy actions.
+        """
+        pos = start
+        for match in _RLE_PATTERN.finditer(self.target, start, end):
+            run_start, run_end = match.span()
+            # The first byte of the run is read as data and the rest of the
+            # run is copied from the byte before it.
+            self.write_literal(pos, run_start + 1)
+            self.target_copy(run_start, run_end - run_start - 1)
+            pos = run_end
+
+        if pos < end:
+            self.write_literal(pos, end)
+
+
+def create_patch(
+        source, target, metadata: bytes = b'', delta: bool = False) -> bytes:
+    """
+    Create a BPS patch that converts source into target.
+
+    Both source and target can be any bytes-like object, such as the
+    buffer returned by BytesIO.getbuffer().  An mmap source is used in place
+    rather than copied.
+
+    With delta set, changed data that also exists elsewhere in the source is
+    copied from the source.  This makes a smaller patch at the cost of a
+    slower encode.
+    """
+    if not isinstance(source, mmap.mmap):
+        source = bytes(source)
+    target = bytes(target)
+    source_crc = zlib.crc32(source)
+
+    source_index = None
+    if delta:
+        source_index = _get_source_index(source, source_crc)
+    writer = _PatchWriter(target, source_index)
+    header = writer.buffer
+    header += BPS_MAGIC
+    _encode_number(len(source), header)
+    _encode_number(len(target), header)
+    _encode_number(len(metadata), header)
+    header += metadata
+
+    common_length = min(len(source), len(target))
+    output_offset = 0
+    for start, end in find_changed_ranges(source, target, common_length):
+        if start > output_offset:
+            writer.source_read(start - output_offset)
+        writer.write_target_data(start, end)
+        output_offset = end
+
+    if output_offset < common_length:
+        writer.source_read(common_length - output_offset)
+        output_offset = common_length
+
+    if output_offset < len(target):
+        # The target is larger than the source.  Anything past the end of
+        # the source has to be written as target data.
+        writer.write_target_data(output_offset, len(target))
+
+    patch = writer.buffer
+    patch += source_crc.to_bytes(4, 'little')
+    patch += zlib.crc32(target).to_bytes(4, 'little')
+    patch += zlib.crc32(patch).to_bytes(4, 'little')
+
+    return bytes(patch)
+
+
+def apply_patch(source, patch) -> bytes:
+    """
+    Apply a BPS patch to the source data and return the target data.
+
+    Raises a ValueError if the patch is malformed or the checksums do
+    not match.
+    """
+    source = bytes(source)
+    patch = bytes(patch)
+
+    if len(patch) < len(BPS_MAGIC) + 12 or not patch.startswith(BPS_MAGIC):
+        raise ValueError('Not a BPS patch')
+
+    footer_start = len(patch) - 12
+    source_crc = int.from_bytes(patch[footer_start:footer_start + 4], 'little')
+    target_crc = int.from_bytes(patch[footer_start + 4:footer_start + 8], 'little')
+    patch_crc = int.from_bytes(patch[footer_start + 8:], 'little')
+
+    if zlib.crc32(patch[:footer_start + 8]) != patch_crc:
+        raise ValueError('BPS patch checksum mismatch')
+    if zlib.crc32(source) != source_crc:
+        raise ValueError('Source data does not match the BPS patch')
+
+    pos = len(BPS_MAGIC)
+    source_size, pos = _decode_number(patch, pos)
+    target_size, pos = _decode_number(patch, pos)
+    metadata_size, pos = _decode_number(patch, pos)
+    pos += metadata_size
+
+    if source_size != len(source):
+        raise ValueError('Source size does not match the BPS patch')
+
+    target = bytearray(target_size)
+    output_offset = 0
+    source_relative_offset = 0
+    target_relative_offset = 0
+
+    while pos < footer_start:
+        data, pos = _decode_number(patch, pos)
+        action = data & 3
+        length = (data >> 2) + 1
+        if output_offset + length > target_size:
+            raise ValueError('BPS action writes past the end of the target')
+
+        if action == SOURCE_READ:
+            target[output_offset:output_offset + length] = \
+                source[output_offset:output_offset + length]
+        elif action == TARGET_READ:
+            target[output_offset:output_offset + length] = \
+                patch[pos:pos + length]
+            pos += length
+        else:
+            offset, pos = _decode_number(patch, pos)
+            relative = -(offset >> 1) if offset & 1 else offset >> 1
+            if action == SOURCE_COPY:
+                source_relative_offset += relative
+                target[output_offset:output_offset + length] = \
+                    source[source_relative_offset:source_relative_offset + length]
+                source_relative_offset += length
+            else:
+                target_relative_offset += relative
+                # Target copies can overlap the data being written, so they
+                # have to be applied one byte at a time.
+                for i in range(length):
+                    target[output_offset + i] = target[target_relative_offset + i]
+                target_relative_offset += length
+        output_offset += length
+
+    if output_offset != target_size:
+        raise ValueError('BPS patch did not fill the target')
+    if zlib.crc32(target) != target_crc:
+        raise ValueError('Target data does not match the BPS patch')
+
+    return bytes(target)
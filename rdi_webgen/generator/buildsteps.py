@@ -0,0 +1,310 @@
+"""
+Build steps run before the webapp starts serving.
+
+These cover the autogenerated toml form and preset buttons, the prepatched
+ROM objects, the database migrations (except in the stateless profile), the
+vendored third-party scripts and styles and the static files.  Each step
+lists the steps it depends on, so independent steps can run at the same
+time (see the startup management command).
+
+Each step also records a hash of its inputs (ROM bytes, randomizer
+version, preset files, tool sources, ...) in a build manifest.  A step is
+skipped when its inputs haven't changed since it last ran and its outputs
+still exist.
+
+Step actions run in worker processes, so they are module level functions.
+"""
+
+from django.conf import settings
+from django.core.management import call_command
+
+import dataclasses
+import glob
+import hashlib
+import importlib.metadata
+import importlib.resources
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import typing
+
+AUTOGEN_HTML_PATH = 'generator/templates/generator/toml_gen'
+VENDOR_STATIC_PATH = 'generator/static/generator/vendor'
+
+
+def get_package_fingerprint(name: str) -> str:
+    """
+    Identify an installed package by its version and the hashes of its
+    installed files, so a reinstall of the same version with different
+    contents is still noticed.
+    """
+    try:
+        dist = importlib.metadata.distribution(name)
+    except importlib.metadata.PackageNotFoundError:
+        return 'not installed'
+
+    record = dist.read_text('RECORD') or ''
+    return f'{dist.version}:{hashlib.sha256(record.encode()).hexdigest()}'
+
+
+def get_preset_files() -> list[str]:
+    """
+    Get the preset files installed with the randomizer
+    """
+    try:
+        presets = importlib.resources.files('ctrando.arguments.presets')
+    except ModuleNotFoundError:
+        return []
+
+    return sorted(
+        str(path) for path in presets.iterdir()
+        if path.name.endswith('.toml'))
+
+
+def hash_inputs(files: typing.Iterable[str], values: typing.Iterable[str]) -> str:
+    """
+    Hash the contents of a set of files (or directories) and some values
+    """
+    input_hash = hashlib.sha256()
+    paths = []
+    for path in files:
+        if os.path.isdir(path):
+            for root, dirs, names in os.walk(path):
+                dirs.sort()
+                paths.extend(os.path.join(root, name) for name in sorted(names))
+        else:
+            paths.append(path)
+
+    for path in paths:
+        input_hash.update(path.encode() + b'\0')
+        try:
+            with open(path, 'rb') as file:
+                for chunk in iter(lambda: file.read(1024 * 1024), b''):
+                    input_hash.update(chunk)
+        except FileNotFoundError:
+            input_hash.update(b'missing')
+        input_hash.update(b'\0')
+
+    for value in values:
+        input_hash.update(value.encode() + b'\0')
+
+    return input_hash.hexdigest()
+
+
+def get_tool_path(name: str) -> str:
+    return os.path.join(settings.RDI_TOOLS_DIR, name)
+
+
+def run_tool(name: str, *args: str, cwd: typing.Optional[str] = None):
+    """
+    Run one of the scripts in the tools directory
+    """
+    subprocess.run(
+        [sys.executable, os.path.abspath(get_tool_path(name)), *args],
+        check=True, cwd=cwd)
+
+
+def build_toml_form():
+    """
+    Autogenerate the toml generator python form code and arg schema
+    """
+    # The tool writes to form_gen_output in the working directory, so give
+    # it a directory of its own
+    with tempfile.TemporaryDirectory() as work_dir:
+        run_tool('create_toml_gen_form.py', cwd=work_dir)
+        output_dir = os.path.join(work_dir, 'form_gen_output')
+
+        # Copy over the auto-generated python form file and arg schema
+        shutil.copy(os.path.join(output_dir, 'toml_gen_form.py'), 'generator/')
+        shutil.copy(os.path.join(output_dir, 'arg_schema.json'), 'generator/')
+
+
+def build_preset_buttons():
+    """
+    Autogenerate the preset buttons based on available preset files
+    """
+    with tempfile.TemporaryDirectory() as work_dir:
+        run_tool('create_preset_buttons.py', cwd=work_dir)
+        os.makedirs(AUTOGEN_HTML_PATH, exist_ok=True)
+        shutil.copy(os.path.join(work_dir, 'preset_buttons.html'),
+                    AUTOGEN_HTML_PATH)
+
+
+def vendor_static():
+    """
+    Bundle the third-party scripts and styles into the static files.  The
+    Docker image already has them, so this only downloads anything when the
+    pinned versions change.
+    """
+    run_tool('vendor_static.py', VENDOR_STATIC_PATH)
+
+
+def build_post_config():
+    """
+    Save the open world post config for the base ROM
+    """
+    run_tool('prepatch_rom.py', '--part', 'post_config',
+             '--rom', settings.RDI_VANILLA_ROM_PATH,
+             '--post-config', settings.RDI_POST_CONFIG_PATH)
+
+
+def build_prepatched_rom():
+    """
+    Save the ROM with the base patch applied.  This lets seed generation
+    skip applying the base patch.
+    """
+    run_tool('prepatch_rom.py', '--part', 'prepatched_rom',
+             '--rom', settings.RDI_VANILLA_ROM_PATH,
+             '--prepatched-rom', settings.RDI_PREPATCHED_ROM_PATH)
+
+
+def migrate():
+    call_command('migrate', interactive=False)
+
+
+def collect_static():
+    call_command('collectstatic', interactive=False, clear=True)
+
+
+def check():
+    """
+    Run Django's system checks.  This imports the URLs and views, so it
+    also catches a broken autogenerated form.
+    """
+    call_command('check')
+
+
+@dataclasses.dataclass
+class Step:
+    name: str
+    action: typing.Callable[[], None]
+    # Functions returning the input files and values to hash
+    input_files: typing.Callable[[], list[str]]
+    input_values: typing.Callable[[], list[str]]
+    outputs: list[str]
+    depends_on: list[str] = dataclasses.field(default_factory=list)
+    # Steps without outputs run on every start
+    always_run: bool = False
+
+    def get_input_hash(self) -> str:
+        return hash_inputs(self.input_files(), self.input_values())
+
+    def outputs_exist(self) -> bool:
+        return all(os.path.exists(path) for path in self.outputs)
+
+
+def _ctrando_fingerprint() -> list[str]:
+    return [get_package_fingerprint('ctrando')]
+
+
+def _django_fingerprint() -> list[str]:
+    return [get_package_fingerprint('Django')]
+
+
+def _static_settings() -> list[str]:
+    """
+    The resolved settings collectstatic depends on.  RDI_STATIC_MANIFEST and
+    RDI_STATELESS change them through the environment, which hashing
+    rdi/settings.py doesn't see.
+    """
+    return _django_fingerprint() + [
+        json.dumps(settings.STORAGES, sort_keys=True, default=str),
+        json.dumps(list(settings.INSTALLED_APPS)),
+        str(settings.STATIC_ROOT),
+    ]
+
+
+def _migrate_settings() -> list[str]:
+    return _django_fingerprint() + [json.dumps(list(settings.INSTALLED_APPS))]
+
+
+def get_steps() -> list[Step]:
+    """
+    Get every startup build step
+    """
+    steps = [
+        Step(
+            name='toml_form',
+            action=build_toml_form,
+            input_files=lambda: [get_tool_path('create_toml_gen_form.py')],
+            input_values=_ctrando_fingerprint,
+            outputs=[
+                'generator/toml_gen_form.py',
+                'generator/arg_schema.json',
+            ]),
+        Step(
+            name='preset_buttons',
+            action=build_preset_buttons,
+            input_files=lambda: [get_tool_path('create_preset_buttons.py')]
+            + get_preset_files(),
+            input_values=_ctrando_fingerprint,
+            outputs=[os.path.join(AUTOGEN_HTML_PATH, 'preset_buttons.html')]),
+        Step(
+            name='post_config',
+            action=build_post_config,
+            input_files=lambda: [
+                settings.RDI_VANILLA_ROM_PATH, get_tool_path('prepatch_rom.py')],
+            input_values=_ctrando_fingerprint,
+            outputs=[settings.RDI_POST_CONFIG_PATH]),
+        Step(
+            name='prepatched_rom',
+            action=build_prepatched_rom,
+            input_files=lambda: [
+                settings.RDI_VANILLA_ROM_PATH, get_tool_path('prepatch_rom.py')],
+            input_values=_ctrando_fingerprint,
+            outputs=[settings.RDI_PREPATCHED_ROM_PATH]),
+        Step(
+            name='vendor_static',
+            action=vendor_static,
+            input_files=lambda: [get_tool_path('vendor_static.py')],
+            input_values=lambda: [],
+            outputs=[
+                os.path.join(VENDOR_STATIC_PATH, name)
+                for name in ('vendor.js', 'vendor.css', 'smol-toml.js')
+            ]),
+        Step(
+            name='collectstatic',
+            action=collect_static,
+            input_files=lambda: glob.glob('*/static') + ['rdi/settings.py'],
+            input_values=_static_settings,
+            outputs=[str(settings.STATIC_ROOT)],
+            depends_on=['vendor_static']),
+        Step(
+            name='check',
+            action=check,
+            input_files=lambda: [],
+            input_values=lambda: [],
+            outputs=[],
+            depends_on=['toml_form', 'preset_buttons'],
+            always_run=True),
+    ]
+
+    # The stateless profile has no database
+    if not settings.RDI_STATELESS:
+        steps.append(Step(
+            name='migrate',
+            action=migrate,
+            input_files=lambda: glob.glob('*/migrations/*.py')
+            + ['rdi/settings.py'],
+            input_values=_migrate_settings,
+            outputs=[str(settings.DATABASES['default']['NAME'])]))
+
+    return steps
+
+
+def load_manifest() -> dict[str, dict[str, typing.Any]]:
+    try:
+        with open(settings.RDI_BUILD_MANIFEST) as file:
+            return json.load(file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def save_manifest(manifest: dict[str, dict[str, typing.Any]]):
+    path = settings.RDI_BUILD_MANIFEST
+    with open(f'{path}.tmp', 'w') as file:
+        json.dump(manifest, file, indent=2)
+    os.replace(f'{path}.tmp', path)
@@ -1,4 +1,7 @@
 from django import forms
+from django.conf import settings
+
+from . import patchformats
 
 
 class GeneratorForm(forms.Form):
@@ -8,4 +11,25 @@ class GeneratorForm(forms.Form):
     settings_file = forms.FileField(required=False)
     personalization_file = forms.FileField(required=False)
     preset_file = forms.CharField(max_length=50, required=False)
+    patch_format = forms.ChoiceField(
+        choices=patchformats.get_choices, required=False,
+        initial=lambda: settings.RDI_PATCH_FORMAT)
+
+
+class BatchGeneratorForm(GeneratorForm):
+    """
+    Form class for a batch of seeds with the same settings.  Either list the
+    seeds or give a count of random seeds to generate.
+    """
+    seeds = forms.CharField(required=False)
+    count = forms.IntegerField(required=False, min_value=1)
+
 
+class RepersonalizeForm(forms.Form):
+    """
+    Form class for applying a personalization file to an earlier seed
+    """
+    personalization_file = forms.FileField()
+    patch_format = forms.ChoiceField(
+        choices=patchformats.get_choices, required=False,
+        initial=lambda: settings.RDI_PATCH_FORMAT)
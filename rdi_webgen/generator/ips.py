@@ -0,0 +1,132 @@
+"""
+IPS patch creation and application.
+
+IPS is older and simpler than BPS: a list of (offset, data) records with no
+checksums and no way to reference the source.  Offsets are 24 bit, so it
+only works for ROMs up to 16 MiB, and it can't shrink the ROM.  Runs of a
+single byte are stored as RLE records.
+
+Format reference: https://zerosoft.zophar.net/ips.php
+"""
+
+from . import bps
+
+import re
+
+IPS_MAGIC = b'PATCH'
+IPS_EOF = b'EOF'
+
+# Largest ROM an IPS patch can address
+MAX_SIZE = 0x1000000
+# Largest amount of data in a single record
+_MAX_RECORD = 0xFFFF
+# A record at this offset would be read as the end of file marker
+_EOF_OFFSET = int.from_bytes(IPS_EOF, 'big')
+
+# Runs of a repeated byte at least this long are stored as RLE records
+_RLE_PATTERN = re.compile(rb'(.)\1{15,}', re.DOTALL)
+
+
+def supports(source, target) -> bool:
+    """
+    Check whether an IPS patch can convert source into target
+    """
+    return len(source) <= len(target) <= MAX_SIZE
+
+
+def _write_data(patch: bytearray, target: bytes, start: int, end: int):
+    while start < end:
+        if start == _EOF_OFFSET:
+            # Start the record a byte early so its offset isn't "EOF"
+            start -= 1
+        record_end = min(end, start + _MAX_RECORD)
+        patch += start.to_bytes(3, 'big')
+        patch += (record_end - start).to_bytes(2, 'big')
+        patch += target[start:record_end]
+        start = record_end
+
+
+def _write_run(patch: bytearray, target: bytes, start: int, end: int):
+    while start < end:
+        if start == _EOF_OFFSET:
+            _write_data(patch, target, start, start + 1)
+            start += 1
+            continue
+        length = min(end - start, _MAX_RECORD)
+        patch += start.to_bytes(3, 'big')
+        patch += b'\0\0'
+        patch += length.to_bytes(2, 'big')
+        patch += target[start:start + 1]
+        start += length
+
+
+def create_patch(source, target) -> bytes:
+    """
+    Create an IPS patch that converts source into target.
+
+    Raises a ValueError if the target is too large for IPS or smaller than
+    the source.
+    """
+    target = bytes(target)
+    if len(target) > MAX_SIZE:
+        raise ValueError('IPS patches are limited to ROMs of 16 MiB')
+    if len(target) < len(source):
+        raise ValueError("IPS patches can't make the ROM smaller")
+
+    ranges = bps.find_changed_ranges(source, target, len(source))
+    if len(target) > len(source):
+        ranges.append([len(source), len(target)])
+
+    patch = bytearray(IPS_MAGIC)
+    for start, end in ranges:
+        pos = start
+        for match in _RLE_PATTERN.finditer(target, start, end):
+            run_start, run_end = match.span()
+            if run_start > pos:
+                _write_data(patch, target, pos, run_start)
+            _write_run(patch, target, run_start, run_end)
+            pos = run_end
+
+        if pos < end:
+            _write_data(patch, target, pos, end)
+
+    patch += IPS_EOF
+    return bytes(patch)
+
+
+def apply_patch(source, patch) -> bytes:
+    """
+    Apply an IPS patch to the source data and return the target data.
+
+    Raises a ValueError if the patch is malformed.
+    """
+    patch = bytes(patch)
+    if not patch.startswith(IPS_MAGIC):
+        raise ValueError('Not an IPS patch')
+
+    target = bytearray(source)
+    pos = len(IPS_MAGIC)
+    while patch[pos:pos + 3] != IPS_EOF:
+        if pos + 5 > len(patch):
+            raise ValueError('Truncated IPS patch')
+        offset = int.from_bytes(patch[pos:pos + 3], 'big')
+        size = int.from_bytes(patch[pos + 3:pos + 5], 'big')
+        pos += 5
+
+        if size == 0:
+            if pos + 3 > len(patch):
+                raise ValueError('Truncated IPS patch')
+            size = int.from_bytes(patch[pos:pos + 2], 'big')
+            data = patch[pos + 2:pos + 3] * size
+            pos += 3
+        else:
+            data = patch[pos:pos + size]
+            if len(data) != size:
+                raise ValueError('Truncated IPS patch')
+            pos += size
+
+        if offset > len(target):
+            target += bytes(offset - len(target))
+        target[offset:offset + size] = data
+
+    return bytes(target)
@@ -0,0 +1,436 @@
+"""
+Asynchronous seed generation jobs.
+
+Each job gets a directory under RDI_JOB_DIR holding a status file and, once
+the job finishes, the zip to send to the user.  Keeping the state on the
+filesystem lets any web worker answer status and download requests for a
+job, no matter which worker queued it.
+
+Jobs run in the randomizer worker pool owned by the web worker that queued
+them (see workerpool.py).  The pool returns the patch and spoiler log and
+the zip is written here, in the web worker.
+
+A single seed job also stores the seed's config in its directory, so a
+later job can re-personalize the seed without randomizing it again.
+"""
+
+from django.conf import settings
+
+from . import (
+    admission, archive, batch, patchformats, resultcache, seedgen, timing,
+    workerpool)
+
+import concurrent.futures
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+import typing
+import uuid
+
+logger = logging.getLogger(__name__)
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+STATUS_FILE = 'status.json'
+RESULT_FILE = 'ct-mod.zip'
+CONFIG_FILE = 'config.pkl'
+
+# Monotonic time this process last pruned old jobs
+_last_prune: typing.Optional[float] = None
+_prune_lock = threading.Lock()
+
+
+def get_job_dir(job_id: str) -> str:
+    return os.path.join(settings.RDI_JOB_DIR, job_id)
+
+
+def get_result_path(job_id: str) -> str:
+    return os.path.join(get_job_dir(job_id), RESULT_FILE)
+
+
+def get_config_path(job_id: str) -> str:
+    return os.path.join(get_job_dir(job_id), CONFIG_FILE)
+
+
+def has_config(job_id: str) -> bool:
+    """
+    Check whether a job's seed can be re-personalized
+    """
+    return os.path.exists(get_config_path(job_id))
+
+
+def _link_file(source_path: str, path: str):
+    """
+    Share a file with a job's directory, or copy it if it can't be linked
+    """
+    try:
+        os.link(source_path, path)
+    except OSError:
+        shutil.copyfile(source_path, path)
+
+
+def _write_status(job_id: str, state: str, **kwargs):
+    """
+    Atomically replace the status file for a job
+    """
+    status = {
+        'state': state,
+        'updated': time.time(),
+    }
+    status.update(kwargs)
+
+    status_path = os.path.join(get_job_dir(job_id), STATUS_FILE)
+    temp_path = f'{status_path}.{os.getpid()}.tmp'
+    with open(temp_path, 'w') as file:
+        json.dump(status, file)
+    os.replace(temp_path, status_path)
+
+
+def get_status(job_id: str) -> typing.Optional[dict[str, typing.Any]]:
+    """
+    Get the status of a job, or None if the job doesn't exist
+    """
+    try:
+        with open(os.path.join(get_job_dir(job_id), STATUS_FILE)) as file:
+            return json.load(file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def get_download_name(status: dict[str, typing.Any]) -> str:
+    """
+    Get the file name to send a job's result as
+    """
+    return status.get('filename', RESULT_FILE)
+
+
+def _write_result(job_id: str, patch_data: bytes, spoiler_text: str,
+                  patch_name: str) -> str:
+    """
+    Write the zip for a finished job and return its path
+    """
+    result_path = get_result_path(job_id)
+    with open(f'{result_path}.tmp', 'wb') as file:
+        archive.write_seed_zip(file, patch_data, spoiler_text, patch_name)
+    os.replace(f'{result_path}.tmp', result_path)
+
+    return result_path
+
+
+def _on_job_finished(
+        job_id: str,
+        cache_key: typing.Optional[str],
+        timer: timing.StageTimer,
+        patch_name: str,
+        future: concurrent.futures.Future):
+    """
+    Store the result of a job once the worker pool is done with it
+    """
+    try:
+        patch_data, spoiler_text, worker_timings = future.result()
+        timer.update(worker_timings)
+        with timer.stage('build_zip'):
+            result_path = _write_result(
+                job_id, patch_data, spoiler_text, patch_name)
+    except workerpool.WorkerTimeout:
+        _write_status(job_id, FAILED, error='Seed generation timed out')
+        return
+    except workerpool.WorkerDied as ex:
+        logger.error('Job %s was interrupted: %s', job_id, ex)
+        _write_status(job_id, FAILED, error='Seed generation was interrupted')
+        return
+    except Exception as ex:
+        _write_status(job_id, FAILED, error=str(ex))
+        return
+
+    _write_status(job_id, DONE, timings=timer.timings)
+    timing.log_timings('seed_generated', timer.timings, job_id=job_id)
+    timing.record(timer.timings)
+
+    if cache_key is not None:
+        config_path = get_config_path(job_id)
+        if not os.path.exists(config_path):
+            config_path = None
+        try:
+            resultcache.put(cache_key, result_path, config_path)
+        except OSError as ex:
+            logger.warning('Failed to cache result for job %s: %s', job_id, ex)
+
+
+def prune_jobs():
+    """
+    Remove jobs older than the retention period
+    """
+    cutoff = time.time() - settings.RDI_JOB_RETENTION
+    try:
+        entries = list(os.scandir(settings.RDI_JOB_DIR))
+    except FileNotFoundError:
+        return
+
+    for entry in entries:
+        try:
+            if entry.is_dir() and entry.stat().st_mtime < cutoff:
+                shutil.rmtree(entry.path, ignore_errors=True)
+        except FileNotFoundError:
+            # Another worker already removed it
+            continue
+
+
+def _prune_jobs_if_due():
+    """
+    Prune old jobs at most once per RDI_JOB_PRUNE_INTERVAL seconds in this
+    process, so new jobs don't scan the whole job directory every time
+    """
+    global _last_prune
+    now = time.monotonic()
+    with _prune_lock:
+        if _last_prune is not None \
+                and now - _last_prune < settings.RDI_JOB_PRUNE_INTERVAL:
+            return
+        _last_prune = now
+
+    prune_jobs()
+
+
+def _create_job(state: str) -> str:
+    """
+    Create the directory and initial status for a new job
+    """
+    _prune_jobs_if_due()
+
+    job_id = str(uuid.uuid4())
+    os.makedirs(get_job_dir(job_id))
+    _write_status(job_id, state)
+
+    return job_id
+
+
+def create_finished(result_path: str,
+                    config_path: typing.Optional[str] = None) -> str:
+    """
+    Create a job that is already done, using an existing zip as its result
+    and the seed's stored config if there is one
+    """
+    job_id = _create_job(QUEUED)
+    _link_file(result_path, get_result_path(job_id))
+    if config_path is not None:
+        try:
+            _link_file(config_path, get_config_path(job_id))
+        except FileNotFoundError:
+            # Evicted from the result cache since it was looked up
+            pass
+    _write_status(job_id, DONE, cached=True)
+
+    return job_id
+
+
+def _submit(job_id: str, fn: typing.Callable, args: tuple,
+            cache_key: typing.Optional[str], timer: timing.StageTimer,
+            patch_format: patchformats.PatchFormat, ticket: str):
+    """
+    Run a single seed job in the worker pool
+    """
+    def on_start():
+        admission.wait_for_slot(ticket)
+        _write_status(job_id, RUNNING)
+
+    future = workerpool.get_pool().submit(fn, *args, on_start=on_start)
+    future.add_done_callback(
+        lambda fut: _on_job_finished(
+            job_id, cache_key, timer, patch_format.patch_name, fut))
+    future.add_done_callback(lambda fut: admission.release(ticket))
+
+
+def enqueue(
+        settings_dict: dict[str, typing.Any],
+        personal_settings,
+        cache_key: typing.Optional[str] = None,
+        timer: typing.Optional[timing.StageTimer] = None,
+        patch_format: typing.Optional[str] = None,
+        ticket: str = '') -> str:
+    """
+    Queue a seed generation job and return its ID.  Stage timings from the
+    job are added to the given timer.
+
+    The job waits for a generation slot for its admission ticket before it
+    starts and gives the ticket back when it's done.
+    """
+    if timer is None:
+        timer = timing.StageTimer()
+    patch_format = patchformats.get(patch_format)
+
+    job_id = _create_job(QUEUED)
+    _submit(job_id, seedgen.generate_seed,
+            (settings_dict, personal_settings, patch_format.name,
+             get_config_path(job_id)),
+            cache_key, timer, patch_format, ticket)
+
+    return job_id
+
+
+def enqueue_repersonalize(
+        source_job_id: str,
+        personal_settings,
+        timer: typing.Optional[timing.StageTimer] = None,
+        patch_format: typing.Optional[str] = None,
+        ticket: str = '') -> str:
+    """
+    Queue a job that applies new personalization to the seed of an earlier
+    job and return its ID.  Raises FileNotFoundError if the earlier job
+    has no stored seed.
+
+    The new job keeps the seed's config too, so it can be re-personalized
+    again after the earlier job is pruned.
+    """
+    if timer is None:
+        timer = timing.StageTimer()
+    patch_format = patchformats.get(patch_format)
+    source_config_path = get_config_path(source_job_id)
+    if not os.path.exists(source_config_path):
+        raise FileNotFoundError(
+            f'No stored seed for job: {source_job_id}')
+
+    job_id = _create_job(QUEUED)
+    config_path = get_config_path(job_id)
+    try:
+        _link_file(source_config_path, config_path)
+    except FileNotFoundError:
+        # The earlier job was pruned in the meantime
+        shutil.rmtree(get_job_dir(job_id), ignore_errors=True)
+        raise FileNotFoundError(
+            f'No stored seed for job: {source_job_id}')
+
+    _submit(job_id, seedgen.repersonalize_seed,
+            (config_path, personal_settings, patch_format.name),
+            None, timer, patch_format, ticket)
+
+    return job_id
+
+
+def enqueue_batch(
+        settings,
+        settings_dict: dict[str, typing.Any],
+        seeds: list[str],
+        patch_format: typing.Optional[str] = None,
+        ticket: str = '') -> str:
+    """
+    Queue a batch of seeds generated from the same parsed settings and
+    return the job ID.  The job's result is a single zip for the batch.
+
+    The batch's admission ticket holds its place in the wait queue until
+    the batch is done.  Each seed waits for a generation slot of its own
+    when a pool worker picks it up, so a batch shares RDI_MAX_GENERATIONS
+    with every other job.
+    """
+    job_id = _create_job(QUEUED)
+    result_path = get_result_path(job_id)
+    temp_path = f'{result_path}.tmp'
+    try:
+        result_file = open(temp_path, 'wb')
+        try:
+            writer = batch.BatchWriter(
+                result_file, seeds, settings_dict, patch_format)
+        except Exception:
+            result_file.close()
+            raise
+    except Exception as ex:
+        admission.release(ticket)
+        _write_status(job_id, FAILED, error=str(ex))
+        raise
+
+    # Seeds finish on several dispatcher threads.  Serialize the status
+    # updates so an older progress count never replaces a newer one.
+    status_lock = threading.Lock()
+    seed_tickets = {}
+    futures = []
+    started = False
+    finished = False
+
+    def on_start(seed: str):
+        nonlocal started
+        seed_ticket = admission.create_ticket()
+        with status_lock:
+            seed_tickets[seed] = seed_ticket
+        admission.wait_for_slot(seed_ticket)
+        with status_lock:
+            if not started and not finished:
+                started = True
+                _write_status(job_id, RUNNING, completed=writer.completed,
+                              total=len(seeds))
+
+    def finish(error: typing.Optional[str]):
+        """
+        Close the batch once every seed is in or writing it failed
+        """
+        nonlocal finished
+        finished = True
+        try:
+            result_file.close()
+            if error is None and writer.failed == len(seeds):
+                error = 'Every seed in the batch failed'
+            if error is None:
+                os.replace(temp_path, result_path)
+        except OSError as ex:
+            error = str(ex)
+        finally:
+            admission.release(ticket)
+
+        if error is not None:
+            try:
+                os.remove(temp_path)
+            except FileNotFoundError:
+                pass
+            _write_status(job_id, FAILED, error=error)
+            return
+
+        _write_status(job_id, DONE, completed=len(seeds),
+                      total=len(seeds), failed=writer.failed,
+                      filename=batch.RESULT_NAME)
+        logger.info('Batch %s finished: %d seeds, %d failed',
+                    job_id, len(seeds), writer.failed)
+
+    def on_seed_done(seed: str, future: concurrent.futures.Future):
+        with status_lock:
+            seed_ticket = seed_tickets.pop(seed, '')
+        admission.release(seed_ticket)
+
+        failed = False
+        with status_lock:
+            if finished:
+                # The batch already failed
+                return
+            try:
+                if writer.add(seed, future):
+                    finish(None)
+                else:
+                    _write_status(job_id, RUNNING, completed=writer.completed,
+                                  total=len(seeds))
+            except Exception as ex:
+                logger.exception('Failed to write batch %s', job_id)
+                finish(f'Failed to write the batch: {ex}')
+                failed = True
+
+        if failed:
+            # Outside the lock, since cancelling runs this callback again
+            for pending in futures:
+                pending.cancel()
+
+    try:
+        futures.extend(batch.submit(
+            workerpool.get_pool(), settings, seeds, writer.patch_format.name,
+            on_seed_done, on_start=on_start))
+    except Exception as ex:
+        with status_lock:
+            if not finished:
+                finish(str(ex))
+        for pending in futures:
+            pending.cancel()
+        raise
+
+    return job_id
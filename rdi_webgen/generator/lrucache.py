@@ -0,0 +1,80 @@
+"""
+In-process LRU caches keyed by a hash of settings data.
+
+Settings and personalization arrive as dictionaries parsed from TOML or
+form data, so they're keyed by a hash of their canonical JSON form: the
+same settings give the same key whatever order their keys came in.
+"""
+
+from django.conf import settings
+
+import collections
+import hashlib
+import json
+import threading
+import typing
+
+_MISSING = object()
+
+
+def get_data_hash(data: typing.Any) -> str:
+    """
+    Hash the canonical JSON form of some data
+    """
+    canonical = json.dumps(
+        data, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+class LRUCache:
+    """
+    Thread-safe LRU cache with hit/miss counters.  The number of entries
+    is read from the named setting on each use, and 0 turns the cache off.
+    """
+
+    def __init__(self, size_setting: str):
+        self.size_setting = size_setting
+        self.hits = 0
+        self.misses = 0
+        self._entries: collections.OrderedDict[str, typing.Any] = \
+            collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def size(self) -> int:
+        return getattr(settings, self.size_setting)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str, create: typing.Callable[[], typing.Any]):
+        """
+        Get the value for a key, calling create to make it on a miss.  Two
+        threads missing the same key at once may both call create.
+        """
+        size = self.size
+        if size <= 0:
+            return create()
+
+        with self._lock:
+            value = self._entries.get(key, _MISSING)
+            if value is not _MISSING:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return value
+            self.misses += 1
+
+        value = create()
+
+        with self._lock:
+            self._entries[key] = value
+            while len(self._entries) > size:
+                self._entries.popitem(last=False)
+
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
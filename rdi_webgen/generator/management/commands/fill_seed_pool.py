@@ -0,0 +1,76 @@
+"""
+Fill the pool of pre-generated seeds now, without waiting for the
+generator to be idle.
+
+    python manage.py fill_seed_pool --workers 8
+    python manage.py fill_seed_pool --preset STANDARD --size 20
+"""
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from generator import seedpool, workerpool
+
+import concurrent.futures
+import time
+
+
+class Command(BaseCommand):
+    help = 'Fill the pool of pre-generated seeds'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--preset', nargs='+',
+                            help='Presets to fill (default: every pooled preset)')
+        parser.add_argument('--size', type=int,
+                            help="Seeds to fill each preset to (default: the "
+                                 "preset's high watermark)")
+        parser.add_argument('--workers', type=int,
+                            default=settings.RDI_JOB_WORKERS,
+                            help='Randomizer worker processes')
+
+    def handle(self, *args, **options):
+        limits = seedpool.get_limits()
+        preset_names = options['preset'] or list(limits)
+        for preset_name in preset_names:
+            if preset_name not in limits:
+                raise CommandError(f'The {preset_name} preset is not pooled')
+
+        seedpool.prune()
+        needed = []
+        for preset_name in preset_names:
+            size = options['size'] or limits[preset_name][1]
+            needed += [preset_name] * max(0, size - seedpool.count(preset_name))
+        if not needed:
+            self.stdout.write('The seed pool is already full')
+            return
+
+        pool = workerpool.RandomizerPool(
+            size=options['workers'],
+            timeout=settings.RDI_JOB_TIMEOUT,
+            max_jobs=settings.RDI_WORKER_MAX_JOBS)
+        start = time.perf_counter()
+        failed = 0
+        try:
+            with concurrent.futures.ThreadPoolExecutor(
+                    options['workers']) as executor:
+                futures = {
+                    executor.submit(seedpool.add_seed, pool, preset_name):
+                        preset_name
+                    for preset_name in needed
+                }
+                for i, future in enumerate(
+                        concurrent.futures.as_completed(futures), 1):
+                    try:
+                        future.result()
+                    except Exception as ex:
+                        failed += 1
+                        self.stderr.write(f'{futures[future]}: {ex}')
+                    self.stdout.write(f'{i}/{len(needed)} seeds done')
+        finally:
+            pool.shutdown()
+
+        self.stdout.write(
+            f'Added {len(needed) - failed} of {len(needed)} seeds in '
+            f'{time.perf_counter() - start:.1f}s')
+        if failed == len(needed):
+            raise CommandError('Every seed failed')
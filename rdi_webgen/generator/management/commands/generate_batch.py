@@ -0,0 +1,120 @@
+"""
+Generate a batch of seeds with the same settings into one zip.
+
+    python manage.py generate_batch settings.toml --count 50 --workers 8
+    python manage.py generate_batch --preset STANDARD --seeds race1 race2
+"""
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from generator import batch, patchformats, personalization, presets, workerpool
+
+import threading
+import time
+import tomllib
+
+
+class Command(BaseCommand):
+    help = 'Generate a batch of seeds with the same settings'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'settings_file', nargs='?', help='Settings (.toml) file')
+        parser.add_argument('--preset', help='Use a preset instead of a file')
+        parser.add_argument('--seeds', nargs='+', default=[],
+                            help='Seed values to generate')
+        parser.add_argument('--count', type=int,
+                            help='Number of random seeds to generate')
+        parser.add_argument('--personalization',
+                            help='Personalization (.toml) file')
+        parser.add_argument('--workers', type=int,
+                            default=settings.RDI_JOB_WORKERS,
+                            help='Randomizer worker processes')
+        parser.add_argument('--format',
+                            choices=[name for name, _ in
+                                     patchformats.get_choices()],
+                            default=settings.RDI_PATCH_FORMAT,
+                            help='Patch format')
+        parser.add_argument('--output', default=batch.RESULT_NAME,
+                            help='Zip file to write')
+
+    def handle(self, *args, **options):
+        if (options['settings_file'] is None) == (options['preset'] is None):
+            raise CommandError('Give either a settings file or --preset')
+
+        seeds = options['seeds']
+        if not seeds and options['count'] is not None:
+            seeds = batch.make_seeds(options['count'])
+
+        try:
+            batch.check_seeds(seeds)
+            if options['preset'] is not None:
+                try:
+                    settings_dict = presets.get_settings(options['preset'])
+                except KeyError:
+                    raise CommandError(f'Invalid preset: {options["preset"]}')
+            else:
+                with open(options['settings_file'], 'rb') as file:
+                    settings_dict = tomllib.load(file)
+
+            personal_settings = None
+            if options['personalization'] is not None:
+                with open(options['personalization'], 'rb') as file:
+                    personal_settings = personalization.parse(
+                        tomllib.load(file))
+
+            rando_settings = batch.prepare_settings(
+                settings_dict, personal_settings)
+        except KeyError as ex:
+            raise CommandError(f'Invalid settings: unknown key {ex}')
+        except (OSError, ValueError, tomllib.TOMLDecodeError) as ex:
+            raise CommandError(str(ex))
+
+        pool = workerpool.RandomizerPool(
+            size=options['workers'],
+            timeout=settings.RDI_JOB_TIMEOUT,
+            max_jobs=settings.RDI_WORKER_MAX_JOBS)
+        finished = threading.Event()
+        # An error writing the zip, which ends the batch early
+        error = []
+        start = time.perf_counter()
+
+        with open(options['output'], 'wb') as file:
+            writer = batch.BatchWriter(
+                file, seeds, settings_dict, options['format'])
+
+            def on_seed_done(seed: str, future):
+                try:
+                    done = writer.add(seed, future)
+                except Exception as ex:
+                    error.append(ex)
+                    finished.set()
+                    return
+                self.stdout.write(f'{writer.completed}/{len(seeds)} seeds done')
+                if done:
+                    finished.set()
+
+            try:
+                futures = batch.submit(
+                    pool, rando_settings, seeds, writer.patch_format.name,
+                    on_seed_done)
+                finished.wait()
+                if error:
+                    for future in futures:
+                        future.cancel()
+            finally:
+                pool.shutdown()
+        if error:
+            raise CommandError(
+                f'Failed to write {options["output"]}: {error[0]}')
+
+        for seed, entry in writer.manifest['seeds'].items():
+            if 'error' in entry:
+                self.stderr.write(f'{seed}: {entry["error"]}')
+
+        self.stdout.write(
+            f'Wrote {len(seeds) - writer.failed} of {len(seeds)} seeds to '
+            f'{options["output"]} in {time.perf_counter() - start:.1f}s')
+        if writer.failed == len(seeds):
+            raise CommandError('Every seed in the batch failed')
@@ -0,0 +1,141 @@
+"""
+Run the startup build steps before the webapp starts serving.
+
+Steps are run in a process pool as soon as the steps they depend on are
+done, so independent steps (e.g. the toml form autogen and the ROM
+prepatching) run at the same time.  Steps whose inputs haven't changed since
+the last start are skipped (see generator/buildsteps.py).  The first failure
+stops the startup.
+
+    python manage.py startup [--force] [--only STEP ...] [--workers N]
+"""
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from generator import buildsteps
+
+import concurrent.futures
+import multiprocessing
+import time
+
+
+class Command(BaseCommand):
+    help = 'Run the startup build steps that changed since the last start'
+
+    # The checks import the views, which need the autogenerated form that
+    # this command creates.  The check step runs them once it exists.
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--force', action='store_true',
+            help='Run every step even if its inputs are unchanged')
+        parser.add_argument(
+            '--only', nargs='+',
+            choices=[step.name for step in buildsteps.get_steps()],
+            help='Only run these steps')
+        parser.add_argument(
+            '--workers', type=int, default=settings.RDI_STARTUP_WORKERS,
+            help='Steps to run at the same time')
+
+    def handle(self, *args, **options):
+        all_steps = {step.name: step for step in buildsteps.get_steps()}
+        steps = dict(all_steps)
+        if options['only']:
+            steps = {name: all_steps[name] for name in options['only']}
+
+        manifest = buildsteps.load_manifest()
+        # Steps outside of --only count as done
+        done = set(name for name in all_steps if name not in steps)
+        pending = dict(steps)
+        running = {}
+        report = {}
+
+        context = multiprocessing.get_context('fork')
+        executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=options['workers'], mp_context=context)
+        start = time.perf_counter()
+
+        try:
+            while pending or running:
+                # Start (or skip) every step whose dependencies are done
+                progress = True
+                while progress:
+                    progress = False
+                    for name, step in list(pending.items()):
+                        if not all(dep in done for dep in step.depends_on):
+                            continue
+                        del pending[name]
+                        progress = True
+
+                        step_start = time.perf_counter()
+                        input_hash = step.get_input_hash()
+                        previous = manifest.get(name, {})
+                        if not options['force'] and not step.always_run \
+                                and previous.get('inputs') == input_hash \
+                                and step.outputs_exist():
+                            done.add(name)
+                            report[name] = (
+                                'skipped', time.perf_counter() - step_start)
+                            continue
+
+                        self.stdout.write(f'Starting {name}')
+                        future = executor.submit(step.action)
+                        running[future] = (name, step_start, input_hash)
+
+                if not running:
+                    if pending:
+                        raise CommandError(
+                            'Steps with unmet dependencies: '
+                            + ', '.join(pending))
+                    break
+
+                finished, _ = concurrent.futures.wait(
+                    running, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in finished:
+                    name, step_start, input_hash = running.pop(future)
+                    duration = time.perf_counter() - step_start
+                    try:
+                        future.result()
+                    except Exception as ex:
+                        self.fail(executor, running, name, ex)
+
+                    done.add(name)
+                    report[name] = ('ran', duration)
+                    self.stdout.write(f'Finished {name} in {duration:.2f}s')
+                    if not steps[name].always_run:
+                        manifest[name] = {
+                            'inputs': input_hash,
+                            'duration': duration,
+                            'completed': time.time(),
+                        }
+                        buildsteps.save_manifest(manifest)
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+        self.stdout.write('Startup steps:')
+        for name, (status, duration) in report.items():
+            self.stdout.write(f'  {name:<16} {status:<8} {duration:8.2f}s')
+        self.stdout.write(
+            f'  {"total":<16} {"":<8} {time.perf_counter() - start:8.2f}s')
+
+    def fail(self, executor, running, name: str, ex: Exception):
+        """
+        Stop every other step and report the failure
+        """
+        for future in running:
+            future.cancel()
+        # Steps that already started can't be cancelled, so stop their
+        # worker processes instead
+        for process in multiprocessing.active_children():
+            process.terminate()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+        if ex.__cause__ is not None:
+            # The traceback from the worker process
+            self.stderr.write(str(ex.__cause__))
+        stopped = ', '.join(name for name, _, _ in running.values())
+        if stopped:
+            self.stderr.write(f'Stopped: {stopped}')
+        raise CommandError(f'Startup step {name} failed: {ex}')
@@ -0,0 +1,168 @@
+"""
+Cache of the rendered static pages (index and TOML builder form).
+
+These pages only change when the templates or the autogenerated form
+(tools/create_toml_gen_form.py) change, so each one is rendered once per
+process with a placeholder in place of the CSRF token.  A request only
+swaps the placeholder for its own token.
+
+Each page gets an ETag built from a hash of the rendered page and a hash of
+the client's CSRF secret.  A masked token stays valid for as long as the
+secret does, so a browser with a cached copy can revalidate and get a 304
+until either the deployment or its CSRF cookie changes.
+"""
+
+import hashlib
+import logging
+import os
+import threading
+import typing
+
+from django.conf import settings
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
+from django.template.loader import render_to_string
+from django.utils.cache import (
+    get_conditional_response, patch_cache_control, patch_vary_headers)
+from django.utils.http import http_date, quote_etag
+
+logger = logging.getLogger(__name__)
+
+# Rendered in place of the CSRF token.  Only contains characters that aren't
+# escaped so it appears in the page verbatim.
+CSRF_PLACEHOLDER = 'RDICSRFTOKENPLACEHOLDER'
+
+_APP_DIR = os.path.dirname(__file__)
+# The files the cached pages are built from
+_SOURCE_PATHS = (
+    os.path.join(_APP_DIR, 'templates', 'generator'),
+    os.path.join(_APP_DIR, 'toml_gen_form.py'),
+    os.path.join(_APP_DIR, 'arg_schema.json'),
+    os.path.join(_APP_DIR, 'forms.py'),
+)
+
+
+class RenderedPage(typing.NamedTuple):
+    content: str
+    digest: str
+    last_modified: float
+
+
+class SourceInfo(typing.NamedTuple):
+    digest: str
+    last_modified: float
+
+
+def _iter_source_files() -> typing.Iterator[str]:
+    for path in _SOURCE_PATHS:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    yield os.path.join(root, name)
+        elif os.path.exists(path):
+            yield path
+
+
+def get_source_info() -> SourceInfo:
+    """
+    Hash the templates and autogenerated form the pages are rendered from
+    """
+    source_hash = hashlib.sha256()
+    last_modified = 0.0
+    for path in _iter_source_files():
+        with open(path, 'rb') as file:
+            source_hash.update(path.encode())
+            source_hash.update(file.read())
+        last_modified = max(last_modified, os.path.getmtime(path))
+
+    return SourceInfo(source_hash.hexdigest(), last_modified)
+
+
+class PageCache:
+    """
+    Rendered pages keyed by template name and source hash
+    """
+
+    def __init__(self):
+        self._pages: dict[tuple[str, str], RenderedPage] = {}
+        self._source_info: typing.Optional[SourceInfo] = None
+        self._lock = threading.Lock()
+
+    def _get_source_info(self) -> SourceInfo:
+        # Templates can change under the dev server, so recheck them on
+        # every request when debugging
+        if self._source_info is None or settings.DEBUG:
+            self._source_info = get_source_info()
+        return self._source_info
+
+    def get(self, template_name: str,
+            get_context: typing.Callable[[], dict[str, typing.Any]]) -> RenderedPage:
+        source_info = self._get_source_info()
+        key = (template_name, source_info.digest)
+        with self._lock:
+            page = self._pages.get(key)
+            if page is None:
+                context = get_context()
+                context['csrf_token'] = CSRF_PLACEHOLDER
+                content = render_to_string(template_name, context)
+                page = RenderedPage(
+                    content,
+                    hashlib.sha256(content.encode()).hexdigest()[:32],
+                    source_info.last_modified)
+                self._pages = {
+                    cached_key: cached_page
+                    for cached_key, cached_page in self._pages.items()
+                    if cached_key[1] == source_info.digest
+                }
+                self._pages[key] = page
+        return page
+
+
+_page_cache = PageCache()
+
+
+def _get_csrf_secret(request) -> str:
+    # get_token() creates the secret (and schedules the cookie) if the
+    # client doesn't have one yet
+    get_token(request)
+    return request.META['CSRF_COOKIE']
+
+
+def render_page(
+        request,
+        template_name: str,
+        get_context: typing.Callable[[], dict[str, typing.Any]]
+) -> HttpResponse:
+    """
+    Serve a cached page, answering conditional requests with a 304
+    """
+    page = _page_cache.get(template_name, get_context)
+    secret_hash = hashlib.sha256(
+        _get_csrf_secret(request).encode()).hexdigest()[:16]
+    etag = quote_etag(f'{page.digest}-{secret_hash}')
+    last_modified = int(page.last_modified)
+
+    response = get_conditional_response(
+        request, etag=etag, last_modified=last_modified)
+    if response is None:
+        content = page.content.replace(CSRF_PLACEHOLDER, get_token(request))
+        response = HttpResponse(content)
+
+    response.headers['ETag'] = etag
+    response.headers['Last-Modified'] = http_date(last_modified)
+    # The page holds a per-client CSRF token, so only the browser may cache
+    # it, and only reuse it after revalidating
+    patch_cache_control(response, private=True, no_cache=True)
+    patch_vary_headers(response, ('Cookie',))
+    return response
+
+
+def preload(pages: typing.Iterable[
+        tuple[str, typing.Callable[[], dict[str, typing.Any]]]]):
+    """
+    Render pages ahead of the first request
+    """
+    for template_name, get_context in pages:
+        _page_cache.get(template_name, get_context)
+        logger.info('Pre-rendered %s', template_name)
@@ -0,0 +1,116 @@
+"""
+Patch formats a seed can be downloaded as.
+
+Each format pairs an encoder with the matching decoder, which the
+benchmarks use to check the output.  Randomized ROMs differ from the vanilla
+ROM in scattered regions, so the choice of encoder trades encode time
+against download size:
+
+    bps:       linear BPS encoder.  Fast, and the patch works with every
+               BPS patcher.
+    bps-delta: BPS encoder that also copies moved data from the source.
+               Slower, with a smaller patch.
+    ips:       IPS patch, for patchers without BPS support.  Only works
+               for ROMs up to 16 MiB, and has no checksums.
+
+Trusted formats skip patch encoding and send the raw changes to the ROM
+(see generator.romdelta).  They are for clients like a local kiosk or
+automated tests that apply the output themselves.  Handing out the
+randomized ROM this way isn't appropriate for a public site, so they're
+only available when RDI_TRUSTED_OUTPUT is set:
+
+    xor:       XOR of the changed ranges against the vanilla ROM
+    ranges:    the changed ranges of the randomized ROM
+
+RDI_PATCH_FORMAT is used when the request doesn't pick a format.
+"""
+
+from django.conf import settings
+
+from . import archive, bps, ips, romdelta
+
+import functools
+import typing
+
+
+class PatchFormat(typing.NamedTuple):
+    name: str
+    label: str
+    extension: str
+    create_patch: typing.Callable[[typing.Any, typing.Any], bytes]
+    apply_patch: typing.Callable[[typing.Any, typing.Any], bytes]
+    # Check whether the format can convert the source into the target
+    supports: typing.Callable[[typing.Any, typing.Any], bool] = \
+        lambda source, target: True
+    # Only available when RDI_TRUSTED_OUTPUT is set
+    trusted: bool = False
+
+    @property
+    def patch_name(self) -> str:
+        """
+        Name of the patch file in the seed zip
+        """
+        return f'{archive.PATCH_STEM}.{self.extension}'
+
+
+FORMATS = {
+    patch_format.name: patch_format for patch_format in (
+        PatchFormat('bps', 'BPS', 'bps',
+                    bps.create_patch, bps.apply_patch),
+        PatchFormat('bps-delta', 'BPS (smaller, slower)', 'bps',
+                    functools.partial(bps.create_patch, delta=True),
+                    bps.apply_patch),
+        PatchFormat('ips', 'IPS', 'ips',
+                    ips.create_patch, ips.apply_patch, ips.supports),
+        PatchFormat('xor', 'XOR delta (trusted clients)', 'xordelta',
+                    romdelta.create_xor_delta, romdelta.apply_xor_delta,
+                    trusted=True),
+        PatchFormat('ranges', 'Changed ranges (trusted clients)', 'ranges',
+                    romdelta.create_range_list, romdelta.apply_range_list,
+                    trusted=True),
+    )
+}
+
+
+def is_available(patch_format: PatchFormat) -> bool:
+    return not patch_format.trusted or bool(settings.RDI_TRUSTED_OUTPUT)
+
+
+def get(name: typing.Optional[str] = None) -> PatchFormat:
+    """
+    Get a patch format by name, or the default format.  Raises a ValueError
+    for an unknown format or a trusted format that isn't enabled.
+    """
+    if not name:
+        name = settings.RDI_PATCH_FORMAT
+
+    try:
+        patch_format = FORMATS[name]
+    except KeyError:
+        raise ValueError(f'Unknown patch format: {name}')
+    if not is_available(patch_format):
+        raise ValueError(f'The {patch_format.label} format is not enabled')
+
+    return patch_format
+
+
+def get_choices() -> list[tuple[str, str]]:
+    """
+    Get the available formats as form choices
+    """
+    return [(patch_format.name, patch_format.label)
+            for patch_format in FORMATS.values()
+            if is_available(patch_format)]
+
+
+def create_patch(name: typing.Optional[str], source, target) -> bytes:
+    """
+    Create a patch in the given format.  Raises a ValueError if the format
+    can't hold this patch.
+    """
+    patch_format = get(name)
+    if not patch_format.supports(source, target):
+        raise ValueError(
+            f"The {patch_format.label} format can't patch this ROM")
+
+    return patch_format.create_patch(source, target)
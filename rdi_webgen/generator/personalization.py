@@ -0,0 +1,57 @@
+"""
+Parsed personalization settings.
+
+A personalization file holds the randomizer's post-rando options (names,
+palettes, music, ...).  The argument parser for them is built once per
+process.  Most users upload one of a few files, so the parsed options are
+kept in an LRU cache of RDI_PERSONALIZATION_CACHE_SIZE entries keyed by a
+hash of the file's settings.
+"""
+
+from ctrando.arguments import tomloptions
+from ctrando.arguments.postrandooptions import PostRandoOptions
+
+from . import lrucache
+
+import argparse
+import copy
+import functools
+import typing
+
+_cache = lrucache.LRUCache('RDI_PERSONALIZATION_CACHE_SIZE')
+
+
+@functools.cache
+def get_parser() -> argparse.ArgumentParser:
+    """
+    Get the parser for the post-rando options
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument_group(PostRandoOptions.add_group_to_parser(parser))
+    return parser
+
+
+def _parse(personalization_dict: dict[str, typing.Any]):
+    args = tomloptions.toml_data_to_args(personalization_dict)
+    namespace = get_parser().parse_args(args)
+    return PostRandoOptions.extract_from_namespace(namespace)
+
+
+def parse(personalization_dict: typing.Optional[dict[str, typing.Any]]):
+    """
+    Get the post-rando options for a personalization file's settings, or
+    None if there's no file.  The caller gets its own copy of the options.
+    """
+    if personalization_dict is None:
+        return None
+
+    if _cache.size <= 0:
+        return _parse(personalization_dict)
+
+    options = _cache.get(lrucache.get_data_hash(personalization_dict),
+                         lambda: _parse(personalization_dict))
+    return copy.deepcopy(options)
+
+
+def clear_cache():
+    _cache.clear()
@@ -0,0 +1,117 @@
+"""
+In-memory index of the randomizer's preset files.
+
+The presets are part of the installed randomizer package, so they are read
+once per process.  Each preset keeps its raw TOML, the parsed settings, a
+content hash used as a strong ETag and pre-compressed copies for clients
+that accept them.  preload() builds the index in the gunicorn master so the
+workers share it.
+"""
+
+import copy
+import gzip
+import hashlib
+import importlib.resources
+import logging
+import threading
+import typing
+
+from ctrando.arguments import arguments
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+
+class Preset(typing.NamedTuple):
+    name: str
+    data: bytes
+    settings: dict[str, typing.Any]
+    etag: str
+    encoded: dict[str, bytes]
+
+
+def _load_preset(preset: arguments.Presets) -> Preset:
+    preset_file = importlib.resources.files(
+        'ctrando.arguments.presets').joinpath(preset.value.filename)
+    data = preset_file.read_bytes()
+
+    encoded = {'gzip': gzip.compress(data, mtime=0)}
+    if brotli is not None:
+        encoded['br'] = brotli.compress(data)
+
+    return Preset(
+        name=preset.name,
+        data=data,
+        settings=arguments.get_preset(preset),
+        etag=f'"{hashlib.sha256(data).hexdigest()}"',
+        encoded=encoded)
+
+
+_presets: typing.Optional[dict[str, Preset]] = None
+_lock = threading.Lock()
+
+
+def _get_presets() -> dict[str, Preset]:
+    global _presets
+    with _lock:
+        if _presets is None:
+            _presets = {
+                preset.name: _load_preset(preset)
+                for preset in arguments.Presets
+            }
+        return _presets
+
+
+def get(preset_id: str) -> Preset:
+    """
+    Get a preset by its name in arguments.Presets.  Raises KeyError for an
+    unknown preset.
+    """
+    return _get_presets()[preset_id]
+
+
+def get_settings(preset_id: str) -> dict[str, typing.Any]:
+    """
+    Get a copy of a preset's settings that the caller is free to modify
+    """
+    return copy.deepcopy(get(preset_id).settings)
+
+
+def _is_refused(param: str) -> bool:
+    """
+    Check whether an Accept-Encoding parameter is a q value of 0
+    """
+    name, _, value = param.partition('=')
+    if name.strip().lower() != 'q':
+        return False
+    try:
+        return float(value) == 0
+    except ValueError:
+        return False
+
+
+def get_encoding(preset: Preset, accept_encoding: str) -> typing.Optional[str]:
+    """
+    Pick the best pre-compressed copy for an Accept-Encoding header, or None
+    to send the preset uncompressed
+    """
+    accepted = set()
+    for item in accept_encoding.split(','):
+        coding, *params = item.split(';')
+        if any(_is_refused(param) for param in params):
+            continue
+        accepted.add(coding.strip().lower())
+
+    for coding in ('br', 'gzip'):
+        if coding in preset.encoded and coding in accepted:
+            return coding
+    return None
+
+
+def preload():
+    presets = _get_presets()
+    logger.info('Loaded %d presets', len(presets))
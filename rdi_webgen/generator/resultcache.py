@@ -0,0 +1,139 @@
+"""
+Content-addressed cache of generated seed zips.
+
+A seed with a fixed seed value always generates the same output for the
+same settings, personalization and randomizer version, so the finished zip
+can be reused.  Entries are stored on disk as <key>.zip and evicted least
+recently used first once the cache grows past RDI_RESULT_CACHE_MAX_BYTES.
+The seed's stored config (see seedgen.write_config) is kept next to the
+zip as <key>.pkl so a cached seed can still be re-personalized.
+"""
+
+from django.conf import settings
+
+from . import lrucache, seedgen
+
+import logging
+import os
+import shutil
+import typing
+
+logger = logging.getLogger(__name__)
+
+# Settings key holding the seed value
+SEED_KEY = 'seed'
+
+
+def get_cache_key(
+        settings_dict: dict[str, typing.Any],
+        personalization_dict: typing.Optional[dict[str, typing.Any]],
+        patch_format: str
+) -> typing.Optional[str]:
+    """
+    Get the cache key for a request, or None if the result can't be cached
+    because the seed isn't fixed.
+    """
+    seed = settings_dict.get(SEED_KEY)
+    if seed is None or str(seed).strip() == '':
+        return None
+
+    return lrucache.get_data_hash({
+        'settings': settings_dict,
+        'personalization': personalization_dict,
+        'seed': str(seed),
+        'patch_format': patch_format,
+        'version': seedgen.get_ctrando_version(),
+    })
+
+
+def _get_entry_path(key: str) -> str:
+    return os.path.join(settings.RDI_RESULT_CACHE_DIR, f'{key}.zip')
+
+
+def _get_config_path(entry_path: str) -> str:
+    return f'{os.path.splitext(entry_path)[0]}.pkl'
+
+
+def _link(source_path: str, path: str):
+    """
+    Atomically put a file in the cache
+    """
+    temp_path = f'{path}.{os.getpid()}.tmp'
+    try:
+        # Share the job's file if possible rather than copying it
+        os.link(source_path, temp_path)
+    except OSError:
+        shutil.copyfile(source_path, temp_path)
+    os.replace(temp_path, path)
+
+
+def get(key: str) -> typing.Optional[str]:
+    """
+    Get the path of a cached zip, or None on a cache miss
+    """
+    path = _get_entry_path(key)
+    try:
+        # Bump the modification time to mark the entry as recently used
+        os.utime(path)
+    except FileNotFoundError:
+        return None
+
+    return path
+
+
+def get_config(key: str) -> typing.Optional[str]:
+    """
+    Get the path of the stored config for a cached zip, or None if there
+    isn't one
+    """
+    path = _get_config_path(_get_entry_path(key))
+    return path if os.path.exists(path) else None
+
+
+def put(key: str, result_path: str, config_path: typing.Optional[str] = None):
+    """
+    Add a finished zip and its stored config to the cache
+    """
+    os.makedirs(settings.RDI_RESULT_CACHE_DIR, exist_ok=True)
+    path = _get_entry_path(key)
+    if config_path is not None:
+        # Added before the zip so a cached zip always has its config
+        _link(config_path, _get_config_path(path))
+    _link(result_path, path)
+
+    evict()
+
+
+def evict():
+    """
+    Remove the least recently used entries until the cache fits in
+    RDI_RESULT_CACHE_MAX_BYTES
+    """
+    entries = []
+    total_size = 0
+    for entry in os.scandir(settings.RDI_RESULT_CACHE_DIR):
+        if not entry.name.endswith('.zip'):
+            continue
+        try:
+            stat = entry.stat()
+        except FileNotFoundError:
+            continue
+        size = stat.st_size
+        try:
+            size += os.stat(_get_config_path(entry.path)).st_size
+        except FileNotFoundError:
+            pass
+        entries.append((stat.st_mtime, size, entry.path))
+        total_size += size
+
+    entries.sort()
+    for _, size, path in entries:
+        if total_size <= settings.RDI_RESULT_CACHE_MAX_BYTES:
+            break
+        for entry_path in (path, _get_config_path(path)):
+            try:
+                os.remove(entry_path)
+            except FileNotFoundError:
+                pass
+        total_size -= size
+        logger.debug('Evicted cached result %s', path)
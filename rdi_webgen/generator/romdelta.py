@@ -0,0 +1,164 @@
+"""
+Raw ROM deltas for trusted clients.
+
+These skip the work of building a real patch format for clients that only
+need the randomized ROM, like a local kiosk or automated tests.  Both
+formats are a header followed by a list of changed ranges:
+
+    header:  magic (4 bytes), source size, target size, source CRC32,
+             target CRC32 (little endian uint32 each)
+    records: offset, length (little endian uint32 each), then length bytes
+
+In the xor format the record data is the target XOR the source, with the
+source padded with zeros to the target size.  In the ranges format it is
+the target data itself.
+
+Ranges are found by comparing whole blocks, and only the blocks that
+differ are split into records, so the cost depends on how much of the ROM
+changed.  Emulators can't load these files, so they're only offered when
+RDI_TRUSTED_OUTPUT is set (see generator.patchformats).
+"""
+
+import re
+import struct
+import zlib
+
+XOR_MAGIC = b'RDX1'
+RANGES_MAGIC = b'RDR1'
+
+_HEADER = struct.Struct('<4sIIII')
+_RECORD = struct.Struct('<II')
+
+# Size of the blocks compared to find the changed parts of the ROM
+_BLOCK_SIZE = 4096
+
+# Non-zero runs of the XOR separated by fewer zeros than this are kept in
+# one record, since a new record header would cost more
+_GAP = bytes(_RECORD.size)
+_NON_ZERO = re.compile(rb'[^\x00]')
+
+
+def _xor(source: bytes, target: bytes) -> bytes:
+    """
+    XOR two buffers, with the source padded with zeros to the target size
+    """
+    size = len(target)
+    source = bytes(source).ljust(size, b'\0')
+    return (int.from_bytes(source, 'little')
+            ^ int.from_bytes(target, 'little')).to_bytes(size, 'little')
+
+
+def _find_runs(xor: bytes) -> list[tuple[int, int]]:
+    """
+    Get the [start, end) ranges of the non-zero runs in an XOR.  Gaps are
+    found with find and skipped with a search, so each byte is only looked
+    at once, in C.
+    """
+    runs = []
+    end = len(xor.rstrip(b'\0'))
+    pos = len(xor) - len(xor.lstrip(b'\0'))
+    while pos < end:
+        gap = xor.find(_GAP, pos, end)
+        if gap == -1:
+            runs.append((pos, end))
+            break
+        runs.append((pos, gap))
+        pos = _NON_ZERO.search(xor, gap, end).start()
+
+    return runs
+
+
+def _find_changed_blocks(source, target: bytes) -> list[list[int]]:
+    """
+    Get the [start, end) ranges of whole blocks where the source and target
+    differ
+    """
+    ranges = []
+    for start in range(0, len(target), _BLOCK_SIZE):
+        end = min(start + _BLOCK_SIZE, len(target))
+        if source[start:end] == target[start:end]:
+            continue
+        if ranges and ranges[-1][1] == start:
+            ranges[-1][1] = end
+        else:
+            ranges.append([start, end])
+
+    return ranges
+
+
+def _create(magic: bytes, source, target) -> bytes:
+    target = bytes(target)
+    delta = bytearray(_HEADER.pack(
+        magic, len(source), len(target),
+        zlib.crc32(source), zlib.crc32(target)))
+
+    for start, end in _find_changed_blocks(source, target):
+        xor = _xor(source[start:end], target[start:end])
+        for run_start, run_end in _find_runs(xor):
+            delta += _RECORD.pack(start + run_start, run_end - run_start)
+            if magic == XOR_MAGIC:
+                delta += xor[run_start:run_end]
+            else:
+                delta += target[start + run_start:start + run_end]
+
+    return bytes(delta)
+
+
+def create_xor_delta(source, target) -> bytes:
+    """
+    Create an xor delta that converts source into target
+    """
+    return _create(XOR_MAGIC, source, target)
+
+
+def create_range_list(source, target) -> bytes:
+    """
+    Create a list of the target's changed ranges
+    """
+    return _create(RANGES_MAGIC, source, target)
+
+
+def _apply(magic: bytes, source, delta) -> bytes:
+    delta = bytes(delta)
+    if len(delta) < _HEADER.size:
+        raise ValueError('Truncated ROM delta')
+    delta_magic, source_size, target_size, source_crc, target_crc = \
+        _HEADER.unpack_from(delta)
+    if delta_magic != magic:
+        raise ValueError('Wrong ROM delta format')
+    if len(source) != source_size or zlib.crc32(source) != source_crc:
+        raise ValueError('Source data does not match the ROM delta')
+
+    target = bytearray(bytes(source).ljust(target_size, b'\0')[:target_size])
+    pos = _HEADER.size
+    while pos < len(delta):
+        if pos + _RECORD.size > len(delta):
+            raise ValueError('Truncated ROM delta')
+        offset, length = _RECORD.unpack_from(delta, pos)
+        pos += _RECORD.size
+        data = delta[pos:pos + length]
+        if len(data) != length or offset + length > target_size:
+            raise ValueError('Invalid ROM delta record')
+        pos += length
+
+        if magic == XOR_MAGIC:
+            data = _xor(target[offset:offset + length], data)
+        target[offset:offset + length] = data
+
+    if zlib.crc32(target) != target_crc:
+        raise ValueError('Target checksum does not match the ROM delta')
+    return bytes(target)
+
+
+def apply_xor_delta(source, delta) -> bytes:
+    """
+    Apply an xor delta to the source data and return the target data
+    """
+    return _apply(XOR_MAGIC, source, delta)
+
+
+def apply_range_list(source, delta) -> bytes:
+    """
+    Apply a range list to the source data and return the target data
+    """
+    return _apply(RANGES_MAGIC, source, delta)
@@ -0,0 +1,247 @@
+"""
+Seed generation pipeline.
+
+These functions don't depend on the request so they can run in a job
+worker process as well as in a view.
+
+A seed can be stored as its parsed settings and the random config the
+randomizer chose for it.  Applying different post-rando options (names,
+palettes, music, ...) to a stored seed only needs the ROM to be built from
+the config again, skipping get_random_config.
+"""
+
+from django.conf import settings as django_settings
+
+import ctrando
+import ctrando.randomizer
+from ctrando.arguments import tomloptions
+
+from . import artifacts, patchformats, timing
+
+import functools
+import importlib.metadata
+import io
+import os
+import pickle
+import tempfile
+import typing
+
+
+@functools.cache
+def get_ctrando_version() -> str:
+    """
+    Get the installed randomizer version
+    """
+    try:
+        return importlib.metadata.version('ctrando')
+    except importlib.metadata.PackageNotFoundError:
+        return getattr(ctrando, '__version__', 'unknown')
+
+
+def extract_settings(
+        settings_dict: dict[str, typing.Any],
+        personal_settings,
+        timer: typing.Optional[timing.StageTimer] = None):
+    """
+    Parse a settings dictionary into the randomizer's settings object
+    """
+    if timer is None:
+        timer = timing.StageTimer()
+
+    args = tomloptions.toml_data_to_args(settings_dict)
+    with timer.stage('extract_settings'):
+        settings = ctrando.randomizer.extract_settings(*args)
+    if personal_settings is not None:
+        settings.post_random_options = personal_settings
+
+    return settings
+
+
+def write_config(config_path: str, settings, config):
+    """
+    Store a seed's parsed settings and random config
+    """
+    temp_path = f'{config_path}.{os.getpid()}.tmp'
+    with open(temp_path, 'wb') as file:
+        pickle.dump((settings, config), file, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temp_path, config_path)
+
+
+def read_config(config_path: str):
+    """
+    Load the parsed settings and random config stored for a seed
+    """
+    with open(config_path, 'rb') as file:
+        return pickle.load(file)
+
+
+def generate_from_settings(
+        settings,
+        timer: timing.StageTimer,
+        config_path: typing.Optional[str] = None):
+    """
+    Generate a randomized game from already parsed settings.  The seed is
+    stored at config_path if given.
+    """
+    ct_rom = artifacts.get_base_ctrom()
+    with timer.stage('get_random_config'):
+        config = ctrando.randomizer.get_random_config(settings, ct_rom)
+    if config_path is not None:
+        with timer.stage('write_config'):
+            write_config(config_path, settings, config)
+
+    return generate_from_config(settings, config, timer, ct_rom)
+
+
+def generate_from_config(settings, config, timer: timing.StageTimer,
+                         ct_rom=None):
+    """
+    Build the randomized game for a random config
+    """
+    if ct_rom is None:
+        ct_rom = artifacts.get_base_ctrom()
+    with timer.stage('get_ctrom_from_config'):
+        out_rom = ctrando.randomizer.get_ctrom_from_config(
+            ct_rom, settings, config,
+            django_settings.RDI_POST_CONFIG_PATH,
+            django_settings.RDI_PREPATCHED_ROM_PATH)
+
+    spoiler_file = io.StringIO()
+    with timer.stage('write_spoilers_to_file'):
+        ctrando.randomizer.write_spoilers_to_file(
+            settings, config, spoiler_file)
+
+    return out_rom, spoiler_file
+
+
+def generate(
+        settings_dict: dict[str, typing.Any],
+        personal_settings,
+        timer: typing.Optional[timing.StageTimer] = None,
+        config_path: typing.Optional[str] = None):
+    """
+    Generate a randomized game based on the given settings files
+    """
+    if timer is None:
+        timer = timing.StageTimer()
+
+    try:
+        settings = extract_settings(settings_dict, personal_settings, timer)
+        out_rom, spoiler_file = generate_from_settings(
+            settings, timer, config_path)
+    except ValueError as ve:
+        raise Exception(f'Invalid args: {str(ve)}')
+    except Exception as ex:
+        raise Exception(f'Unknown error during generation: {str(ex)}')
+
+    return out_rom, spoiler_file
+
+
+def get_patch_file(
+        out_rom, patch_format: typing.Optional[str] = None) -> io.BytesIO:
+    """
+    Get a BytesIO object with the patch file data in the given format (see
+    generator.patchformats)
+    """
+    try:
+        patch_format = patchformats.get(patch_format).name
+        if patch_format == 'bps' \
+                and django_settings.RDI_PATCH_ENGINE == 'flips':
+            return get_patch_file_flips(out_rom)
+
+        patch_data = patchformats.create_patch(
+            patch_format, artifacts.get_vanilla_rom(), out_rom.getbuffer())
+    except Exception as ex:
+        raise Exception('Failed to generate patch file: ' + str(ex))
+
+    return io.BytesIO(patch_data)
+
+
+def get_patch_file_flips(out_rom) -> io.BytesIO:
+    """
+    Create the patch file with the flips CLI.  This is slower than the
+    in-process encoder but is kept as a fallback.
+    """
+    temp_file = tempfile.NamedTemporaryFile()
+    bps_file_name = f'{temp_file.file.name}.bps'
+    patch_buffer = io.BytesIO()
+
+    # Write the patch file
+    temp_file.write(out_rom.getbuffer())
+    temp_file.flush()
+    os.system(
+        f'flips --create {django_settings.RDI_VANILLA_ROM_PATH} '
+        f'{temp_file.file.name} {bps_file_name}')
+
+    # Read the patch file back into a BytesIO object
+    with open(bps_file_name, 'rb') as patch_file:
+        patch_buffer.write(patch_file.read())
+
+    # Clean up the temp bps file
+    os.remove(bps_file_name)
+
+    return patch_buffer
+
+
+def generate_seed(
+        settings_dict: dict[str, typing.Any],
+        personal_settings,
+        patch_format: typing.Optional[str] = None,
+        config_path: typing.Optional[str] = None
+) -> tuple[bytes, str, dict[str, float]]:
+    """
+    Generate a seed and return the patch data, spoiler log text and stage
+    timings.  This is the unit of work sent to the randomizer worker pool.
+    The seed is stored at config_path if given.
+    """
+    timer = timing.StageTimer()
+    out_rom, spoiler_log = generate(
+        settings_dict, personal_settings, timer, config_path)
+    with timer.stage('get_patch_file'):
+        patch_file = get_patch_file(out_rom, patch_format)
+
+    return patch_file.getvalue(), spoiler_log.getvalue(), timer.timings
+
+
+def repersonalize_seed(
+        config_path: str,
+        personal_settings,
+        patch_format: typing.Optional[str] = None
+) -> tuple[bytes, str, dict[str, float]]:
+    """
+    Rebuild a stored seed with new post-rando options.  Returns the same
+    values as generate_seed.
+    """
+    timer = timing.StageTimer()
+    try:
+        with timer.stage('read_config'):
+            settings, config = read_config(config_path)
+        settings.post_random_options = personal_settings
+        out_rom, spoiler_log = generate_from_config(settings, config, timer)
+    except Exception as ex:
+        raise Exception(f'Unknown error during generation: {str(ex)}')
+    with timer.stage('get_patch_file'):
+        patch_file = get_patch_file(out_rom, patch_format)
+
+    return patch_file.getvalue(), spoiler_log.getvalue(), timer.timings
+
+
+def generate_batch_seed(
+        settings,
+        seed: str,
+        patch_format: typing.Optional[str] = None
+) -> tuple[bytes, str, dict[str, float]]:
+    """
+    Generate one seed of a batch from settings that were parsed once for
+    the whole batch.  Returns the same values as generate_seed.
+    """
+    timer = timing.StageTimer()
+    settings.seed = seed
+    try:
+        out_rom, spoiler_log = generate_from_settings(settings, timer)
+    except Exception as ex:
+        raise Exception(f'Unknown error during generation: {str(ex)}')
+    with timer.stage('get_patch_file'):
+        patch_file = get_patch_file(out_rom, patch_format)
+
+    return patch_file.getvalue(), spoiler_log.getvalue(), timer.timings
@@ -0,0 +1,360 @@
+"""
+Pool of pre-generated seeds for each preset.
+
+A preset request without a fixed seed or personalization can be answered
+with any seed generated from that preset, so a few are kept ready on disk
+under RDI_SEED_POOL_DIR.  GenerateView takes one when such a request comes
+in, and the request skips the randomizer altogether.
+
+Each preset's pool refills once it drops below RDI_SEED_POOL_LOW seeds, up
+to RDI_SEED_POOL_HIGH.  RDI_SEED_POOL_SIZES overrides the high watermark
+for single presets (e.g. "STANDARD=10 RACE=0").  The pool is off when
+every preset's size is 0.
+
+Seeds are only pre-generated when the generator is idle (see
+admission.is_idle).  Every web worker starts a filler thread, and a lock
+file makes sure only one of them fills the pool at a time.  The
+fill_seed_pool command fills it on demand.
+
+Seeds only match the current randomizer version, vanilla ROM and patch
+format, so the pool is kept in a directory named for a hash of those.  A
+change to any of them leaves the old seeds behind, and the filler removes
+them.  Seeds are stored with their config (see seedgen.write_config), so
+they can still be re-personalized.
+"""
+
+from django.conf import settings
+
+from ctrando.arguments import arguments
+
+from . import admission, archive, artifacts, patchformats, presets, seedgen, \
+    workerpool
+
+import fcntl
+import functools
+import hashlib
+import logging
+import os
+import shutil
+import threading
+import time
+import typing
+import uuid
+
+logger = logging.getLogger(__name__)
+
+_ZIP = '.zip'
+_CONFIG = '.pkl'
+# Added to the name of a seed that a request has taken
+_TAKEN = '.taken'
+_LOCK_FILE = 'filler.lock'
+
+
+@functools.cache
+def get_fingerprint() -> str:
+    """
+    Get the hash of everything the pooled seeds depend on
+    """
+    rom_hash = hashlib.sha256(artifacts.get_vanilla_rom()).hexdigest()
+    data = '\n'.join((
+        seedgen.get_ctrando_version(), rom_hash, settings.RDI_PATCH_FORMAT))
+    return hashlib.sha256(data.encode()).hexdigest()[:16]
+
+
+@functools.cache
+def _parse_sizes(text: str) -> dict[str, int]:
+    """
+    Parse RDI_SEED_POOL_SIZES.  Bad entries are logged once and left out,
+    so a typo doesn't break every preset request.
+    """
+    preset_names = {preset.name for preset in arguments.Presets}
+    sizes = {}
+    for item in text.replace(',', ' ').split():
+        name, _, size = item.partition('=')
+        try:
+            sizes[name] = int(size)
+        except ValueError:
+            logger.warning('Ignoring bad RDI_SEED_POOL_SIZES entry: %s', item)
+            continue
+        if name not in preset_names:
+            logger.warning('Unknown preset in RDI_SEED_POOL_SIZES: %s', name)
+
+    return sizes
+
+
+def get_limits() -> dict[str, tuple[int, int]]:
+    """
+    Get the low and high watermarks of each pooled preset
+    """
+    sizes = _parse_sizes(settings.RDI_SEED_POOL_SIZES)
+    limits = {}
+    for preset in arguments.Presets:
+        high = sizes.get(preset.name, settings.RDI_SEED_POOL_HIGH)
+        if high > 0:
+            limits[preset.name] = (min(settings.RDI_SEED_POOL_LOW, high), high)
+
+    return limits
+
+
+def _get_dir(preset_name: str) -> str:
+    return os.path.join(
+        settings.RDI_SEED_POOL_DIR, get_fingerprint(), preset_name)
+
+
+def count(preset_name: str) -> int:
+    """
+    Get the number of seeds ready for a preset
+    """
+    try:
+        return sum(name.endswith(_ZIP)
+                   for name in os.listdir(_get_dir(preset_name)))
+    except FileNotFoundError:
+        return 0
+
+
+def take(preset_name: str, patch_format: str
+         ) -> typing.Optional[tuple[str, typing.Optional[str]]]:
+    """
+    Take a seed for a preset out of the pool.  Returns the paths of its zip
+    and stored config, which the caller removes with discard(), or None if
+    the pool has no seed for the preset.
+    """
+    if patch_format != settings.RDI_PATCH_FORMAT \
+            or preset_name not in get_limits():
+        return None
+
+    directory = _get_dir(preset_name)
+    try:
+        names = sorted(os.listdir(directory))
+    except FileNotFoundError:
+        return None
+
+    for name in names:
+        if not name.endswith(_ZIP):
+            continue
+        path = os.path.join(directory, name)
+        try:
+            # Only one worker can rename the file, so only one gets the seed
+            os.rename(path, path + _TAKEN)
+        except FileNotFoundError:
+            continue
+
+        config_path = path[:-len(_ZIP)] + _CONFIG
+        try:
+            os.rename(config_path, config_path + _TAKEN)
+            config_path += _TAKEN
+        except FileNotFoundError:
+            config_path = None
+
+        wake_filler()
+        return path + _TAKEN, config_path
+
+    return None
+
+
+def discard(entry: tuple[str, typing.Optional[str]]):
+    """
+    Remove a seed returned by take()
+    """
+    for path in entry:
+        if path is not None:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+def add_seed(pool: workerpool.RandomizerPool, preset_name: str,
+             on_start: typing.Optional[typing.Callable[[], None]] = None
+             ) -> dict[str, float]:
+    """
+    Generate a seed for a preset in the worker pool and add it to the
+    pool.  Returns the stage timings.
+    """
+    directory = _get_dir(preset_name)
+    os.makedirs(directory, exist_ok=True)
+    entry_id = uuid.uuid4().hex
+    path = os.path.join(directory, entry_id)
+    # Hidden until the seed is complete
+    temp_path = os.path.join(directory, f'.{entry_id}')
+    patch_format = patchformats.get(settings.RDI_PATCH_FORMAT)
+
+    settings_dict = presets.get_settings(preset_name)
+    settings_dict['input_file'] = settings.RDI_VANILLA_ROM_PATH
+    try:
+        future = pool.submit(
+            seedgen.generate_seed, settings_dict, None, patch_format.name,
+            temp_path + _CONFIG, on_start=on_start)
+        patch_data, spoiler_text, timings = future.result()
+        with open(temp_path + _ZIP, 'wb') as file:
+            archive.write_seed_zip(
+                file, patch_data, spoiler_text, patch_format.patch_name)
+
+        # The config goes first so a seed in the pool always has one
+        os.replace(temp_path + _CONFIG, path + _CONFIG)
+        os.replace(temp_path + _ZIP, path + _ZIP)
+    finally:
+        discard((temp_path + _CONFIG, temp_path + _ZIP))
+
+    return timings
+
+
+def prune():
+    """
+    Remove seeds from old fingerprints and leftovers from workers that died
+    """
+    fingerprint = get_fingerprint()
+    try:
+        entries = list(os.scandir(settings.RDI_SEED_POOL_DIR))
+    except FileNotFoundError:
+        return
+
+    for entry in entries:
+        if entry.is_dir() and entry.name != fingerprint:
+            logger.info('Removing outdated seed pool %s', entry.name)
+            shutil.rmtree(entry.path, ignore_errors=True)
+
+    cutoff = time.time() - settings.RDI_JOB_RETENTION
+    for preset_name in get_limits():
+        directory = _get_dir(preset_name)
+        try:
+            leftovers = [entry for entry in os.scandir(directory)
+                         if entry.name.startswith('.')
+                         or entry.name.endswith(_TAKEN)]
+        except FileNotFoundError:
+            continue
+        for entry in leftovers:
+            try:
+                if entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+            except FileNotFoundError:
+                continue
+
+
+class _Filler(threading.Thread):
+    """
+    Thread that refills the pool while the generator is idle
+    """
+
+    def __init__(self):
+        super().__init__(name='seed-pool-filler', daemon=True)
+        self.wake = threading.Event()
+        # Presets between their watermarks that are still being refilled
+        self.filling = set()
+        self.lock_file = None
+
+    def run(self):
+        while True:
+            try:
+                if self.try_lock() and self.fill_next():
+                    continue
+            except Exception:
+                logger.exception('Failed to refill the seed pool')
+
+            self.wake.wait(settings.RDI_SEED_POOL_INTERVAL)
+            self.wake.clear()
+
+    def try_lock(self) -> bool:
+        """
+        Try to become the process that fills the pool
+        """
+        if self.lock_file is not None:
+            return True
+
+        os.makedirs(settings.RDI_SEED_POOL_DIR, exist_ok=True)
+        lock_file = open(
+            os.path.join(settings.RDI_SEED_POOL_DIR, _LOCK_FILE), 'w')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            return False
+
+        self.lock_file = lock_file
+        prune()
+        return True
+
+    def get_next_preset(self) -> typing.Optional[str]:
+        """
+        Get the emptiest preset that needs refilling
+        """
+        next_preset = None
+        lowest_fill = 1
+        for preset_name, (low, high) in get_limits().items():
+            size = count(preset_name)
+            if size < low:
+                self.filling.add(preset_name)
+            elif size >= high:
+                self.filling.discard(preset_name)
+
+            if preset_name in self.filling and size / high < lowest_fill:
+                next_preset = preset_name
+                lowest_fill = size / high
+
+        return next_preset
+
+    def fill_next(self) -> bool:
+        """
+        Add a seed to the pool if one is needed and the generator is idle.
+        Returns whether a seed was added.
+        """
+        preset_name = self.get_next_preset()
+        if preset_name is None or not admission.is_idle():
+            return False
+
+        try:
+            ticket = admission.admit()
+        except admission.Rejected:
+            return False
+        try:
+            add_seed(workerpool.get_pool(), preset_name,
+                     on_start=lambda: admission.wait_for_slot(ticket))
+        finally:
+            admission.release(ticket)
+
+        logger.debug('Added a %s seed to the pool', preset_name)
+        return True
+
+
+_filler: typing.Optional[_Filler] = None
+_filler_lock = threading.Lock()
+
+
+def start_filler():
+    """
+    Start refilling the pool in the background, if it's enabled
+    """
+    global _filler
+    with _filler_lock:
+        if _filler is None and get_limits():
+            _filler = _Filler()
+            _filler.start()
+
+
+def wake_filler():
+    """
+    Have the filler check the pool now, if it runs in this process
+    """
+    if _filler is not None:
+        _filler.wake.set()
+
+
+def render_prometheus() -> str:
+    """
+    Get the number of seeds ready for each preset in the Prometheus text
+    format
+    """
+    limits = get_limits()
+    if not limits:
+        return ''
+
+    lines = [
+        '# HELP rdi_seed_pool_seeds Pre-generated seeds ready by preset',
+        '# TYPE rdi_seed_pool_seeds gauge',
+    ]
+    for preset_name in limits:
+        lines.append(
+            f'rdi_seed_pool_seeds{{preset="{preset_name}"}} '
+            f'{count(preset_name)}')
+
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,296 @@
+/*
+ * Renders the toml builder form from the arg schema embedded in the page
+ * (see tools/create_toml_gen_form.py).
+ *
+ * Each section of the schema gets a tab.  Every field keeps the id_<flag>
+ * id and <flag> name of TomlGenForm, so the form posts as before.  The
+ * controls share a few event handlers on the form instead of each having
+ * its own.
+ *
+ * window.tomlForm.setValue(flag, value) sets a field from a parsed toml
+ * value, and window.tomlForm.reset() sets every field to its default.
+ */
+(function () {
+    "use strict";
+
+    let schema = {};
+
+    // Same as str.title() on the flag name with underscores as spaces
+    function displayName(name) {
+        return name.replace(/_/g, " ").replace(/[a-z]+/gi, (word) =>
+            word[0].toUpperCase() + word.slice(1).toLowerCase());
+    }
+
+    function element(tag, attributes, children) {
+        const elem = document.createElement(tag);
+        for (const name in attributes) {
+            const value = attributes[name];
+            if (value === true) {
+                elem.setAttribute(name, "");
+            } else if (value !== false && value !== undefined) {
+                elem.setAttribute(name, value);
+            }
+        }
+        if (children) {
+            elem.append(...children);
+        }
+        return elem;
+    }
+
+    function group(spec, children) {
+        return element("div", {class: "form-group", title: spec.help}, children);
+    }
+
+    function createToggle(flag, spec) {
+        const id = "id_" + flag;
+        const div = group(spec, [
+            element("input", {
+                type: "checkbox", name: flag, id: id, "data-toggle": "toggle",
+                checked: spec.default}),
+            element("label", {for: id}, [displayName(flag)]),
+        ]);
+        div.className = "form-group form-check pl-0";
+        return [div];
+    }
+
+    function createSlider(flag, spec) {
+        const id = "id_" + flag;
+        return [group(spec, [
+            element("label", {for: id, class: "form-label mr-2"}, [displayName(flag)]),
+            element("input", {
+                type: "range", class: "form-range", name: flag, id: id,
+                min: spec.min, max: spec.max, step: spec.interval,
+                value: spec.default}),
+            element("input", {
+                type: "text", id: id + "_text", form: "none", size: 2,
+                value: spec.default}),
+        ])];
+    }
+
+    function createChoice(flag, spec) {
+        const id = "id_" + flag;
+        const options = spec.choices.map((choice) => element(
+            "option", {value: choice, selected: choice === spec.default}, [choice]));
+        return [group(spec, [
+            element("label", {for: id}, [displayName(flag) + ":"]),
+            element("select", {class: "form-control", name: flag, id: id}, options),
+        ])];
+    }
+
+    function createText(flag, spec) {
+        const id = "id_" + flag;
+        return [group(spec, [
+            element("label", {for: id}, [displayName(flag)]),
+            element("input", {
+                class: "form-control", name: flag, id: id, type: "text",
+                value: spec.default}),
+        ])];
+    }
+
+    function createMultiselect(flag, spec) {
+        const searchId = flag + "_searchbox";
+        const box = element("div", {
+            class: "multiselect border border-primary rounded mb-4 pl-2 pr-2",
+            "data-flag": flag,
+        }, [
+            element("div", {class: "mt-1", title: spec.help}, [
+                element("label", {for: searchId}, ["Search/Filter"]),
+                element("input", {
+                    type: "text", id: searchId, form: "none",
+                    class: "multiselect-search"}),
+            ]),
+            element("label", {}, ["Possible:"]),
+            element("div", {
+                id: flag + "_srclist",
+                class: "multiselect-src choice-list border border-secondary rounded mb-2"}),
+            element("label", {}, ["Selected:"]),
+            element("div", {
+                id: flag + "_destlist",
+                class: "multiselect-dest choice-list border border-secondary rounded mb-2"}),
+        ]);
+        const field = element("input", {type: "hidden", id: "id_" + flag, name: flag});
+        fillMultiselect(box, field, spec, spec.default);
+
+        return [
+            element("label", {title: spec.help}, [displayName(flag) + ":"]),
+            box,
+            field,
+        ];
+    }
+
+    const CONTROLS = {
+        flag: createToggle,
+        int: createSlider,
+        float: createSlider,
+        choice: createChoice,
+        multiselect: createMultiselect,
+        string: createText,
+    };
+
+    function createItem(name) {
+        return element("span", {
+            class: "movable border border-secondary rounded pl-1 pr-1"}, [name]);
+    }
+
+    function getMultiselect(flag) {
+        return document.querySelector('.multiselect[data-flag="' + CSS.escape(flag) + '"]');
+    }
+
+    // Write the selected items to the field the form posts
+    function updateMultiselectField(box) {
+        const items = Array.from(
+            box.querySelector(".multiselect-dest").children, (item) => item.textContent);
+        document.getElementById("id_" + box.dataset.flag).value = "[" + items.join(", ") + "]";
+    }
+
+    function filterMultiselect(box) {
+        const query = box.querySelector(".multiselect-search").value;
+        for (const item of box.querySelector(".multiselect-src").children) {
+            item.hidden = query.length > 0 && !item.textContent.includes(query);
+        }
+    }
+
+    // Select exactly the given items.  Unknown items are left out.
+    function fillMultiselect(box, field, spec, selected) {
+        const choices = new Set(spec.choices);
+        selected = selected.filter((item) => choices.has(item));
+        if (!spec.allow_duplicates) {
+            selected = Array.from(new Set(selected));
+        }
+        const chosen = new Set(selected);
+        const possible = spec.allow_duplicates
+            ? spec.choices
+            : spec.choices.filter((choice) => !chosen.has(choice));
+
+        box.querySelector(".multiselect-src").replaceChildren(...possible.map(createItem));
+        box.querySelector(".multiselect-dest").replaceChildren(...selected.map(createItem));
+        field.value = "[" + selected.join(", ") + "]";
+        filterMultiselect(box);
+    }
+
+    function moveItem(item) {
+        const box = item.closest(".multiselect");
+        const src = box.querySelector(".multiselect-src");
+        const dest = box.querySelector(".multiselect-dest");
+        const allowDuplicates = schema[box.dataset.flag].allow_duplicates;
+
+        if (item.parentElement === dest) {
+            if (allowDuplicates) {
+                // Every choice stays in the source list
+                item.remove();
+            } else {
+                src.appendChild(item);
+                filterMultiselect(box);
+            }
+        } else if (allowDuplicates) {
+            dest.appendChild(createItem(item.textContent));
+        } else {
+            item.hidden = false;
+            dest.appendChild(item);
+        }
+
+        updateMultiselectField(box);
+    }
+
+    function setValue(flag, value) {
+        const spec = schema[flag];
+        const field = document.getElementById("id_" + flag);
+        if (spec === undefined || field === null) {
+            return;
+        }
+
+        switch (spec.type) {
+            case "flag":
+                field.checked = Boolean(value);
+                if (window.jQuery) {
+                    // Redraw the bootstrap toggle
+                    window.jQuery(field).change();
+                }
+                break;
+            case "int":
+            case "float":
+                field.value = value;
+                document.getElementById(field.id + "_text").value = value;
+                break;
+            case "multiselect":
+                fillMultiselect(getMultiselect(flag), field, spec,
+                    Array.from(value, String));
+                break;
+            default:
+                field.value = value;
+        }
+    }
+
+    function reset() {
+        document.getElementById("status_text").innerHTML = "";
+        for (const flag in schema) {
+            setValue(flag, schema[flag].default);
+        }
+    }
+
+    function onInput(event) {
+        const target = event.target;
+        if (target.type === "range") {
+            document.getElementById(target.id + "_text").value = target.value;
+        } else if (target.classList.contains("multiselect-search")) {
+            filterMultiselect(target.closest(".multiselect"));
+        } else if (target.id.endsWith("_text")) {
+            const slider = document.getElementById(target.id.slice(0, -"_text".length));
+            if (slider !== null && slider.type === "range") {
+                slider.value = target.value;
+            }
+        }
+    }
+
+    function onClick(event) {
+        const item = event.target.closest(".movable");
+        if (item !== null) {
+            moveItem(item);
+        } else if (event.target.id === "reset_to_default") {
+            reset();
+        }
+    }
+
+    function build() {
+        schema = JSON.parse(document.getElementById("arg_schema").textContent);
+        const form = document.getElementById("toml_gen_form");
+
+        const tabs = [];
+        const pages = new Map();
+        for (const flag in schema) {
+            const spec = schema[flag];
+            let page = pages.get(spec.section);
+            if (page === undefined) {
+                page = element("div", {
+                    class: "tab-pane fade show", id: "options-" + spec.section});
+                pages.set(spec.section, page);
+                tabs.push(element("li", {class: "nav-item"}, [
+                    element("a", {
+                        class: "nav-link", "data-toggle": "tab",
+                        href: "#options-" + spec.section,
+                    }, [displayName(spec.section)]),
+                ]));
+            }
+            page.append(...CONTROLS[spec.type](flag, spec));
+        }
+
+        // Add everything at once so the page is only laid out again once
+        document.getElementById("settings_nav_tabs").append(...tabs);
+        document.getElementById("settings_tab_pages").append(...pages.values());
+
+        if (window.jQuery && window.jQuery.fn.bootstrapToggle) {
+            window.jQuery(form).find("input[data-toggle=toggle]").bootstrapToggle();
+        }
+
+        form.addEventListener("input", onInput);
+        form.addEventListener("click", onClick);
+    }
+
+    window.tomlForm = {setValue: setValue, reset: reset};
+
+    if (document.readyState === "loading") {
+        document.addEventListener("DOMContentLoaded", build);
+    } else {
+        build();
+    }
+})();
@@ -0,0 +1,61 @@
+"""
+Static files storage with precompressed copies.
+
+ManifestStaticFilesStorage names each collected file after a hash of its
+contents, so a browser can cache it for good.  This also writes a gzip
+copy (and a brotli copy if brotli is installed) next to each hashed text
+file, so the web server can send it compressed without compressing it on
+every request (nginx's gzip_static and brotli_static, see
+deploy/nginx_static.conf).
+"""
+
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+
+import gzip
+import os
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Images and fonts are compressed already
+COMPRESSED_EXTENSIONS = ('.css', '.js', '.json', '.svg', '.txt', '.html')
+# Smaller files fit in a packet or two anyway
+MIN_COMPRESS_SIZE = 1024
+
+
+def _write_if_smaller(path: str, data: bytes, original_size: int):
+    if len(data) < original_size:
+        with open(path, 'wb') as file:
+            file.write(data)
+
+
+def compress_file(path: str):
+    """
+    Write the .gz and .br copies of a file
+    """
+    with open(path, 'rb') as file:
+        data = file.read()
+    if len(data) < MIN_COMPRESS_SIZE:
+        return
+
+    # A fixed mtime keeps the output the same between runs
+    _write_if_smaller(
+        f'{path}.gz', gzip.compress(data, compresslevel=9, mtime=0), len(data))
+    if brotli is not None:
+        _write_if_smaller(f'{path}.br', brotli.compress(data), len(data))
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run=dry_run, **options)
+        if dry_run:
+            return
+
+        # Only the hashed names are linked from the pages
+        for name in set(self.hashed_files.values()):
+            if name.endswith(COMPRESSED_EXTENSIONS):
+                path = self.path(name)
+                if os.path.exists(path):
+                    compress_file(path)
@@ -1,3 +1,1691 @@
-from django.test import TestCase
+from django.conf import settings
+from django.core.management import ManagementUtility, call_command
+from django.core.management.base import CommandError
+from django.test import Client, SimpleTestCase, override_settings
+from django.urls import reverse
 
-# Create your tests here.
+from ctrando.arguments import arguments
+
+from . import (
+    admission, argschema, artifacts, batch, bps, buildsteps, ips, jobs,
+    lrucache, pagecache, patchformats, personalization, presets, resultcache,
+    romdelta, seedgen, seedpool, timing, validation, workerpool)
+
+import concurrent.futures
+import dataclasses
+import functools
+import gzip
+import hashlib
+import io
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import toml
+import tomllib
+import zipfile
+from unittest import mock
+
+
+def make_rom(size: int, seed: int = 0) -> bytes:
+    """
+    Get repeatable random data to stand in for a ROM
+    """
+    return random.Random(seed).randbytes(size)
+
+
+def modify(source: bytes, changes: dict[int, bytes]) -> bytes:
+    """
+    Copy the source with the data at each offset replaced
+    """
+    target = bytearray(source)
+    for offset, data in changes.items():
+        target[offset:offset + len(data)] = data
+    return bytes(target)
+
+
+def use_temp_dir(test_case, **paths: str) -> str:
+    """
+    Point path settings at a temporary directory for the rest of a test
+    """
+    temp_dir = test_case.enterContext(tempfile.TemporaryDirectory())
+    test_case.enterContext(override_settings(**{
+        name: os.path.join(temp_dir, path) for name, path in paths.items()
+    }))
+    return temp_dir
+
+
+class BPSTests(SimpleTestCase):
+    def setUp(self):
+        self.source = make_rom(0x10000)
+
+    def assertRoundTrip(self, source: bytes, target: bytes, **kwargs) -> bytes:
+        patch = bps.create_patch(source, target, **kwargs)
+        self.assertEqual(bps.apply_patch(source, patch), target)
+        return patch
+
+    def test_unchanged(self):
+        patch = self.assertRoundTrip(self.source, self.source)
+        self.assertLess(len(patch), 32)
+
+    def test_scattered_changes(self):
+        target = modify(self.source, {
+            0: b'\x01\x02',
+            0x1001: make_rom(300, seed=1),
+            0x8000: b'\xff',
+            len(self.source) - 1: b'\x00',
+        })
+        self.assertRoundTrip(self.source, target)
+
+    def test_changes_a_few_bytes_apart(self):
+        # Closer than _MIN_SOURCE_READ, so folded into one TargetRead
+        target = modify(self.source, {0x100: b'\x00', 0x102: b'\x00'})
+        self.assertRoundTrip(self.source, target)
+
+    def test_repeated_byte_runs(self):
+        target = modify(self.source, {
+            0x200: b'\xaa' * 8,
+            0x400: b'\x00' * 5000,
+            0x3000: b'\x55' * 7,
+        })
+        patch = self.assertRoundTrip(self.source, target)
+        # The long run is stored as a TargetCopy, not 5000 bytes of data
+        self.assertLess(len(patch), 200)
+
+    def test_larger_target(self):
+        target = self.source + b'\x00' * 100 + make_rom(100, seed=2)
+        self.assertRoundTrip(self.source, target)
+
+    def test_smaller_target(self):
+        target = modify(self.source[:0x8000], {0x10: b'\x99'})
+        self.assertRoundTrip(self.source, target)
+
+    def test_metadata(self):
+        target = modify(self.source, {0x10: b'\x99'})
+        self.assertRoundTrip(self.source, target, metadata=b'<rdi/>')
+
+    def test_wrong_source(self):
+        patch = bps.create_patch(self.source, modify(self.source, {0: b'x'}))
+        with self.assertRaisesMessage(ValueError, 'Source data'):
+            bps.apply_patch(make_rom(len(self.source), seed=3), patch)
+
+    def test_corrupt_patch(self):
+        patch = bytearray(
+            bps.create_patch(self.source, modify(self.source, {0: b'x'})))
+        patch[6] ^= 0xff
+        with self.assertRaisesMessage(ValueError, 'checksum'):
+            bps.apply_patch(self.source, patch)
+
+    def test_not_a_patch(self):
+        with self.assertRaisesMessage(ValueError, 'Not a BPS patch'):
+            bps.apply_patch(self.source, b'PATCH' + bytes(20))
+
+    def test_number_encoding(self):
+        for value in (0, 1, 0x7f, 0x80, 0x407f, 0x4080, 2 ** 32 + 5):
+            buffer = bytearray()
+            bps._encode_number(value, buffer)
+            self.assertEqual(bps._decode_number(buffer, 0),
+                             (value, len(buffer)))
+
+
+class BPSDeltaTests(SimpleTestCase):
+    def test_moved_data(self):
+        source = make_rom(0x10000)
+        # Move a block of the source and change a few bytes elsewhere
+        target = modify(source, {
+            0x8000: source[0x1000:0x1400],
+            0x20: b'\x01',
+        })
+        patch = bps.create_patch(source, target, delta=True)
+        self.assertEqual(bps.apply_patch(source, patch), target)
+        # The moved block is a SourceCopy, not 1 KiB of data
+        self.assertLess(len(patch), 100)
+        self.assertLess(len(patch), len(bps.create_patch(source, target)))
+
+    def test_moved_data_next_to_changes(self):
+        source = make_rom(0x10000)
+        target = modify(source, {
+            0x8000: make_rom(50, seed=1) + source[0x100:0x200]
+            + b'\x00' * 40 + source[0x9000:0x9100],
+            # A larger target, partly copied from the source
+            len(source): source[0x4000:0x4100],
+        })
+        patch = bps.create_patch(source, target, delta=True)
+        self.assertEqual(bps.apply_patch(source, patch), target)
+
+
+class IPSTests(SimpleTestCase):
+    def setUp(self):
+        self.source = make_rom(0x10000)
+
+    def assertRoundTrip(self, source: bytes, target: bytes) -> bytes:
+        patch = ips.create_patch(source, target)
+        self.assertEqual(ips.apply_patch(source, patch), target)
+        return patch
+
+    def test_scattered_changes(self):
+        target = modify(self.source, {
+            0: b'\x01\x02',
+            0x1001: make_rom(300, seed=1),
+            0x8000: b'\xff',
+            len(self.source) - 1: b'\x00',
+        })
+        self.assertRoundTrip(self.source, target)
+
+    def test_repeated_byte_runs(self):
+        target = modify(self.source, {
+            0x200: make_rom(5, seed=1) + b'\xaa' * 16 + make_rom(5, seed=2),
+            0x400: b'\x00' * 15,
+        })
+        patch = self.assertRoundTrip(self.source, target)
+        self.assertIn(b'\x00\x00\x00\x10\xaa', patch)
+
+    def test_long_records(self):
+        # Longer than a single record can hold
+        source = make_rom(0x30000)
+        target = modify(source, {
+            0x100: make_rom(0x12000, seed=1),
+            0x18000: b'\x55' * 0x12000,
+        })
+        self.assertRoundTrip(source, target)
+
+    def test_larger_target(self):
+        target = self.source + b'\x00' * 100 + make_rom(100, seed=2)
+        self.assertRoundTrip(self.source, target)
+
+    def test_eof_offset(self):
+        # A record at offset 0x454f46 would read as the end of the patch
+        source = make_rom(ips._EOF_OFFSET + 0x1000)
+        for changes in (
+                {ips._EOF_OFFSET: b'\x01\x02\x03'},
+                {ips._EOF_OFFSET: b'\x00' * 32},
+                {ips._EOF_OFFSET - 1: b'\x01', ips._EOF_OFFSET: b'\x00' * 32}):
+            with self.subTest(changes=changes):
+                self.assertRoundTrip(source, modify(source, changes))
+
+    def test_target_at_eof_offset(self):
+        # Data added past the source starts at the EOF offset
+        source = make_rom(ips._EOF_OFFSET)
+        self.assertRoundTrip(source, source + b'\x07' * 40)
+
+    def test_unsupported(self):
+        self.assertFalse(ips.supports(self.source, self.source[:100]))
+        with self.assertRaises(ValueError):
+            ips.create_patch(self.source, self.source[:100])
+        with self.assertRaises(ValueError):
+            ips.create_patch(b'', bytes(ips.MAX_SIZE + 1))
+
+    def test_truncated_patch(self):
+        patch = ips.create_patch(self.source, modify(self.source, {9: b'xyz'}))
+        with self.assertRaisesMessage(ValueError, 'Truncated'):
+            ips.apply_patch(self.source, patch[:-5])
+
+
+class ROMDeltaTests(SimpleTestCase):
+    FORMATS = (
+        (romdelta.create_xor_delta, romdelta.apply_xor_delta),
+        (romdelta.create_range_list, romdelta.apply_range_list),
+    )
+
+    def setUp(self):
+        self.source = make_rom(0x10000)
+
+    def assertRoundTrip(self, source: bytes, target: bytes):
+        for create, apply in self.FORMATS:
+            with self.subTest(create.__name__):
+                delta = create(source, target)
+                self.assertEqual(apply(source, delta), target)
+
+    def test_unchanged(self):
+        self.assertRoundTrip(self.source, self.source)
+        self.assertEqual(
+            len(romdelta.create_xor_delta(self.source, self.source)),
+            romdelta._HEADER.size)
+
+    def test_scattered_changes(self):
+        target = modify(self.source, {
+            0: b'\x01\x02',
+            # Across a block boundary
+            0xffe: make_rom(300, seed=1),
+            0x8000: b'\xff',
+            len(self.source) - 1: b'\x00',
+        })
+        self.assertRoundTrip(self.source, target)
+
+    def test_nearby_changes(self):
+        # Gaps shorter than a record header stay in one record
+        source = bytes(0x2000)
+        target = modify(source, {0x100: b'\x01', 0x104: b'\x01'})
+        delta = romdelta.create_range_list(source, target)
+        self.assertEqual(romdelta._find_runs(romdelta._xor(source, target)),
+                         [(0x100, 0x105)])
+        self.assertEqual(
+            len(delta), romdelta._HEADER.size + romdelta._RECORD.size + 5)
+
+        target = modify(source, {0x100: b'\x01', 0x109: b'\x01'})
+        self.assertEqual(romdelta._find_runs(romdelta._xor(source, target)),
+                         [(0x100, 0x101), (0x109, 0x10a)])
+
+    def test_larger_target(self):
+        target = self.source + b'\x00' * 100 + make_rom(100, seed=2)
+        self.assertRoundTrip(self.source, target)
+
+    def test_smaller_target(self):
+        self.assertRoundTrip(self.source, self.source[:0x7fff])
+
+    def test_wrong_source(self):
+        delta = romdelta.create_xor_delta(
+            self.source, modify(self.source, {0: b'x'}))
+        with self.assertRaisesMessage(ValueError, 'Source data'):
+            romdelta.apply_xor_delta(make_rom(len(self.source), seed=3), delta)
+
+    def test_wrong_format(self):
+        delta = romdelta.create_xor_delta(
+            self.source, modify(self.source, {0: b'x'}))
+        with self.assertRaisesMessage(ValueError, 'Wrong ROM delta format'):
+            romdelta.apply_range_list(self.source, delta)
+
+    def test_truncated_delta(self):
+        delta = romdelta.create_range_list(
+            self.source, modify(self.source, {0x10: b'xyz'}))
+        with self.assertRaises(ValueError):
+            romdelta.apply_range_list(self.source, delta[:-1])
+        with self.assertRaisesMessage(ValueError, 'Truncated'):
+            romdelta.apply_range_list(self.source, delta[:10])
+
+
+class PatchFormatTests(SimpleTestCase):
+    def test_round_trip(self):
+        source = make_rom(0x10000)
+        target = modify(source, {0x100: b'\x00' * 20, 0x5000: b'abc'})
+        with override_settings(RDI_TRUSTED_OUTPUT=True):
+            for name, patch_format in patchformats.FORMATS.items():
+                with self.subTest(name):
+                    patch = patchformats.create_patch(name, source, target)
+                    self.assertEqual(
+                        patch_format.apply_patch(source, patch), target)
+
+    @override_settings(RDI_PATCH_FORMAT='ips', RDI_TRUSTED_OUTPUT=False)
+    def test_get(self):
+        self.assertEqual(patchformats.get().name, 'ips')
+        self.assertEqual(patchformats.get('bps-delta').name, 'bps-delta')
+        with self.assertRaisesMessage(ValueError, 'Unknown patch format'):
+            patchformats.get('ups')
+        with self.assertRaisesMessage(ValueError, 'not enabled'):
+            patchformats.get('xor')
+        self.assertNotIn('xor', dict(patchformats.get_choices()))
+
+    def test_unsupported(self):
+        source = make_rom(0x1000)
+        with self.assertRaisesMessage(ValueError, "can't patch this ROM"):
+            patchformats.create_patch('ips', source, source[:10])
+
+
+class ResultCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.temp_dir = use_temp_dir(self, RDI_RESULT_CACHE_DIR='cache')
+        self.settings_dict = {'seed': 'abc', 'mode': 'std'}
+
+    def make_file(self, name: str, size: int) -> str:
+        path = os.path.join(self.temp_dir, name)
+        with open(path, 'wb') as file:
+            file.write(make_rom(size))
+        return path
+
+    def test_cache_key(self):
+        key = resultcache.get_cache_key(self.settings_dict, None, 'bps')
+        self.assertEqual(
+            resultcache.get_cache_key(
+                {'mode': 'std', 'seed': 'abc'}, None, 'bps'), key)
+        self.assertNotEqual(
+            resultcache.get_cache_key(self.settings_dict, None, 'ips'), key)
+        self.assertNotEqual(
+            resultcache.get_cache_key(
+                self.settings_dict, {'name': 'Crono'}, 'bps'), key)
+
+    def test_random_seed_not_cached(self):
+        for seed in (None, '', '  '):
+            with self.subTest(seed=seed):
+                self.assertIsNone(resultcache.get_cache_key(
+                    {'seed': seed, 'mode': 'std'}, None, 'bps'))
+        self.assertIsNone(resultcache.get_cache_key({}, None, 'bps'))
+
+    def test_hit_and_miss(self):
+        key = resultcache.get_cache_key(self.settings_dict, None, 'bps')
+        self.assertIsNone(resultcache.get(key))
+
+        resultcache.put(key, self.make_file('result.zip', 100),
+                        self.make_file('config.pkl', 10))
+        path = resultcache.get(key)
+        with open(path, 'rb') as file:
+            self.assertEqual(file.read(), make_rom(100))
+        with open(resultcache.get_config(key), 'rb') as file:
+            self.assertEqual(file.read(), make_rom(10))
+
+    def test_no_config(self):
+        resultcache.put('key', self.make_file('result.zip', 100))
+        self.assertIsNotNone(resultcache.get('key'))
+        self.assertIsNone(resultcache.get_config('key'))
+
+    @override_settings(RDI_RESULT_CACHE_MAX_BYTES=250)
+    def test_eviction(self):
+        def put(key: str):
+            # Separate files, since the cache links rather than copies them
+            resultcache.put(key, self.make_file(f'{key}.zip', 90),
+                            self.make_file(f'{key}.pkl', 10))
+
+        put('old')
+        put('used')
+        # Entries are ordered by their mtime, so set it rather than sleep
+        os.utime(resultcache.get('old'), (1000, 1000))
+        os.utime(resultcache.get('used'), (1000, 1000))
+        resultcache.get('used')
+
+        put('new')
+        self.assertIsNone(resultcache.get('old'))
+        self.assertIsNone(resultcache.get_config('old'))
+        self.assertIsNotNone(resultcache.get('used'))
+        self.assertIsNotNone(resultcache.get('new'))
+        self.assertEqual(
+            sorted(os.listdir(os.path.join(self.temp_dir, 'cache'))),
+            ['new.pkl', 'new.zip', 'used.pkl', 'used.zip'])
+
+
+@override_settings(RDI_RATE_LIMIT_PER_MINUTE=60, RDI_RATE_LIMIT_BURST=3)
+class RateLimitTests(SimpleTestCase):
+    def setUp(self):
+        use_temp_dir(self, RDI_ADMISSION_DB='admission.sqlite3')
+        self.time = self.enterContext(mock.patch.object(admission, 'time'))
+        self.time.time.return_value = 1000.0
+
+    def assertRejected(self, client: str, retry_after: int, cost: int = 1):
+        with self.assertRaises(admission.Rejected) as context:
+            admission.check_rate(client, cost)
+        self.assertEqual(context.exception.status, 429)
+        self.assertEqual(context.exception.retry_after, retry_after)
+
+    def test_burst(self):
+        for _ in range(3):
+            admission.check_rate('a')
+        self.assertRejected('a', retry_after=1)
+        # Other clients have buckets of their own
+        admission.check_rate('b')
+
+    def test_refill(self):
+        for _ in range(3):
+            admission.check_rate('a')
+        self.time.time.return_value = 1001.5
+        admission.check_rate('a')
+        self.assertRejected('a', retry_after=1)
+
+        # The bucket never holds more than the burst
+        self.time.time.return_value = 2000.0
+        for _ in range(3):
+            admission.check_rate('a')
+        self.assertRejected('a', retry_after=1)
+
+    def test_cost(self):
+        admission.check_rate('a', cost=2)
+        self.assertRejected('a', retry_after=1, cost=2)
+        admission.check_rate('a')
+
+    def test_cost_over_burst(self):
+        # Needs a full bucket and leaves it in debt
+        admission.check_rate('a', cost=5)
+        self.assertRejected('a', retry_after=3)
+        self.time.time.return_value = 1003.0
+        admission.check_rate('a')
+
+    def test_full_buckets_removed(self):
+        admission.check_rate('a')
+        self.time.time.return_value = 1010.0
+        admission.check_rate('b')
+        clients = [row[0] for row in admission._connect().execute(
+            'SELECT client FROM buckets')]
+        self.assertEqual(clients, ['b'])
+
+    @override_settings(RDI_RATE_LIMIT_PER_MINUTE=0)
+    def test_disabled(self):
+        for _ in range(10):
+            admission.check_rate('a')
+
+
+@override_settings(RDI_MAX_GENERATIONS=1, RDI_ADMISSION_QUEUE=1,
+                   RDI_ADMISSION_LEASE=60)
+class AdmissionTests(SimpleTestCase):
+    def setUp(self):
+        use_temp_dir(self, RDI_ADMISSION_DB='admission.sqlite3')
+
+    def get_tickets(self) -> dict[str, str]:
+        return dict(admission._connect().execute(
+            'SELECT id, state FROM tickets'))
+
+    def add_ticket(self, pid: int, state: str, created: float,
+                   started=None) -> str:
+        ticket = f'ticket-{len(self.get_tickets())}'
+        admission._connect().execute(
+            'INSERT INTO tickets (id, pid, state, created, started) '
+            'VALUES (?, ?, ?, ?, ?)', (ticket, pid, state, created, started))
+        return ticket
+
+    def assertBusy(self):
+        with self.assertRaises(admission.Rejected) as context:
+            admission.admit()
+        self.assertEqual(context.exception.status, 503)
+
+    def test_queue_limit(self):
+        # One job for the free slot and one in the queue
+        first = admission.admit()
+        second = admission.admit()
+        self.assertBusy()
+
+        admission.wait_for_slot(first)
+        self.assertEqual(self.get_tickets(), {
+            first: admission.RUNNING, second: admission.WAITING})
+        self.assertBusy()
+        self.assertFalse(admission.is_idle())
+
+        admission.release(first)
+        admission.wait_for_slot(second)
+        admission.admit()
+        admission.release(second)
+        self.assertEqual(len(self.get_tickets()), 1)
+
+    def test_create_ticket_skips_queue(self):
+        admission.admit()
+        admission.admit()
+        self.assertBusy()
+        ticket = admission.create_ticket()
+        self.assertEqual(self.get_tickets()[ticket], admission.WAITING)
+
+    def test_idle(self):
+        self.assertTrue(admission.is_idle())
+        ticket = admission.admit()
+        self.assertFalse(admission.is_idle())
+        admission.release(ticket)
+        self.assertTrue(admission.is_idle())
+
+    @override_settings(RDI_MAX_GENERATIONS=0)
+    def test_disabled(self):
+        ticket = admission.admit()
+        self.assertEqual(ticket, '')
+        admission.wait_for_slot(ticket)
+        admission.release(ticket)
+        self.assertTrue(admission.is_idle())
+
+    def test_reclaim_dead_worker(self):
+        process = subprocess.Popen([sys.executable, '-c', ''])
+        process.wait()
+        self.add_ticket(process.pid, admission.RUNNING, time.time())
+        # The slot is free again once the ticket is reclaimed
+        ticket = admission.admit()
+        admission.wait_for_slot(ticket)
+        self.assertEqual(self.get_tickets(), {ticket: admission.RUNNING})
+
+    def test_reclaim_after_lease(self):
+        now = time.time()
+        self.add_ticket(os.getpid(), admission.WAITING, now - 120)
+        # A running ticket's lease counts from when it started
+        running = self.add_ticket(
+            os.getpid(), admission.RUNNING, now - 120, now - 30)
+        admission.is_idle()
+        self.assertEqual(self.get_tickets(), {running: admission.RUNNING})
+
+        admission._connect().execute(
+            'UPDATE tickets SET started = ?', (now - 120,))
+        self.assertTrue(admission.is_idle())
+        self.assertEqual(self.get_tickets(), {})
+
+    def test_reclaimed_while_waiting(self):
+        ticket = admission.admit()
+        admission.release(ticket)
+        # The job still gets its slot, and holds it against other jobs
+        admission.wait_for_slot(ticket)
+        self.assertEqual(self.get_tickets(), {ticket: admission.RUNNING})
+        self.assertFalse(admission.is_idle())
+
+    @override_settings(RDI_ADMISSION_LEASE=0.3)
+    def test_wait_timeout(self):
+        # A slot held by a job that started "later", so it isn't reclaimed
+        self.add_ticket(os.getpid(), admission.RUNNING, time.time(),
+                        time.time() + 60)
+        ticket = admission.create_ticket()
+        with mock.patch.object(admission, '_POLL_INTERVAL', 0.01):
+            with self.assertRaises(admission.SlotTimeout):
+                admission.wait_for_slot(ticket)
+
+    def test_metrics(self):
+        admission.wait_for_slot(admission.admit())
+        admission.admit()
+        metrics = admission.render_prometheus()
+        self.assertIn('rdi_admission_jobs{state="waiting"} 1', metrics)
+        self.assertIn('rdi_admission_jobs{state="running"} 1', metrics)
+
+
+class JobTests(SimpleTestCase):
+    def setUp(self):
+        self.temp_dir = use_temp_dir(
+            self, RDI_JOB_DIR='jobs', RDI_RESULT_CACHE_DIR='cache',
+            RDI_METRICS_DIR='metrics')
+
+    def get_status(self, job_id: str):
+        return self.client.get(reverse('generator:job_status', args=[job_id]))
+
+    def download(self, job_id: str):
+        return self.client.get(
+            reverse('generator:job_download', args=[job_id]))
+
+    def finish(self, job_id: str, result=None, exception=None,
+               cache_key=None):
+        """
+        Finish a job the way the worker pool would
+        """
+        future = concurrent.futures.Future()
+        if exception is not None:
+            future.set_exception(exception)
+        else:
+            future.set_result(result)
+        jobs._on_job_finished(job_id, cache_key, timing.StageTimer(),
+                              'ct-mod.bps', future)
+
+    def test_unknown_job(self):
+        job_id = '00000000-0000-0000-0000-000000000000'
+        self.assertEqual(self.get_status(job_id).status_code, 404)
+        self.assertEqual(self.download(job_id).status_code, 404)
+
+    def test_queued(self):
+        job_id = jobs._create_job(jobs.QUEUED)
+        response = self.get_status(job_id)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {
+            'job_id': job_id,
+            'status_url': f'/job/{job_id}',
+            'download_url': f'/job/{job_id}/download',
+            'state': jobs.QUEUED,
+        })
+        self.assertEqual(self.download(job_id).status_code, 404)
+
+    def test_done(self):
+        job_id = jobs._create_job(jobs.QUEUED)
+        self.finish(job_id, (b'patch', 'spoiler', {'generate': 0.25}),
+                    cache_key='key')
+
+        response = self.get_status(job_id)
+        self.assertEqual(response.json()['state'], jobs.DONE)
+        self.assertNotIn('repersonalize_url', response.json())
+
+        response = self.download(job_id)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Disposition'],
+                         'attachment; filename="ct-mod.zip"')
+        self.assertIn('generate;dur=250.0', response['Server-Timing'])
+        data = b''.join(response.streaming_content)
+        response.close()
+        with zipfile.ZipFile(io.BytesIO(data)) as zip_file:
+            self.assertEqual(zip_file.read('ct-mod.bps'), b'patch')
+
+        # Fixed seeds are added to the result cache
+        self.assertIsNotNone(resultcache.get('key'))
+
+    def test_failed(self):
+        job_id = jobs._create_job(jobs.QUEUED)
+        self.finish(job_id, exception=ValueError('Bad settings'))
+        response = self.get_status(job_id)
+        self.assertEqual(response.json()['state'], jobs.FAILED)
+        self.assertEqual(response.json()['error'], 'Bad settings')
+        self.assertEqual(self.download(job_id).status_code, 404)
+
+    def test_batch_progress(self):
+        job_id = jobs._create_job(jobs.QUEUED)
+        jobs._write_status(job_id, jobs.RUNNING, completed=2, total=5)
+        data = self.get_status(job_id).json()
+        self.assertEqual(
+            (data['state'], data['completed'], data['total']),
+            (jobs.RUNNING, 2, 5))
+
+    def test_cached_result(self):
+        result_path = os.path.join(self.temp_dir, 'result.zip')
+        config_path = os.path.join(self.temp_dir, 'config.pkl')
+        with open(result_path, 'wb') as file:
+            file.write(b'zip')
+        with open(config_path, 'wb') as file:
+            file.write(b'config')
+
+        job_id = jobs.create_finished(result_path, config_path)
+        data = self.get_status(job_id).json()
+        self.assertEqual(data['state'], jobs.DONE)
+        self.assertEqual(data['repersonalize_url'],
+                         f'/job/{job_id}/repersonalize')
+
+        response = self.download(job_id)
+        self.assertEqual(b''.join(response.streaming_content), b'zip')
+        response.close()
+
+    @override_settings(RDI_JOB_RETENTION=60)
+    def test_prune(self):
+        old_job = jobs._create_job(jobs.QUEUED)
+        os.utime(jobs.get_job_dir(old_job), (1000, 1000))
+        new_job = jobs._create_job(jobs.QUEUED)
+        jobs.prune_jobs()
+        self.assertEqual(self.get_status(old_job).status_code, 404)
+        self.assertEqual(self.get_status(new_job).status_code, 200)
+
+    @override_settings(RDI_JOB_PRUNE_INTERVAL=60)
+    def test_prune_interval(self):
+        self.enterContext(mock.patch.object(jobs, '_last_prune', None))
+        with mock.patch.object(jobs, 'prune_jobs') as prune_jobs, \
+                mock.patch.object(jobs.time, 'monotonic') as monotonic:
+            monotonic.return_value = 1000.0
+            jobs._create_job(jobs.QUEUED)
+            monotonic.return_value = 1059.0
+            jobs._create_job(jobs.QUEUED)
+            self.assertEqual(prune_jobs.call_count, 1)
+
+            monotonic.return_value = 1060.0
+            jobs._create_job(jobs.QUEUED)
+            self.assertEqual(prune_jobs.call_count, 2)
+
+
+class ValidationTests(SimpleTestCase):
+    def setUp(self):
+        validation.clear_cache()
+        self.addCleanup(validation.clear_cache)
+
+    def round_trip(self, cleaned_data: dict) -> dict:
+        """
+        Build the settings the way the TOML builder did before: convert the
+        list fields, dump the data to TOML and parse it back
+        """
+        data_dict = {}
+        for name, value in cleaned_data.items():
+            if isinstance(value, str):
+                if value.startswith('[') and value.endswith(']'):
+                    if len(value) != 2:
+                        data_dict[name] = [x.replace("'", '').strip()
+                                           for x in value[1:-1].split(',')]
+                    else:
+                        data_dict[name] = []
+                elif len(value) > 0:
+                    data_dict[name] = value
+            else:
+                data_dict[name] = value
+        return tomllib.loads(toml.dumps(data_dict))
+
+    def test_matches_round_trip(self):
+        cleaned_data = {
+            'seed': 'abc123',
+            'blank': '',
+            'items': "['Bronze Fist', 'Hero Medal']",
+            'one_item': "['Moon Stone']",
+            'no_items': '[]',
+            'count': 3,
+            'zero': 0,
+            'scale': 1.5,
+            'flag': True,
+            'off': False,
+            'unset': None,
+            'text_with_quote': "it's",
+        }
+        self.assertEqual(validation.form_to_settings_dict(cleaned_data),
+                         self.round_trip(cleaned_data))
+
+        for name, value in cleaned_data.items():
+            with self.subTest(name):
+                self.assertEqual(
+                    validation.form_to_settings_dict({name: value}),
+                    self.round_trip({name: value}))
+
+    def test_hash(self):
+        self.assertEqual(
+            validation.get_settings_hash({'a': 1, 'b': [1, 2]}),
+            validation.get_settings_hash({'b': [1, 2], 'a': 1}))
+        self.assertNotEqual(
+            validation.get_settings_hash({'a': 1}),
+            validation.get_settings_hash({'a': 2}))
+
+    @override_settings(RDI_VALIDATION_CACHE_SIZE=4)
+    def test_memoized(self):
+        with mock.patch.object(validation, '_check_settings',
+                               return_value='Bad settings') as check:
+            self.assertEqual(validation.validate({'a': 1}), 'Bad settings')
+            self.assertEqual(validation.validate({'a': 1}), 'Bad settings')
+            self.assertEqual(check.call_count, 1)
+            validation.validate({'a': 2})
+            self.assertEqual(check.call_count, 2)
+
+
+class LRUCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.cache = lrucache.LRUCache('RDI_VALIDATION_CACHE_SIZE')
+
+    @override_settings(RDI_VALIDATION_CACHE_SIZE=2)
+    def test_hits_and_misses(self):
+        create = mock.Mock(side_effect=['one', 'two'])
+        self.assertEqual(self.cache.get('a', create), 'one')
+        self.assertEqual(self.cache.get('a', create), 'one')
+        self.assertEqual(self.cache.get('b', create), 'two')
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 2))
+        self.assertEqual(create.call_count, 2)
+
+        self.cache.clear()
+        self.assertEqual((len(self.cache), self.cache.hits, self.cache.misses),
+                         (0, 0, 0))
+
+    @override_settings(RDI_VALIDATION_CACHE_SIZE=2)
+    def test_eviction(self):
+        self.cache.get('a', lambda: 'a')
+        self.cache.get('b', lambda: 'b')
+        # Using a makes b the least recently used
+        self.cache.get('a', lambda: 'unused')
+        self.cache.get('c', lambda: 'c')
+        self.assertEqual(len(self.cache), 2)
+
+        self.assertEqual(self.cache.get('a', lambda: 'new a'), 'a')
+        self.assertEqual(self.cache.get('b', lambda: 'new b'), 'new b')
+
+    @override_settings(RDI_VALIDATION_CACHE_SIZE=0)
+    def test_disabled(self):
+        create = mock.Mock(return_value='value')
+        self.cache.get('a', create)
+        self.cache.get('a', create)
+        self.assertEqual(create.call_count, 2)
+        self.assertEqual(
+            (len(self.cache), self.cache.hits, self.cache.misses), (0, 0, 0))
+
+    def test_data_hash(self):
+        self.assertEqual(lrucache.get_data_hash({'a': 1, 'b': {'c': 2}}),
+                         lrucache.get_data_hash({'b': {'c': 2}, 'a': 1}))
+        self.assertNotEqual(lrucache.get_data_hash({'a': 1}),
+                            lrucache.get_data_hash({'a': '1'}))
+
+
+# Worker pool jobs are pickled by name, so they have to be module level
+def get_worker_pid() -> int:
+    return os.getpid()
+
+
+def sleep_in_worker(seconds: float):
+    time.sleep(seconds)
+
+
+def exit_worker():
+    os._exit(3)
+
+
+def fail_in_worker():
+    raise ValueError('Bad settings')
+
+
+class WorkerPoolTests(SimpleTestCase):
+    def start_pool(self, timeout: float = 30, max_jobs: int = 10):
+        pool = workerpool.RandomizerPool(
+            size=1, timeout=timeout, max_jobs=max_jobs)
+        self.addCleanup(pool.shutdown)
+        return pool
+
+    def test_result(self):
+        pool = self.start_pool()
+        self.assertNotEqual(pool.submit(get_worker_pid).result(), os.getpid())
+        with self.assertRaisesMessage(ValueError, 'Bad settings'):
+            pool.submit(fail_in_worker).result()
+
+    def test_timeout(self):
+        pool = self.start_pool(timeout=0.5)
+        pid = pool.submit(get_worker_pid).result()
+        with self.assertLogs('generator.workerpool', 'ERROR'):
+            with self.assertRaises(workerpool.WorkerTimeout):
+                pool.submit(sleep_in_worker, 30).result()
+        # The stuck worker is replaced
+        self.assertNotEqual(pool.submit(get_worker_pid).result(), pid)
+
+    def test_worker_died(self):
+        pool = self.start_pool()
+        pid = pool.submit(get_worker_pid).result()
+        with self.assertLogs('generator.workerpool', 'ERROR'):
+            with self.assertRaisesMessage(workerpool.WorkerDied, 'code 3'):
+                pool.submit(exit_worker).result()
+        self.assertNotEqual(pool.submit(get_worker_pid).result(), pid)
+
+    def test_recycle(self):
+        pool = self.start_pool(max_jobs=2)
+        pids = [pool.submit(get_worker_pid).result() for _ in range(5)]
+        self.assertEqual(len(set(pids)), 3)
+        self.assertEqual(pids[0], pids[1])
+        self.assertEqual(pids[2], pids[3])
+        self.assertNotEqual(pids[1], pids[2])
+
+    def test_on_start_fails(self):
+        pool = self.start_pool()
+        on_start = mock.Mock(side_effect=admission.SlotTimeout('No slot'))
+        with self.assertRaises(admission.SlotTimeout):
+            pool.submit(exit_worker, on_start=on_start).result()
+        on_start.assert_called_once_with()
+        # The job never ran, so the worker is still the same
+        pid = pool.submit(get_worker_pid).result()
+        self.assertEqual(pool.submit(get_worker_pid).result(), pid)
+
+
+class FakePool:
+    """
+    Stands in for the randomizer pool.  Jobs start as soon as they're
+    submitted and finish when the test sets their futures.
+    """
+
+    def __init__(self):
+        self.jobs = []
+
+    def submit(self, func, *args, on_start=None):
+        future = concurrent.futures.Future()
+        try:
+            if on_start is not None:
+                on_start()
+        except Exception as ex:
+            future.set_exception(ex)
+        self.jobs.append((args, future))
+        return future
+
+
+@override_settings(RDI_MAX_GENERATIONS=4)
+class BatchTests(SimpleTestCase):
+    def setUp(self):
+        use_temp_dir(self, RDI_JOB_DIR='jobs',
+                     RDI_ADMISSION_DB='admission.sqlite3')
+        self.pool = FakePool()
+        self.enterContext(
+            mock.patch.object(jobs.workerpool, 'get_pool', lambda: self.pool))
+        self.seeds = ['alpha', 'beta', 'gamma']
+        self.settings_dict = {'seed': 'ignored', 'mode': 'standard'}
+        self.job_id = jobs.enqueue_batch(
+            object(), self.settings_dict, self.seeds, 'bps')
+
+    def finish_seed(self, index: int, patch_data=None, exception=None):
+        _, future = self.pool.jobs[index]
+        if exception is not None:
+            future.set_exception(exception)
+        else:
+            future.set_result((patch_data, f'spoiler {index}', {'generate': 1.0}))
+
+    def read_result(self) -> zipfile.ZipFile:
+        return zipfile.ZipFile(jobs.get_result_path(self.job_id))
+
+    def test_manifest(self):
+        self.assertEqual(len(self.pool.jobs), 3)
+        self.assertEqual([args[1] for args, _ in self.pool.jobs], self.seeds)
+        self.assertEqual(jobs.get_status(self.job_id)['state'], jobs.RUNNING)
+
+        for index in (2, 0, 1):
+            self.finish_seed(index, patch_data=f'patch {index}'.encode())
+        status = jobs.get_status(self.job_id)
+        self.assertEqual(
+            (status['state'], status['completed'], status['failed'],
+             status['filename']),
+            (jobs.DONE, 3, 0, batch.RESULT_NAME))
+
+        with self.read_result() as zip_file:
+            manifest = json.loads(zip_file.read(batch.MANIFEST_NAME))
+            self.assertEqual(manifest['ctrando_version'],
+                             seedgen.get_ctrando_version())
+            self.assertEqual(manifest['settings'], self.settings_dict)
+            self.assertEqual(manifest['patch_format'], 'bps')
+            self.assertEqual(list(manifest['seeds']), self.seeds)
+            for index, seed in enumerate(self.seeds):
+                entry = manifest['seeds'][seed]
+                patch_data = zip_file.read(entry['patch'])
+                self.assertEqual(patch_data, f'patch {index}'.encode())
+                self.assertEqual(entry['patch'], f'{seed}/ct-mod.bps')
+                self.assertEqual(entry['patch_sha256'],
+                                 hashlib.sha256(patch_data).hexdigest())
+                self.assertEqual(zip_file.read(entry['spoiler']),
+                                 f'spoiler {index}'.encode())
+                self.assertEqual(entry['timings'], {'generate': 1.0})
+
+    def test_partial_failure(self):
+        self.finish_seed(0, patch_data=b'patch')
+        self.finish_seed(1, exception=ValueError('No path to the end'))
+        status = jobs.get_status(self.job_id)
+        self.assertEqual((status['state'], status['completed']),
+                         (jobs.RUNNING, 2))
+        self.finish_seed(2, exception=jobs.workerpool.WorkerTimeout())
+
+        status = jobs.get_status(self.job_id)
+        self.assertEqual((status['state'], status['failed']), (jobs.DONE, 2))
+        with self.read_result() as zip_file:
+            manifest = json.loads(zip_file.read(batch.MANIFEST_NAME))
+            self.assertEqual(sorted(zip_file.namelist()),
+                             ['alpha/ct-mod-spoilers.txt', 'alpha/ct-mod.bps',
+                              batch.MANIFEST_NAME])
+        self.assertIn('patch', manifest['seeds']['alpha'])
+        self.assertEqual(manifest['seeds']['beta'],
+                         {'error': 'No path to the end'})
+        self.assertEqual(manifest['seeds']['gamma'],
+                         {'error': 'Seed generation timed out'})
+
+    def test_every_seed_failed(self):
+        for index in range(3):
+            self.finish_seed(index, exception=ValueError('Bad settings'))
+        status = jobs.get_status(self.job_id)
+        self.assertEqual(
+            (status['state'], status['error']),
+            (jobs.FAILED, 'Every seed in the batch failed'))
+        self.assertFalse(os.path.exists(jobs.get_result_path(self.job_id)))
+        self.assertEqual(os.listdir(jobs.get_job_dir(self.job_id)),
+                         [jobs.STATUS_FILE])
+
+        # The batch's tickets are all released
+        self.assertEqual(
+            admission._connect().execute(
+                'SELECT COUNT(*) FROM tickets').fetchone()[0], 0)
+
+
+class PresetTests(SimpleTestCase):
+    def setUp(self):
+        self.preset = presets.get(next(iter(arguments.Presets)).name)
+
+    def get_encoding(self, accept_encoding: str, encoded=('br', 'gzip')):
+        preset = self.preset._replace(
+            encoded={coding: b'' for coding in encoded})
+        return presets.get_encoding(preset, accept_encoding)
+
+    def fetch(self, **headers):
+        return self.client.get(
+            reverse('generator:fetch_preset', args=[self.preset.name]),
+            headers=headers)
+
+    def test_get_encoding(self):
+        for accept_encoding, expected in (
+                ('', None),
+                ('gzip', 'gzip'),
+                ('gzip, br', 'br'),
+                ('GZIP;q=0.5, Br;q=0.1', 'br'),
+                ('br;q=0, gzip', 'gzip'),
+                ('br; q=0.000, gzip;Q=0', None),
+                ('br;q=0.001', 'br'),
+                ('br;q=oops', 'br'),
+                ('deflate, identity', None),
+        ):
+            with self.subTest(accept_encoding):
+                self.assertEqual(self.get_encoding(accept_encoding), expected)
+
+        # br is only used when there's a brotli copy
+        self.assertEqual(self.get_encoding('br, gzip', ['gzip']), 'gzip')
+        self.assertIsNone(self.get_encoding('br', ['gzip']))
+
+    def test_fetch(self):
+        response = self.fetch(accept_encoding='gzip')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['ETag'], self.preset.etag)
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(gzip.decompress(response.content), self.preset.data)
+
+        response = self.fetch(accept_encoding='gzip;q=0')
+        self.assertNotIn('Content-Encoding', response)
+        self.assertEqual(response.content, self.preset.data)
+
+        if 'br' in self.preset.encoded:
+            response = self.fetch(accept_encoding='gzip, br')
+            self.assertEqual(response['Content-Encoding'], 'br')
+            self.assertEqual(response.content, self.preset.encoded['br'])
+
+    def test_not_modified(self):
+        response = self.fetch(if_none_match=self.preset.etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(response['ETag'], self.preset.etag)
+
+        response = self.fetch(if_none_match='"stale"')
+        self.assertEqual(response.status_code, 200)
+
+    def test_unknown_preset(self):
+        response = self.client.get(
+            reverse('generator:fetch_preset', args=['NOT_A_PRESET']))
+        self.assertEqual(response.status_code, 404)
+
+
+class PageCacheTests(SimpleTestCase):
+    TOKEN_PATTERN = re.compile(r'name="csrfmiddlewaretoken" value="([^"]+)"')
+
+    def setUp(self):
+        self.client = Client(enforce_csrf_checks=True)
+
+    def get_token(self, response) -> str:
+        return self.TOKEN_PATTERN.search(response.content.decode()).group(1)
+
+    def assertTokenAccepted(self, client: Client, token: str, accepted: bool):
+        response = client.post(
+            reverse('generator:validate_settings'), '{}',
+            content_type='application/json', HTTP_X_CSRFTOKEN=token)
+        self.assertEqual(response.status_code != 403, accepted)
+
+    def test_own_token(self):
+        response = self.client.get('/')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn(pagecache.CSRF_PLACEHOLDER, response.content.decode())
+        self.assertIn(settings.CSRF_COOKIE_NAME, response.cookies)
+        token = self.get_token(response)
+        self.assertTokenAccepted(self.client, token, True)
+
+        # Another client's token doesn't pass with this client's cookie
+        other_client = Client(enforce_csrf_checks=True)
+        other_token = self.get_token(other_client.get('/'))
+        self.assertNotEqual(other_token, token)
+        self.assertTokenAccepted(self.client, other_token, False)
+        self.assertTokenAccepted(other_client, other_token, True)
+
+    def test_cached_render(self):
+        # Served from the cache, each request still gets a fresh token
+        first = self.get_token(self.client.get('/'))
+        response = self.client.get('/')
+        self.assertNotIn(pagecache.CSRF_PLACEHOLDER, response.content.decode())
+        second = self.get_token(response)
+        self.assertNotEqual(first, second)
+        self.assertTokenAccepted(self.client, second, True)
+
+    def test_etag_per_cookie(self):
+        etag = self.client.get('/')['ETag']
+        self.assertEqual(self.client.get('/')['ETag'], etag)
+        self.assertNotEqual(Client().get('/')['ETag'], etag)
+
+    def test_conditional_request(self):
+        response = self.client.get('/')
+        etag = response['ETag']
+        self.assertEqual(
+            self.client.get('/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        # An ETag from another deployment or cookie gets the page again
+        response = self.client.get('/', HTTP_IF_NONE_MATCH='"stale-etag"')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn(pagecache.CSRF_PLACEHOLDER, response.content.decode())
+        other_etag = Client().get('/')['ETag']
+        self.assertEqual(
+            self.client.get('/', HTTP_IF_NONE_MATCH=other_etag).status_code,
+            200)
+
+
+class ArgSchemaTests(SimpleTestCase):
+    SCHEMA = {
+        'flag': {'type': 'flag'},
+        'count': {'type': 'int', 'min': 0, 'max': 10},
+        'step': {'type': 'int', 'min': 2, 'max': 20, 'interval': 3},
+        'scale': {'type': 'float', 'min': 0.5, 'max': 2.0, 'interval': 0.1},
+        'difficulty': {'type': 'choice', 'choices': ['easy', 'hard']},
+        'items': {'type': 'multiselect', 'choices': ['a', 'b', 'c'],
+                  'allow_duplicates': False},
+        'slots': {'type': 'multiselect', 'choices': ['a', 'b'],
+                  'allow_duplicates': True},
+        'name': {'type': 'string', 'max_length': 5},
+    }
+
+    def setUp(self):
+        temp_dir = self.enterContext(tempfile.TemporaryDirectory())
+        self.schema_path = os.path.join(temp_dir, 'arg_schema.json')
+        with open(self.schema_path, 'w') as file:
+            json.dump(self.SCHEMA, file)
+        self.enterContext(
+            mock.patch.object(argschema, 'SCHEMA_PATH', self.schema_path))
+        self.enterContext(mock.patch.object(argschema, '_schema', None))
+
+    def assertValid(self, name: str, *values):
+        for value in values:
+            with self.subTest(name=name, value=value):
+                self.assertIsNone(argschema.validate_field(name, value))
+
+    def assertInvalid(self, name: str, error: str, *values):
+        for value in values:
+            with self.subTest(name=name, value=value):
+                self.assertIn(error, argschema.validate_field(name, value))
+
+    def test_flag(self):
+        self.assertValid('flag', True, False, 'on', 'False')
+        self.assertInvalid('flag', 'true or false', 'yes', 1)
+
+    def test_range(self):
+        self.assertValid('count', 0, 10, '7', 3.0)
+        self.assertInvalid('count', 'between 0 and 10', -1, 11, '100')
+        self.assertInvalid('count', 'whole number', 1.5)
+        self.assertInvalid('count', 'Expected a number', 'many', True, [1])
+
+    def test_interval(self):
+        self.assertValid('step', 2, 5, 20)
+        self.assertInvalid('step', 'multiple of 3 from 2', 3, 19)
+        # Floats on the interval despite rounding error
+        self.assertValid('scale', 0.5, 0.7, '1.3', 2.0)
+        self.assertInvalid('scale', 'multiple of 0.1', 0.55)
+        self.assertInvalid('scale', 'between', 0.4, 2.1)
+
+    def test_choice(self):
+        self.assertValid('difficulty', 'easy', 'hard')
+        self.assertInvalid('difficulty', 'Invalid choice: medium', 'medium')
+
+    def test_multiselect(self):
+        self.assertValid('items', ['a', 'c'], '[a, b]', "['a', 'b']", '[]')
+        self.assertInvalid('items', 'Invalid choice: d', ['a', 'd'], '[d]')
+        self.assertInvalid('items', 'Expected a list', 'a, b')
+
+    def test_duplicates(self):
+        self.assertInvalid(
+            'items', 'only be selected once', ['a', 'a'], '[b, c, b]')
+        self.assertValid('slots', ['a', 'a', 'b'], '[b, b]')
+
+    def test_string(self):
+        self.assertValid('name', 'Crono')
+        self.assertInvalid('name', 'at most 5 characters', 'Frog!!')
+        self.assertInvalid('name', 'Expected text', 5)
+
+    def test_unknown_field(self):
+        self.assertEqual(argschema.validate_field('nope', 1), 'Unknown setting')
+        self.assertEqual(
+            argschema.validate_field('nope', ''), 'Unknown setting')
+
+    def test_empty_value(self):
+        # Empty fields are left out of the settings file
+        self.assertValid('count', None, '')
+        self.assertValid('difficulty', '')
+
+    def test_validate_delta(self):
+        self.assertEqual(argschema.validate_delta({
+            'count': 3, 'difficulty': 'medium', 'items': ['a', 'a'],
+            'nope': True,
+        }), {
+            'difficulty': 'Invalid choice: medium',
+            'items': 'Items may only be selected once',
+            'nope': 'Unknown setting',
+        })
+
+    def test_view(self):
+        url = reverse('generator:validate_settings')
+        response = self.client.post(
+            url, {'count': 20, 'difficulty': 'easy'},
+            content_type='application/json')
+        self.assertEqual(response.json(), {
+            'valid': False, 'errors': {'count': 'Must be between 0 and 10'}})
+
+        # Form data, as the TOML form posts it
+        response = self.client.post(url, {'items': '[a, b]'})
+        self.assertEqual(response.json(), {'valid': True, 'errors': {}})
+
+        response = self.client.post(
+            url, '[1, 2]', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_missing_schema(self):
+        os.remove(self.schema_path)
+        with self.assertRaises(argschema.SchemaUnavailable):
+            argschema.validate_field('count', 1)
+
+        response = self.client.post(
+            reverse('generator:validate_settings'), {'count': 1},
+            content_type='application/json')
+        self.assertEqual(response.status_code, 503)
+        self.assertIn('create_toml_gen_form.py', response.json()['error'])
+
+
+class TimingTests(SimpleTestCase):
+    def setUp(self):
+        self.temp_dir = use_temp_dir(self, RDI_METRICS_DIR='metrics')
+        self.metrics_dir = os.path.join(self.temp_dir, 'metrics')
+        os.makedirs(self.metrics_dir)
+
+    def write_stats(self, pid: int, samples: list[float]) -> str:
+        path = os.path.join(self.metrics_dir, f'{pid}.json')
+        with open(path, 'w') as file:
+            json.dump({'generate': {
+                'samples': samples, 'count': len(samples),
+                'sum': sum(samples)}}, file)
+        return path
+
+    def get_dead_pid(self) -> int:
+        process = subprocess.Popen([sys.executable, '-c', ''])
+        process.wait()
+        return process.pid
+
+    def test_quantiles(self):
+        samples = [float(n) for n in range(1, 101)]
+        self.assertEqual(timing._quantile(samples, 0.5), 50)
+        self.assertEqual(timing._quantile(samples, 0.95), 95)
+        self.assertEqual(timing._quantile(samples, 0.99), 99)
+        self.assertEqual(timing._quantile([3.0], 0.5), 3)
+        self.assertEqual(timing._quantile([1.0, 2.0], 0.99), 2)
+
+    def test_render(self):
+        self.write_stats(os.getpid(), [float(n) for n in range(1, 101)])
+        metrics = timing.render_prometheus()
+        self.assertIn(
+            'rdi_stage_seconds{stage="generate",quantile="0.5"} 50.000000',
+            metrics)
+        self.assertIn(
+            'rdi_stage_seconds{stage="generate",quantile="0.99"} 99.000000',
+            metrics)
+        self.assertIn('rdi_stage_seconds_count{stage="generate"} 100', metrics)
+        self.assertIn('rdi_stage_seconds_sum{stage="generate"} 5050', metrics)
+
+    def test_dead_process_removed(self):
+        self.write_stats(os.getpid(), [1.0])
+        dead_path = self.write_stats(self.get_dead_pid(), [5.0, 6.0])
+        metrics = timing.render_prometheus()
+        self.assertFalse(os.path.exists(dead_path))
+        self.assertIn('rdi_stage_seconds_count{stage="generate"} 1', metrics)
+        self.assertIn(
+            'rdi_stage_seconds{stage="generate",quantile="0.99"} 1.000000',
+            metrics)
+
+    @override_settings(RDI_METRICS_RETENTION=60)
+    def test_idle_process_removed(self):
+        # The parent test runner is alive but hasn't recorded for too long
+        idle_path = self.write_stats(os.getppid(), [5.0])
+        own_path = self.write_stats(os.getpid(), [1.0])
+        for path in (idle_path, own_path):
+            os.utime(path, (1000, 1000))
+
+        metrics = timing.render_prometheus()
+        self.assertFalse(os.path.exists(idle_path))
+        # This process's own file is kept however old it is
+        self.assertTrue(os.path.exists(own_path))
+        self.assertIn('rdi_stage_seconds_count{stage="generate"} 1', metrics)
+
+    def test_record(self):
+        timing.record({'generate': 0.5, 'build_zip': 0.1})
+        with open(os.path.join(self.metrics_dir, f'{os.getpid()}.json')) as file:
+            stats = json.load(file)
+        self.assertEqual(stats['generate']['samples'][-1], 0.5)
+        self.assertIn('build_zip', timing.render_prometheus())
+
+
+@override_settings(RDI_SEED_POOL_LOW=1, RDI_SEED_POOL_HIGH=3,
+                   RDI_SEED_POOL_SIZES='', RDI_PATCH_FORMAT='bps')
+class SeedPoolTests(SimpleTestCase):
+    def setUp(self):
+        self.temp_dir = use_temp_dir(self, RDI_SEED_POOL_DIR='pool')
+        self.preset = next(iter(arguments.Presets)).name
+        self.version = 'v1'
+        self.enterContext(mock.patch.object(
+            seedgen, 'get_ctrando_version', lambda: self.version))
+        self.enterContext(mock.patch.object(
+            artifacts, 'get_vanilla_rom', lambda: b'vanilla'))
+        seedpool.get_fingerprint.cache_clear()
+        self.addCleanup(seedpool.get_fingerprint.cache_clear)
+
+    def add_seed(self, name: str) -> str:
+        """
+        Put a finished seed in the pool the way add_seed() leaves it
+        """
+        directory = seedpool._get_dir(self.preset)
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, name)
+        for extension in ('.pkl', '.zip'):
+            with open(path + extension, 'w') as file:
+                file.write(name)
+        return path
+
+    def test_take(self):
+        path = self.add_seed('a')
+        self.assertEqual(seedpool.count(self.preset), 1)
+        zip_path, config_path = seedpool.take(self.preset, 'bps')
+        self.assertEqual(
+            (zip_path, config_path), (f'{path}.zip.taken', f'{path}.pkl.taken'))
+        self.assertEqual(seedpool.count(self.preset), 0)
+        self.assertIsNone(seedpool.take(self.preset, 'bps'))
+
+        seedpool.discard((zip_path, config_path))
+        self.assertEqual(os.listdir(os.path.dirname(path)), [])
+
+    def test_take_other_format(self):
+        self.add_seed('a')
+        self.assertIsNone(seedpool.take(self.preset, 'ips'))
+        self.assertEqual(seedpool.count(self.preset), 1)
+
+    def test_claimed_once(self):
+        for index in range(5):
+            self.add_seed(f'seed-{index}')
+
+        barrier = threading.Barrier(20)
+        results = []
+
+        def take():
+            barrier.wait()
+            results.append(seedpool.take(self.preset, 'bps'))
+
+        threads = [threading.Thread(target=take) for _ in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        taken = [result[0] for result in results if result is not None]
+        self.assertEqual(len(taken), 5)
+        self.assertEqual(len(set(taken)), 5)
+        self.assertEqual(results.count(None), 15)
+
+    def test_lost_rename_race(self):
+        self.add_seed('a')
+        self.add_seed('b')
+        directory = seedpool._get_dir(self.preset)
+        listing = sorted(os.listdir(directory))
+        first, _ = seedpool.take(self.preset, 'bps')
+        self.assertTrue(first.endswith('a.zip.taken'))
+
+        # Another worker took seed a after this one listed the directory
+        with mock.patch.object(seedpool.os, 'listdir', return_value=listing):
+            second, _ = seedpool.take(self.preset, 'bps')
+            self.assertTrue(second.endswith('b.zip.taken'))
+            self.assertIsNone(seedpool.take(self.preset, 'bps'))
+
+    def test_fingerprint_change(self):
+        old_path = self.add_seed('a')
+        old_fingerprint = seedpool.get_fingerprint()
+
+        for change in ('version', 'patch_format'):
+            with self.subTest(change):
+                seedpool.get_fingerprint.cache_clear()
+                if change == 'version':
+                    self.version = 'v2'
+                    fingerprint = seedpool.get_fingerprint()
+                else:
+                    with override_settings(RDI_PATCH_FORMAT='ips'):
+                        fingerprint = seedpool.get_fingerprint()
+                self.assertNotEqual(fingerprint, old_fingerprint)
+
+        self.version = 'v2'
+        seedpool.get_fingerprint.cache_clear()
+        self.assertEqual(seedpool.count(self.preset), 0)
+        self.assertIsNone(seedpool.take(self.preset, 'bps'))
+
+        seedpool.prune()
+        self.assertFalse(os.path.exists(os.path.dirname(old_path)))
+        self.assertEqual(os.listdir(settings.RDI_SEED_POOL_DIR), [])
+
+    def test_prune_leftovers(self):
+        path = self.add_seed('a')
+        for leftover in (f'{path}.zip.taken',
+                         os.path.join(os.path.dirname(path), '.b.zip')):
+            with open(leftover, 'w'):
+                pass
+            os.utime(leftover, (1000, 1000))
+
+        seedpool.prune()
+        self.assertEqual(sorted(os.listdir(os.path.dirname(path))),
+                         ['a.pkl', 'a.zip'])
+
+    def test_limits(self):
+        names = [preset.name for preset in arguments.Presets]
+        self.assertEqual(seedpool.get_limits(),
+                         {name: (1, 3) for name in names})
+
+        with override_settings(
+                RDI_SEED_POOL_SIZES=f'{self.preset}=10, {names[-1]}=0'):
+            limits = seedpool.get_limits()
+            if len(names) > 1:
+                self.assertNotIn(names[-1], limits)
+            else:
+                self.assertEqual(limits, {})
+
+        with override_settings(RDI_SEED_POOL_SIZES=f'{self.preset}=10'):
+            self.assertEqual(seedpool.get_limits()[self.preset], (1, 10))
+
+        with override_settings(RDI_SEED_POOL_HIGH=0,
+                               RDI_SEED_POOL_SIZES=f'{self.preset}=1'):
+            # The low watermark can't be above the high one
+            self.assertEqual(seedpool.get_limits(), {self.preset: (1, 1)})
+
+        with override_settings(RDI_SEED_POOL_HIGH=0):
+            self.assertEqual(seedpool.get_limits(), {})
+
+    def test_bad_sizes(self):
+        sizes = (f'{self.preset}=five {self.preset} =2 NOT_A_PRESET=4 '
+                 f'{self.preset}=2')
+        with self.assertLogs('generator.seedpool', 'WARNING') as logs:
+            self.assertEqual(seedpool._parse_sizes(sizes),
+                             {self.preset: 2, '': 2, 'NOT_A_PRESET': 4})
+        self.assertEqual(len(logs.output), 4)
+        self.assertIn(f'bad RDI_SEED_POOL_SIZES entry: {self.preset}=five',
+                      logs.output[0])
+
+        with override_settings(RDI_SEED_POOL_SIZES=sizes):
+            self.assertEqual(seedpool.get_limits()[self.preset], (1, 2))
+
+
+@override_settings(RDI_PERSONALIZATION_CACHE_SIZE=4, RDI_JOB_RETENTION=60)
+class RepersonalizeTests(SimpleTestCase):
+    def setUp(self):
+        self.temp_dir = use_temp_dir(
+            self, RDI_JOB_DIR='jobs', RDI_ADMISSION_DB='admission.sqlite3',
+            RDI_METRICS_DIR='metrics')
+        self.pool = FakePool()
+        self.enterContext(
+            mock.patch.object(jobs.workerpool, 'get_pool', lambda: self.pool))
+        self.parse = self.enterContext(mock.patch.object(
+            personalization, '_parse', side_effect=lambda data: dict(data)))
+        personalization.clear_cache()
+        self.addCleanup(personalization.clear_cache)
+
+        result_path = os.path.join(self.temp_dir, 'result.zip')
+        config_path = os.path.join(self.temp_dir, 'config.pkl')
+        with open(result_path, 'wb') as file:
+            file.write(b'zip')
+        with open(config_path, 'wb') as file:
+            file.write(b'config')
+        self.source_job = jobs.create_finished(result_path, config_path)
+
+    def repersonalize(self, job_id: str):
+        personalization_file = io.BytesIO(b'name = "Crono"\n')
+        personalization_file.name = 'personal.toml'
+        return self.client.post(
+            reverse('generator:repersonalize', args=[job_id]),
+            {'personalization_file': personalization_file,
+             'patch_format': 'bps'},
+            headers={'Accept': 'application/json'})
+
+    def test_repersonalize(self):
+        with mock.patch.object(seedgen, 'repersonalize_seed'):
+            response = self.repersonalize(self.source_job)
+        self.assertEqual(response.status_code, 202)
+        job_id = response.json()['job_id']
+        self.assertNotEqual(job_id, self.source_job)
+
+        (config_path, personal_settings, patch_format), future = \
+            self.pool.jobs[0]
+        self.assertEqual(config_path, jobs.get_config_path(job_id))
+        self.assertEqual(personal_settings, {'name': 'Crono'})
+        self.assertEqual(patch_format, 'bps')
+        self.assertEqual(jobs.get_status(job_id)['state'], jobs.RUNNING)
+
+        future.set_result((b'patch', 'spoiler', {'generate': 0.5}))
+        self.assertEqual(jobs.get_status(job_id)['state'], jobs.DONE)
+        with zipfile.ZipFile(jobs.get_result_path(job_id)) as zip_file:
+            self.assertEqual(zip_file.read('ct-mod.bps'), b'patch')
+
+        # The new job keeps the seed, so it can be re-personalized again
+        self.assertTrue(jobs.has_config(job_id))
+        with mock.patch.object(seedgen, 'repersonalize_seed'):
+            self.assertEqual(self.repersonalize(job_id).status_code, 202)
+        # The second upload of the same file was parsed from the cache
+        self.assertEqual(self.parse.call_count, 1)
+
+    def test_unknown_job(self):
+        response = self.repersonalize('00000000-0000-0000-0000-000000000000')
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(self.pool.jobs, [])
+
+    def test_pruned_job(self):
+        os.utime(jobs.get_job_dir(self.source_job), (1000, 1000))
+        jobs.prune_jobs()
+        response = self.repersonalize(self.source_job)
+        self.assertEqual(response.status_code, 404)
+        self.assertIn('No stored seed', response.json()['error'])
+        self.assertEqual(self.pool.jobs, [])
+
+    def test_pruned_while_queueing(self):
+        os.remove(jobs.get_config_path(self.source_job))
+        with mock.patch.object(jobs, 'has_config', return_value=True):
+            response = self.repersonalize(self.source_job)
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(self.pool.jobs, [])
+
+    def test_personalization_cache(self):
+        first = personalization.parse({'name': 'Crono', 'music': 'on'})
+        second = personalization.parse({'music': 'on', 'name': 'Crono'})
+        self.assertEqual(self.parse.call_count, 1)
+        # Each caller gets its own copy
+        self.assertEqual(first, second)
+        self.assertIsNot(first, second)
+
+        self.assertIsNone(personalization.parse(None))
+        with override_settings(RDI_PERSONALIZATION_CACHE_SIZE=0):
+            personalization.parse({'name': 'Crono', 'music': 'on'})
+        self.assertEqual(self.parse.call_count, 2)
+
+
+# Startup steps run in a process pool, so their actions are module level
+def run_build_step(name: str, log_path: str, output_path: str):
+    with open(log_path, 'a') as file:
+        file.write(f'{name}\n')
+    with open(output_path, 'w') as file:
+        file.write(name)
+
+
+def fail_build_step():
+    raise ValueError('Broken tool')
+
+
+def hang_build_step():
+    time.sleep(60)
+
+
+@override_settings(RDI_PATCH_FORMAT='bps')
+class StartupTests(SimpleTestCase):
+    def setUp(self):
+        self.temp_dir = use_temp_dir(
+            self, RDI_BUILD_MANIFEST='build_manifest.json')
+        self.log_path = self.path('log')
+        self.input_path = self.path('input')
+        with open(self.input_path, 'w') as file:
+            file.write('1')
+
+        self.steps = [
+            self.make_step('first'),
+            self.make_step('second', depends_on=['first']),
+        ]
+        self.enterContext(mock.patch.object(
+            buildsteps, 'get_steps', lambda: self.steps))
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.temp_dir, name)
+
+    def make_step(self, name: str, action=None, **kwargs) -> buildsteps.Step:
+        if action is None:
+            action = functools.partial(
+                run_build_step, name, self.log_path, self.path(name))
+        return buildsteps.Step(
+            name=name,
+            action=action,
+            input_files=lambda: [self.input_path],
+            input_values=lambda: [settings.RDI_PATCH_FORMAT],
+            outputs=[self.path(name)],
+            **kwargs)
+
+    def startup(self, *args) -> list[str]:
+        """
+        Run the startup command and get the steps that ran, in order
+        """
+        if os.path.exists(self.log_path):
+            os.remove(self.log_path)
+        call_command('startup', *args, '--workers', '2',
+                     stdout=io.StringIO(), stderr=io.StringIO())
+        try:
+            with open(self.log_path) as file:
+                return file.read().split()
+        except FileNotFoundError:
+            return []
+
+    def test_skip_unchanged(self):
+        self.assertEqual(self.startup(), ['first', 'second'])
+        self.assertEqual(set(buildsteps.load_manifest()), {'first', 'second'})
+        self.assertEqual(self.startup(), [])
+        self.assertEqual(self.startup('--force'), ['first', 'second'])
+        self.assertEqual(self.startup('--only', 'second', '--force'),
+                         ['second'])
+
+    def test_changed_input(self):
+        self.startup()
+        with open(self.input_path, 'w') as file:
+            file.write('2')
+        self.assertEqual(self.startup(), ['first', 'second'])
+        self.assertEqual(self.startup(), [])
+
+        os.remove(self.input_path)
+        self.assertEqual(self.startup(), ['first', 'second'])
+
+    def test_changed_setting(self):
+        self.startup()
+        with override_settings(RDI_PATCH_FORMAT='ips'):
+            self.assertEqual(self.startup(), ['first', 'second'])
+        self.assertEqual(self.startup(), ['first', 'second'])
+
+    def test_missing_output(self):
+        self.startup()
+        os.remove(self.path('second'))
+        self.assertEqual(self.startup(), ['second'])
+
+    def test_always_run(self):
+        self.steps.append(dataclasses.replace(
+            self.make_step('check'), outputs=[], always_run=True))
+        self.assertIn('check', self.startup())
+        self.assertEqual(self.startup(), ['check'])
+        self.assertNotIn('check', buildsteps.load_manifest())
+
+    def test_failed_step(self):
+        self.startup()
+        manifest = buildsteps.load_manifest()
+        with open(self.input_path, 'w') as file:
+            file.write('2')
+
+        self.steps[1] = self.make_step(
+            'second', action=fail_build_step, depends_on=['first'])
+        with self.assertRaisesMessage(
+                CommandError, 'Startup step second failed: Broken tool'):
+            self.startup()
+        # The failed step keeps its old entry, so the next start runs it
+        updated = buildsteps.load_manifest()
+        self.assertNotEqual(updated['first'], manifest['first'])
+        self.assertEqual(updated['second'], manifest['second'])
+
+        self.steps[1] = self.make_step('second', depends_on=['first'])
+        self.assertEqual(self.startup(), ['second'])
+
+    def test_failed_parallel_step(self):
+        self.steps = [
+            self.make_step('slow', action=hang_build_step),
+            self.make_step('broken', action=fail_build_step),
+            self.make_step('after', depends_on=['slow', 'broken']),
+        ]
+        stderr = io.StringIO()
+        start = time.monotonic()
+        with self.assertRaisesMessage(
+                CommandError, 'Startup step broken failed: Broken tool'):
+            call_command('startup', '--workers', '2',
+                         stdout=io.StringIO(), stderr=stderr)
+        # The slow step is stopped rather than waited for
+        self.assertLess(time.monotonic() - start, 30)
+        self.assertIn('Stopped: slow', stderr.getvalue())
+        self.assertEqual(buildsteps.load_manifest(), {})
+        self.assertFalse(os.path.exists(self.path('after')))
+
+    def test_failed_step_exit_code(self):
+        self.steps = [
+            self.make_step('first'),
+            self.make_step('broken', action=fail_build_step),
+        ]
+        stderr = io.StringIO()
+        with mock.patch.object(sys, 'stdout', io.StringIO()), \
+                mock.patch.object(sys, 'stderr', stderr), \
+                self.assertRaises(SystemExit) as context:
+            ManagementUtility(
+                ['manage.py', 'startup', '--workers', '2']).execute()
+        self.assertEqual(context.exception.code, 1)
+        self.assertIn('Startup step broken failed: Broken tool',
+                      stderr.getvalue())
@@ -0,0 +1,227 @@
+"""
+Per-stage timing of seed generation.
+
+A StageTimer measures the stages of one request.  Finished timings are
+reported three ways:
+  - as a Server-Timing header on the response
+  - as a structured (JSON) log line
+  - as p50/p95/p99 summaries per stage at /metrics
+
+Each web worker only sees the seeds it queued, so each process saves its
+recent samples to a file in RDI_METRICS_DIR and /metrics merges all of them.
+The files of processes that exited, or that haven't recorded anything for
+RDI_METRICS_RETENTION seconds, are removed when /metrics is rendered.
+"""
+
+from django.conf import settings
+
+from . import admission
+
+import collections
+import contextlib
+import json
+import logging
+import math
+import os
+import threading
+import time
+import typing
+
+logger = logging.getLogger(__name__)
+
+# Quantiles reported for each stage
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class StageTimer:
+    """
+    Record how long each stage of a request takes
+    """
+
+    def __init__(self):
+        self.timings: dict[str, float] = {}
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = \
+                self.timings.get(name, 0.0) + time.perf_counter() - start
+
+    def update(self, timings: dict[str, float]):
+        """
+        Add timings measured elsewhere, e.g. in a randomizer worker
+        """
+        for name, duration in timings.items():
+            self.timings[name] = self.timings.get(name, 0.0) + duration
+
+
+def get_server_timing(timings: dict[str, float]) -> str:
+    """
+    Format timings (in seconds) as a Server-Timing header value
+    """
+    return ', '.join(
+        f'{name};dur={duration * 1000:.1f}'
+        for name, duration in timings.items())
+
+
+def log_timings(event: str, timings: dict[str, float], **kwargs):
+    """
+    Write timings as a single JSON log line
+    """
+    entry = {'event': event}
+    entry.update(kwargs)
+    entry['timings_ms'] = {
+        name: round(duration * 1000, 1) for name, duration in timings.items()
+    }
+    logger.info(json.dumps(entry))
+
+
+class _StageStats:
+    """
+    Recent samples and running totals for each stage in this process
+    """
+
+    def __init__(self, window: int):
+        self.window = window
+        self.samples = collections.defaultdict(
+            lambda: collections.deque(maxlen=self.window))
+        self.counts = collections.Counter()
+        self.sums = collections.Counter()
+        self.lock = threading.Lock()
+
+    def add(self, timings: dict[str, float]):
+        with self.lock:
+            for name, duration in timings.items():
+                self.samples[name].append(duration)
+                self.counts[name] += 1
+                self.sums[name] += duration
+
+    def to_dict(self) -> dict[str, dict[str, typing.Any]]:
+        with self.lock:
+            return {
+                name: {
+                    'samples': list(self.samples[name]),
+                    'count': self.counts[name],
+                    'sum': self.sums[name],
+                }
+                for name in self.samples
+            }
+
+
+_stats: typing.Optional[_StageStats] = None
+_stats_pid: typing.Optional[int] = None
+_save_lock = threading.Lock()
+
+
+def _get_stats() -> _StageStats:
+    """
+    Get the stats for this process.  Forked children start with empty stats
+    rather than counting their parent's samples a second time.
+    """
+    global _stats, _stats_pid
+    if _stats is None or _stats_pid != os.getpid():
+        _stats = _StageStats(settings.RDI_METRICS_WINDOW)
+        _stats_pid = os.getpid()
+    return _stats
+
+
+def record(timings: dict[str, float]):
+    """
+    Add a request's timings to the stage summaries
+    """
+    stats = _get_stats()
+    stats.add(timings)
+
+    try:
+        os.makedirs(settings.RDI_METRICS_DIR, exist_ok=True)
+        path = os.path.join(settings.RDI_METRICS_DIR, f'{os.getpid()}.json')
+        with _save_lock:
+            with open(f'{path}.tmp', 'w') as file:
+                json.dump(stats.to_dict(), file)
+            os.replace(f'{path}.tmp', path)
+    except OSError as ex:
+        logger.warning('Unable to save stage timings: %s', ex)
+
+
+def _quantile(sorted_samples: list[float], quantile: float) -> float:
+    """
+    Get a quantile of the samples by the nearest rank method
+    """
+    index = max(0, math.ceil(quantile * len(sorted_samples)) - 1)
+    return sorted_samples[index]
+
+
+def _is_stale(entry: os.DirEntry) -> bool:
+    """
+    Check whether a stats file belongs to a process that exited or hasn't
+    recorded anything within the retention window
+    """
+    try:
+        pid = int(entry.name.removesuffix('.json'))
+    except ValueError:
+        return False
+    if pid == os.getpid():
+        return False
+
+    try:
+        mtime = entry.stat().st_mtime
+    except FileNotFoundError:
+        return False
+    return not admission.pid_alive(pid) \
+        or mtime < time.time() - settings.RDI_METRICS_RETENTION
+
+
+def render_prometheus() -> str:
+    """
+    Merge the stage stats from every process and render them in the
+    Prometheus text format
+    """
+    samples = collections.defaultdict(list)
+    counts = collections.Counter()
+    sums = collections.Counter()
+
+    try:
+        entries = list(os.scandir(settings.RDI_METRICS_DIR))
+    except FileNotFoundError:
+        entries = []
+
+    for entry in entries:
+        if not entry.name.endswith('.json'):
+            continue
+        if _is_stale(entry):
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                # Another worker already removed it
+                pass
+            continue
+        try:
+            with open(entry.path) as file:
+                process_stats = json.load(file)
+        except (OSError, json.JSONDecodeError):
+            continue
+
+        for name, stage in process_stats.items():
+            samples[name].extend(stage['samples'])
+            counts[name] += stage['count']
+            sums[name] += stage['sum']
+
+    lines = [
+        '# HELP rdi_stage_seconds Time spent in each seed generation stage',
+        '# TYPE rdi_stage_seconds summary',
+    ]
+    for name in sorted(samples):
+        stage_samples = sorted(samples[name])
+        if not stage_samples:
+            continue
+        for quantile in QUANTILES:
+            lines.append(
+                f'rdi_stage_seconds{{stage="{name}",quantile="{quantile}"}} '
+                f'{_quantile(stage_samples, quantile):.6f}')
+        lines.append(f'rdi_stage_seconds_sum{{stage="{name}"}} {sums[name]:.6f}')
+        lines.append(f'rdi_stage_seconds_count{{stage="{name}"}} {counts[name]}')
+
+    return '\n'.join(lines) + '\n'
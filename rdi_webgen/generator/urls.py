@@ -1,14 +1,27 @@
+from django.conf import settings
 from django.urls import path
 from django.views.generic import TemplateView
-from . import views
+from . import asyncviews, views as sync_views
+
+views = asyncviews if settings.RDI_ASYNC_VIEWS else sync_views
 
 app_name = 'generator'
 
 urlpatterns = [
     path('', views.IndexView.as_view(), name='index'),
     path('generate', views.GenerateView.as_view(), name='generate'),
+    path('generate_batch', views.BatchGenerateView.as_view(),
+         name='generate_batch'),
     path('toml_form', views.TomlFormView.as_view(), name='toml_form'),
     path('toml_gen', views.TomlGenView.as_view(), name='toml_gen'),
+    path('validate_settings', views.ValidateSettingsView.as_view(),
+         name='validate_settings'),
     path('fetch_preset/<str:preset_id>',
          views.FetchPresetView.as_view(), name='fetch_preset'),
+    path('job/<uuid:job_id>', views.JobStatusView.as_view(), name='job_status'),
+    path('job/<uuid:job_id>/download',
+         views.JobDownloadView.as_view(), name='job_download'),
+    path('job/<uuid:job_id>/repersonalize',
+         views.RepersonalizeView.as_view(), name='repersonalize'),
+    path('metrics', views.MetricsView.as_view(), name='metrics'),
 ]
@@ -0,0 +1,92 @@
+"""
+Validation of settings built with the TOML builder form.
+
+The cleaned form data is converted straight to the settings dictionary the
+randomizer's argument parser takes, without dumping it to TOML and parsing
+it back.  Validation results are memoized by a hash of the canonical
+settings since the same settings tend to be submitted many times while a
+user tweaks the form.
+"""
+
+import typing
+
+import ctrando.randomizer
+from ctrando.arguments import tomloptions
+from ctrando.arguments.plandooptions import PlandoException
+
+from . import lrucache, seedgen
+
+
+def form_to_settings_dict(
+        cleaned_data: dict[str, typing.Any]) -> dict[str, typing.Any]:
+    """
+    Convert cleaned TOML builder form data to a settings dictionary.  The
+    result matches what dumping the data to TOML and loading it back gives.
+    """
+    data_dict = {}
+    # Most fields can be read as-is, but the list fields will need to
+    # be converted from a string to a list type in the new dict.
+    for name, value in cleaned_data.items():
+        if isinstance(value, str):
+            if value.startswith('[') and value.endswith(']'):
+                # If this is an empty list then don't add the field to the toml
+                if len(value) != 2:
+                    temp = [x.replace("'", '').strip()
+                            for x in value[1:-1].split(',')]
+                    data_dict[name] = temp
+                else:
+                    data_dict[name] = []
+            elif len(value) > 0:
+                # All non-list strings.  Skip empty fields
+                data_dict[name] = value
+        elif value is not None:
+            # TOML has no null, so empty numeric fields are left out
+            data_dict[name] = value
+
+    return data_dict
+
+
+def get_settings_hash(settings_dict: dict[str, typing.Any]) -> str:
+    """
+    Hash the canonical form of a settings dictionary
+    """
+    return lrucache.get_data_hash({
+        'settings': settings_dict,
+        'version': seedgen.get_ctrando_version(),
+    })
+
+
+def _check_settings(settings_dict: dict[str, typing.Any]) -> typing.Optional[str]:
+    """
+    Run the settings through the randomizer's argument parser and return
+    the error text, or None if the settings are valid
+    """
+    try:
+        args = tomloptions.toml_data_to_args(settings_dict)
+        _ = ctrando.randomizer.extract_settings(*args)
+    except (ValueError, PlandoException) as ex:
+        return str(ex)
+    except KeyError as ex:
+        return 'Invalid key value: ' + str(ex)
+    except Exception as ex:
+        # Catch-all exception for errors we don't expect
+        return 'Unexpected error: ' + str(ex)
+
+    return None
+
+
+# Validation results per process, see RDI_VALIDATION_CACHE_SIZE
+_cache = lrucache.LRUCache('RDI_VALIDATION_CACHE_SIZE')
+
+
+def validate(settings_dict: dict[str, typing.Any]) -> typing.Optional[str]:
+    """
+    Validate a settings dictionary.  Returns the error text, or None if the
+    settings are valid.
+    """
+    return _cache.get(get_settings_hash(settings_dict),
+                      lambda: _check_settings(settings_dict))
+
+
+def clear_cache():
+    _cache.clear()
@@ -1,28 +1,25 @@
 # django imports
+from django.conf import settings
 from django.shortcuts import render
-from django.http import FileResponse, HttpResponse, HttpResponseNotFound
-from wsgiref.util import FileWrapper
+from django.http import (
+    FileResponse, HttpResponse, HttpResponseNotFound, JsonResponse)
+from django.urls import reverse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.safestring import mark_safe
 
 from django.views import View
 from django.views.generic import FormView
 
-from .forms import GeneratorForm
+from . import (
+    admission, argschema, batch, jobs, pagecache, patchformats, personalization,
+    presets, resultcache, seedpool, timing, validation)
+from .forms import BatchGeneratorForm, GeneratorForm, RepersonalizeForm
 from .toml_gen_form import TomlGenForm
 
-# RDI rando imports
-import ctrando
-import ctrando.randomizer
-from ctrando.arguments import arguments, tomloptions
-from ctrando.arguments.postrandooptions import PostRandoOptions
-from ctrando.arguments.plandooptions import PlandoException
-
 # standard lib imports
-import argparse
-import importlib.resources
-from zipfile import ZipFile
 import io
-import os
-import tempfile
+import json
+import secrets
 import toml
 import tomllib
 import traceback
@@ -34,26 +31,51 @@ class IndexView(View):
     Index page with some basic information/links and the generate form
     """
 
-    @classmethod
-    def get(cls, request):
+    template_name = 'generator/index.html'
+
+    @staticmethod
+    def get_context_data():
         form = GeneratorForm()
         context = {
             'form': form
         }
-        return render(request, 'generator/index.html', context)
+        return context
+
+    @classmethod
+    def get(cls, request):
+        return pagecache.render_page(
+            request, cls.template_name, cls.get_context_data)
 
 
 class TomlFormView(View):
     """
     Main page of the toml generator form
     """
-    @classmethod
-    def get(cls, request):
-        form = TomlGenForm()
+    template_name = 'generator/toml_form.html'
+
+    @staticmethod
+    def get_context_data(**kwargs):
+        # The page builds its controls from the arg schema in the browser
         context = {
-            'form': form
+            'form': TomlGenForm(),
+            'arg_schema': mark_safe(argschema.get_page_json()),
         }
-        return render(request, 'generator/toml_form.html', context)
+        context.update(kwargs)
+        return context
+
+    @classmethod
+    def get(cls, request):
+        return pagecache.render_page(
+            request, cls.template_name, cls.get_context_data)
+
+
+def preload_pages():
+    """
+    Render the cached pages ahead of the first request
+    """
+    pagecache.preload(
+        (view.template_name, view.get_context_data)
+        for view in (IndexView, TomlFormView))
 
 
 class FetchPresetView(View):
@@ -63,18 +85,28 @@ class FetchPresetView(View):
 
     @classmethod
     def get(cls, request, preset_id):
-        # Get the preset file from the randomizer package
         try:
-            preset_data = arguments.Presets[preset_id].value
+            preset = presets.get(preset_id)
         except KeyError:
             # Invalid preset file
             return HttpResponseNotFound(f'Invalid preset: {preset_id}')
 
-        preset_file = importlib.resources.files(
-            'ctrando.arguments.presets').joinpath(preset_data.filename)
-
-        with open(preset_file, 'r') as file:
-            return FileResponse(file.read(), filename='preset.toml')
+        response = get_conditional_response(request, etag=preset.etag)
+        if response is None:
+            encoding = presets.get_encoding(
+                preset, request.headers.get('Accept-Encoding', ''))
+            if encoding is None:
+                response = HttpResponse(preset.data)
+            else:
+                response = HttpResponse(preset.encoded[encoding])
+                response.headers['Content-Encoding'] = encoding
+            response.headers['Content-Type'] = 'application/octet-stream'
+            response.headers['Content-Disposition'] = \
+                'inline; filename="preset.toml"'
+
+        response.headers['ETag'] = preset.etag
+        patch_vary_headers(response, ('Accept-Encoding',))
+        return response
 
 
 class TomlGenView(FormView):
@@ -84,58 +116,13 @@ class TomlGenView(FormView):
     form_class = TomlGenForm
 
     def form_valid(self, form):
-
-        data_dict = {}
-        # Loop over the form fields and store them in a new dictionary
-        # Most fields can be read as-is, but the list fields will need to
-        # be converted from a string to a list type in the new dict.
-        for name, value in form.cleaned_data.items():
-            if isinstance(value, str):
-                if value.startswith('[') and value.endswith(']'):
-                    # If this is an empty list then don't add the field to the toml
-                    if len(value) != 2:
-                        temp = [x.replace("'", '').strip()
-                                for x in value[1:-1].split(',')]
-                        data_dict[name] = temp
-                    else:
-                        data_dict[name] = []
-                elif len(value) > 0:
-                    # All non-list strings.  Skip empty fields
-                    data_dict[name] = value
-            else:
-                data_dict[name] = value
-
-        # Convert the form fields to TOML
-        toml_data = io.StringIO()
-        toml.dump(data_dict, toml_data)
-
-        # Feed the toml data to the rando arg parser to validate it
-        toml_data.seek(0)
-        toml_dict = tomllib.load(io.BytesIO(toml_data.getvalue().encode()))
-        try:
-            args = tomloptions.toml_data_to_args(toml_dict)
-            _ = ctrando.randomizer.extract_settings(*args)
-        except (ValueError, PlandoException) as ex:
-            context = {
-                'form': form,
-                'error_text': str(ex)
-            }
-            return render(self.request, 'generator/toml_form.html', context)
-        except KeyError as ex:
-            context = {
-                'form': form,
-                'error_text': 'Invalid key value: ' + str(ex)
-            }
-            return render(self.request, 'generator/toml_form.html', context)
-        except Exception as ex:
-            # Catch-all exception for errors we don't expect
-            # TODO: Combine all into a general exception?  Or do we want to keep
-            #       looking for specific exception to handle different errors in
-            #       different ways?
-            context = {
-                'form': form,
-                'error_text': 'Unexpected error: ' + str(ex)
-            }
+        # Build the settings straight from the form and validate them with
+        # the rando arg parser
+        data_dict = validation.form_to_settings_dict(form.cleaned_data)
+        error_text = validation.validate(data_dict)
+        if error_text is not None:
+            context = TomlFormView.get_context_data(
+                form=form, error_text=error_text)
             return render(self.request, 'generator/toml_form.html', context)
 
         # If we made it here, the form is good
@@ -143,27 +130,88 @@ class TomlGenView(FormView):
         # NOTE: toml content type is application/toml, which implies it's
         #       meant to be read by an application.  Going to use text/plain
         #       for now just to ensure it's treated as a text file in browsers
-        toml_data.seek(0)
-        content = FileWrapper(toml_data)
-        response = HttpResponse(content, content_type='text/plain')
+        response = HttpResponse(toml.dumps(data_dict), content_type='text/plain')
         response['Content-Disposition'] = 'attachment; filename=settings.toml'
 
         return response
 
     def form_invalid(self, form):
-        context = {
-            'form': form,
-            'error_text': str(form.errors)
-        }
+        context = TomlFormView.get_context_data(
+            form=form, error_text=str(form.errors))
         return render(self.request, 'generator/toml_form.html', context)
 
 
+class ValidateSettingsView(View):
+    """
+    Check changed TOML form fields against the arg schema.  Takes a JSON
+    object (or form data) of field names to values.
+    """
+
+    @classmethod
+    def post(cls, request):
+        if request.content_type == 'application/json':
+            try:
+                delta = json.loads(request.body)
+            except ValueError:
+                return JsonResponse({'error': 'Invalid JSON'}, status=400)
+            if not isinstance(delta, dict):
+                return JsonResponse(
+                    {'error': 'Expected an object of settings'}, status=400)
+        else:
+            delta = request.POST.dict()
+            delta.pop('csrfmiddlewaretoken', None)
+
+        try:
+            errors = argschema.validate_delta(delta)
+        except argschema.SchemaUnavailable as ex:
+            return JsonResponse({'error': str(ex)}, status=503)
+
+        return JsonResponse({'valid': not errors, 'errors': errors})
+
+
+def get_job_urls(job_id: str) -> dict[str, str]:
+    """
+    Get the status and download URLs for a job
+    """
+    return {
+        'job_id': job_id,
+        'status_url': reverse('generator:job_status', args=[job_id]),
+        'download_url': reverse('generator:job_download', args=[job_id]),
+    }
+
+
 class GenerateView(FormView):
     """
     Handle generating the seed and providing a patch file
     """
     form_class = GeneratorForm
 
+    def post(self, request, *args, **kwargs):
+        # Turn away clients over their rate limit before doing any work
+        try:
+            admission.check_rate(admission.get_client_ip(request))
+        except admission.Rejected as ex:
+            return self.rejected_response(ex)
+
+        return super().post(request, *args, **kwargs)
+
+    def rejected_response(self, ex: admission.Rejected):
+        """
+        Tell the client to come back later
+        """
+        if self.wants_json():
+            response = JsonResponse({'error': str(ex)}, status=ex.status)
+        else:
+            context = {
+                'form': GeneratorForm(),
+                'error_text': str(ex)
+            }
+            response = render(self.request, 'generator/index.html', context,
+                              status=ex.status)
+
+        response['Retry-After'] = str(ex.retry_after)
+        return response
+
     def get_settings_dict(self, form) -> dict[str, typing.Any]:
         """
         Get the settings dictionary corresponding to the user's chosen preset
@@ -182,124 +230,351 @@ class GenerateView(FormView):
             buf = io.BytesIO(self.request.FILES['settings_file'].read())
             return tomllib.load(buf)
         else:
-            # Get the preset data from the rando
-            preset_name = form.cleaned_data['preset_file']
-            preset = arguments.Presets[preset_name]
-            return arguments.get_preset(preset)
+            # Get a copy of the preset data from the preset index
+            return presets.get_settings(form.cleaned_data['preset_file'])
+
+    def get_personalization_dict(self) -> typing.Optional[dict[str, typing.Any]]:
+        """
+        Get the personalization settings dictionary if the user provided a file
+        """
+        if 'personalization_file' not in self.request.FILES:
+            return None
+
+        buf = io.BytesIO(
+            self.request.FILES['personalization_file'].read())
+
+        try:
+            return tomllib.load(buf)
+        except Exception as ex:
+            raise Exception('Invalid personalization file: ' + str(ex))
 
-    def get_personalization_settings(self):
+    @staticmethod
+    def get_personalization_settings(personalization_dict):
         """
         Apply personalization if the user provided a file
         """
-        personal_settings = None
-        if 'personalization_file' in self.request.FILES:
-            buf = io.BytesIO(
-                self.request.FILES['personalization_file'].read())
+        return personalization.parse(personalization_dict)
 
-            try:
-                personalization_dict = tomllib.load(buf)
-            except Exception as ex:
-                raise Exception('Invalid personalization file: ' + str(ex))
+    def get_cached_response(self, cache_key: str):
+        """
+        Get a response for a previously generated seed, or None if this
+        seed hasn't been generated before.
+        """
+        result_path = resultcache.get(cache_key)
+        if result_path is None:
+            return None
 
-            personal_opts = tomloptions.toml_data_to_args(personalization_dict)
-            personal_parser = argparse.ArgumentParser()
-            personal_parser.add_argument_group(
-                PostRandoOptions.add_group_to_parser(personal_parser))
-            namespace = personal_parser.parse_args(personal_opts)
-            personal_settings = PostRandoOptions.extract_from_namespace(
-                namespace)
+        return self.get_result_response(
+            result_path, resultcache.get_config(cache_key))
+
+    def get_pooled_response(self, form, patch_format: str):
+        """
+        Get a response for a pre-generated seed of the chosen preset, or
+        None if the seed pool has none ready.
+        """
+        preset_name = form.cleaned_data['preset_file']
+        if not preset_name or 'settings_file' in self.request.FILES:
+            return None
 
-        return personal_settings
+        entry = seedpool.take(preset_name, patch_format)
+        if entry is None:
+            return None
+        try:
+            return self.get_result_response(*entry)
+        finally:
+            # An open file can still be sent after it's removed
+            seedpool.discard(entry)
 
-    def generate(self, settings_dict, personal_settings):
+    def get_result_response(self, result_path: str,
+                            config_path: typing.Optional[str]):
         """
-        Generate a randomized game based on the given settings files
+        Get a response for an already generated seed
         """
+        if self.wants_json():
+            job_id = jobs.create_finished(result_path, config_path)
+            return JsonResponse(get_job_urls(job_id), status=202)
+
+        return FileResponse(
+            open(result_path, 'rb'),
+            as_attachment=True,
+            filename='ct-mod.zip',
+            content_type='application/octet-stream')
+
+    def wants_json(self) -> bool:
+        return 'application/json' in self.request.headers.get('Accept', '')
+
+    def form_valid(self, form):
+        timer = timing.StageTimer()
         try:
-            args = tomloptions.toml_data_to_args(settings_dict)
-            settings = ctrando.randomizer.extract_settings(*args)
-            if personal_settings is not None:
-                settings.post_random_options = personal_settings
-            base_rom = ctrando.common.ctrom.CTRom.from_file('./ct.sfc')
-            ct_rom = ctrando.randomizer.ctrom.CTRom(base_rom.getvalue())
-            config = ctrando.randomizer.get_random_config(settings, ct_rom)
-            out_rom = ctrando.randomizer.get_ctrom_from_config(
-                ct_rom, settings, config, 'post_config.pkl', 'prepatched_rom.pkl')
-
-            spoiler_file = io.StringIO()
-            ctrando.randomizer.write_spoilers_to_file(
-                settings, config, spoiler_file)
-        except ValueError as ve:
-            raise Exception(f'Invalid args: {str(ve)}')
+            response = self.queue_seed(form, timer)
+        except admission.Rejected as ex:
+            return self.rejected_response(ex)
         except Exception as ex:
-            raise Exception(f'Unknown error during generation: {str(ex)}')
+            context = {
+                'form': form,
+                'error_text': str(ex)
+            }
+            return render(self.request, 'generator/index.html', context)
 
-        return out_rom, spoiler_file
+        response['Server-Timing'] = timing.get_server_timing(timer.timings)
+        return response
 
-    def get_patch_file(self, form, out_rom) -> io.BytesIO:
+    def queue_seed(self, form, timer: timing.StageTimer):
         """
-        Get a BytesIO object with the patch file data
+        Queue a job for the seed and get the response pointing to it.  Seeds
+        that were generated before are served from the result cache.
         """
-        temp_file = tempfile.NamedTemporaryFile()
-        bps_file_name = f'{temp_file.file.name}.bps'
-        patch_buffer = io.BytesIO()
+        # Get the settings for this request
+        with timer.stage('get_settings_dict'):
+            settings_dict = self.get_settings_dict(form)
+        # TODO: Needed?
+        settings_dict['input_file'] = settings.RDI_VANILLA_ROM_PATH
+        with timer.stage('get_personalization_settings'):
+            personalization_dict = self.get_personalization_dict()
+
+        patch_format = patchformats.get(form.cleaned_data['patch_format']).name
+
+        # Serve repeat requests for the same seed from the cache
+        cache_key = resultcache.get_cache_key(
+            settings_dict, personalization_dict, patch_format)
+        if cache_key is not None:
+            response = self.get_cached_response(cache_key)
+            if response is not None:
+                timing.log_timings('seed_cache_hit', timer.timings)
+                return response
+        elif personalization_dict is None:
+            # Any seed of the preset will do, so use a pre-generated one
+            response = self.get_pooled_response(form, patch_format)
+            if response is not None:
+                timing.log_timings('seed_pool_hit', timer.timings)
+                return response
+
+        with timer.stage('parse_personalization'):
+            personal_settings = self.get_personalization_settings(
+                personalization_dict)
+
+        # Queue up the seed to be generated in the background.  The job gets
+        # its own copy of the timer since it keeps adding to it.
+        job_timer = timing.StageTimer()
+        job_timer.update(timer.timings)
+        ticket = admission.admit()
         try:
-            # Write the patch file
-            temp_file.write(out_rom.getbuffer())
-            os.system(
-                f'flips --create ct.sfc {temp_file.file.name} {bps_file_name}')
+            job_id = jobs.enqueue(
+                settings_dict, personal_settings, cache_key, job_timer,
+                patch_format, ticket)
+        except Exception:
+            admission.release(ticket)
+            raise
+
+        return self.job_response(job_id)
 
-            # Read the patch file back into a BytesIO object
-            with open(bps_file_name, 'rb') as patch_file:
-                patch_buffer.write(patch_file.read())
+    def job_response(self, job_id: str, **data):
+        """
+        Point the client to a queued job
+        """
+        if self.wants_json():
+            data.update(get_job_urls(job_id))
+            return JsonResponse(data, status=202)
 
-            # Clean up the temp bps file
-            os.remove(bps_file_name)
+        context = {
+            'job_id': job_id,
+        }
+        context.update(get_job_urls(job_id))
+        return render(self.request, 'generator/job.html', context)
 
-        except Exception as ex:
-            raise Exception('Failed to generate patch file: ' + str(ex))
+    def error_response(self, form, error_text: str, status: int = 400,
+                       **data):
+        if self.wants_json():
+            data['error'] = error_text
+            return JsonResponse(data, status=status)
 
-        return patch_buffer
+        context = {
+            'form': GeneratorForm(),
+            'error_text': error_text
+        }
+        return render(self.request, 'generator/index.html', context,
+                      status=status)
+
+    def form_invalid(self, form):
+        error_text = ' '.join(
+            message if field == '__all__' else f'{field}: {message}'
+            for field, messages in form.errors.items()
+            for message in messages)
+        return self.error_response(
+            form, error_text, errors=form.errors.get_json_data())
 
-    def form_valid(self, form):
 
+class BatchGenerateView(GenerateView):
+    """
+    Generate a batch of seeds with the same settings as a single job
+    """
+    form_class = BatchGeneratorForm
+
+    def has_access(self) -> bool:
+        """
+        Check the request's batch access token (see RDI_BATCH_TOKEN)
+        """
+        if not settings.RDI_BATCH_TOKEN:
+            return False
+
+        scheme, _, token = \
+            self.request.headers.get('Authorization', '').partition(' ')
+        return scheme.lower() == 'bearer' and secrets.compare_digest(
+            token.strip().encode(), settings.RDI_BATCH_TOKEN.encode())
+
+    def post(self, request, *args, **kwargs):
+        if not settings.RDI_BATCH_TOKEN:
+            return self.error_response(
+                None, 'Batch generation is not enabled', status=404)
+        if not self.has_access():
+            return self.error_response(
+                None, 'Invalid batch access token', status=403)
+
+        # The rate limit is charged per seed once the seeds are known (see
+        # form_valid), so skip GenerateView's check of a single token
+        return super(GenerateView, self).post(request, *args, **kwargs)
+
+    def get_seeds(self, form) -> list[str]:
+        seeds = batch.parse_seeds(form.cleaned_data['seeds'])
+        if not seeds and form.cleaned_data['count'] is not None:
+            seeds = batch.make_seeds(form.cleaned_data['count'])
+
+        batch.check_seeds(seeds)
+        return seeds
+
+    def form_valid(self, form):
         try:
-            # Get the settings for this request
+            seeds = self.get_seeds(form)
             settings_dict = self.get_settings_dict(form)
-            settings_dict['input_file'] = './ct.sfc'  # TODO: Needed?
-            personal_settings = self.get_personalization_settings()
-
-            # Generate a randomized ROM
-            out_rom, spoiler_log = self.generate(
+            personal_settings = self.get_personalization_settings(
+                self.get_personalization_dict())
+            # Parse the settings once for the whole batch
+            rando_settings = batch.prepare_settings(
                 settings_dict, personal_settings)
+        except Exception as ex:
+            return self.error_response(form, str(ex))
 
-            # Create the patch file
-            patch_file = self.get_patch_file(form, out_rom)
+        try:
+            admission.check_rate(
+                admission.get_client_ip(self.request), cost=len(seeds))
+            ticket = admission.admit()
+        except admission.Rejected as ex:
+            return self.rejected_response(ex)
+        try:
+            job_id = jobs.enqueue_batch(
+                rando_settings, settings_dict, seeds,
+                form.cleaned_data['patch_format'], ticket)
+        except Exception:
+            admission.release(ticket)
+            raise
+
+        return self.job_response(job_id, seeds=seeds)
+
+
+class RepersonalizeView(GenerateView):
+    """
+    Apply a new personalization file to the seed of an earlier job.  Only
+    the post-rando options are applied again, so the seed isn't re-randomized.
+    """
+    form_class = RepersonalizeForm
+
+    def form_valid(self, form):
+        source_job_id = str(self.kwargs['job_id'])
+        status = jobs.get_status(source_job_id)
+        if status is None or status['state'] != jobs.DONE \
+                or not jobs.has_config(source_job_id):
+            return self.error_response(
+                form, f'No stored seed for job: {source_job_id}', status=404)
+
+        timer = timing.StageTimer()
+        try:
+            with timer.stage('get_personalization_settings'):
+                personal_settings = self.get_personalization_settings(
+                    self.get_personalization_dict())
+            patch_format = patchformats.get(
+                form.cleaned_data['patch_format']).name
         except Exception as ex:
-            context = {
-                'form': form,
-                'error_text': str(ex)
-            }
-            return render(self.request, 'generator/index.html', context)
+            return self.error_response(form, str(ex))
+
+        try:
+            ticket = admission.admit()
+        except admission.Rejected as ex:
+            return self.rejected_response(ex)
+        try:
+            job_id = jobs.enqueue_repersonalize(
+                source_job_id, personal_settings, timer, patch_format, ticket)
+        except FileNotFoundError as ex:
+            admission.release(ticket)
+            return self.error_response(form, str(ex), status=404)
+        except Exception:
+            admission.release(ticket)
+            raise
+
+        return self.job_response(job_id)
 
-        # Build the zip file to send to the user
-        zip_buf = io.BytesIO()
-        with ZipFile(zip_buf, 'w') as zip_file:
-            zip_file.writestr('ct-mod.bps', patch_file.getvalue())
-            zip_file.writestr('ct-mod-spoilers.txt', spoiler_log.getvalue())
-        zip_buf.seek(0)
+    def form_invalid(self, form):
+        return self.error_response(form, 'Upload a personalization file')
+
+
+class JobStatusView(View):
+    """
+    Report the state of a seed generation job
+    """
 
-        # Build and send the response object
-        content = FileWrapper(zip_buf)
-        response = HttpResponse(
-            content, content_type='application/octet-stream')
-        response['Content-Disposition'] = 'attachment; filename=ct-mod.zip'
+    @classmethod
+    def get(cls, request, job_id):
+        job_id = str(job_id)
+        status = jobs.get_status(job_id)
+        if status is None:
+            return HttpResponseNotFound(f'Invalid job: {job_id}')
+
+        data = get_job_urls(job_id)
+        data['state'] = status['state']
+        if 'total' in status:
+            data['completed'] = status['completed']
+            data['total'] = status['total']
+        if status['state'] == jobs.FAILED:
+            data['error'] = status.get('error', 'Unknown error')
+        if status['state'] == jobs.DONE and jobs.has_config(job_id):
+            data['repersonalize_url'] = reverse(
+                'generator:repersonalize', args=[job_id])
+
+        return JsonResponse(data)
+
+
+class JobDownloadView(View):
+    """
+    Send the zip for a finished seed generation job
+    """
+
+    @classmethod
+    def get(cls, request, job_id):
+        job_id = str(job_id)
+        status = jobs.get_status(job_id)
+        if status is None or status['state'] != jobs.DONE:
+            return HttpResponseNotFound(f'No finished seed for job: {job_id}')
+
+        response = FileResponse(
+            open(jobs.get_result_path(job_id), 'rb'),
+            as_attachment=True,
+            filename=jobs.get_download_name(status),
+            content_type='application/octet-stream')
+        if 'timings' in status:
+            response['Server-Timing'] = \
+                timing.get_server_timing(status['timings'])
 
         return response
 
-    def form_invalid(self, form):
-        context = {
-            'form': form,
-            'error_text': 'Choose a preset or upload a settings file.'
-        }
-        return render(self.request, 'generator/index.html', context)
+
+class MetricsView(View):
+    """
+    Seed generation stage timings, admission gauges and seed pool sizes in
+    the Prometheus text format
+    """
+
+    @classmethod
+    def get(cls, request):
+        return HttpResponse(
+            timing.render_prometheus() + admission.render_prometheus()
+            + seedpool.render_prometheus(),
+            content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,250 @@
+"""
+Pool of long-lived randomizer worker processes.
+
+Each worker is started once, warms up the generator artifacts and then
+handles jobs sent to it over a pipe until it has run RDI_WORKER_MAX_JOBS of
+them, at which point it exits and is replaced.  This keeps CPU heavy
+randomization out of the web worker and limits memory creep in the workers.
+
+Workers are forked from a fork server rather than from the web worker.
+Replacements are started from dispatcher threads (and the pool itself may
+be started from the seed pool filler thread), and forking a process with
+other threads running could copy a lock another thread holds, like the
+logging or sqlite locks, leaving the worker to deadlock on it.  The fork
+server is single threaded and has already imported the randomizer, so
+starting a worker stays cheap.  As with any spawned process, a worker
+imports the parent's main module, so scripts that start a pool need an
+if __name__ == '__main__' guard.
+
+Jobs are plain (function, args) payloads.  The function must be importable
+by name since the payload is pickled to send it through the pipe.
+"""
+
+from django.conf import settings
+
+from . import artifacts
+
+import concurrent.futures
+import logging
+import multiprocessing
+import multiprocessing.connection
+import os
+import queue
+import signal
+import threading
+import typing
+
+logger = logging.getLogger(__name__)
+
+
+class WorkerTimeout(Exception):
+    """
+    Raised when a job takes longer than the pool's job timeout
+    """
+
+
+class WorkerDied(Exception):
+    """
+    Raised when a worker process exits while running a job
+    """
+
+
+def _worker_main(conn: multiprocessing.connection.Connection, max_jobs: int):
+    """
+    Main loop of a worker process
+    """
+    # The parent process decides when workers stop.  Don't let a Ctrl-C or
+    # the web worker's signal handlers interfere with a running job.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+    try:
+        artifacts.preload()
+    except OSError as ex:
+        logger.warning('Worker %d could not preload artifacts: %s',
+                       os.getpid(), ex)
+
+    for _ in range(max_jobs):
+        try:
+            func, args = conn.recv()
+        except (EOFError, OSError):
+            # The parent went away
+            return
+
+        try:
+            result = ('ok', func(*args))
+        except Exception as ex:
+            result = ('error', ex)
+
+        try:
+            conn.send(result)
+        except Exception as ex:
+            # The result (or the exception) couldn't be pickled
+            conn.send(('error', Exception(str(ex))))
+
+
+_context = multiprocessing.get_context('forkserver')
+_context.set_forkserver_preload([__name__])
+
+
+class _Worker:
+    """
+    Parent side handle for one worker process
+    """
+
+    def __init__(self, max_jobs: int):
+        self.conn, child_conn = _context.Pipe()
+        self.process = _context.Process(
+            target=_worker_main, args=(child_conn, max_jobs), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.jobs_left = max_jobs
+
+    def run(self, func, args, timeout: float):
+        """
+        Run a job in the worker and return its result
+        """
+        try:
+            self.conn.send((func, args))
+        except OSError:
+            raise self._died()
+        self.jobs_left -= 1
+
+        if not self.conn.poll(timeout):
+            raise WorkerTimeout(f'Job took longer than {timeout} seconds')
+
+        try:
+            status, value = self.conn.recv()
+        except EOFError:
+            raise self._died()
+
+        if status == 'error':
+            raise value
+        return value
+
+    def _died(self) -> WorkerDied:
+        # The pipe closes just before the process can be reaped, so give it
+        # a moment to report its exit code
+        self.process.join(1)
+        return WorkerDied(f'Worker exited with code {self.process.exitcode}')
+
+    def stop(self):
+        self.conn.close()
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join()
+
+
+class _Task(typing.NamedTuple):
+    future: concurrent.futures.Future
+    func: typing.Callable
+    args: tuple
+    on_start: typing.Optional[typing.Callable[[], None]]
+
+
+class RandomizerPool:
+    """
+    Fixed size pool of worker processes fed from a shared job queue.
+
+    Each worker process has a dispatcher thread in the parent that feeds it
+    jobs one at a time and restarts it when it times out, dies or reaches
+    its job limit.
+    """
+
+    def __init__(self, size: int, timeout: float, max_jobs: int):
+        self.size = size
+        self.timeout = timeout
+        self.max_jobs = max_jobs
+        self._tasks: queue.SimpleQueue[typing.Optional[_Task]] = \
+            queue.SimpleQueue()
+        self._threads = []
+        self._shutdown = False
+
+        for i in range(size):
+            worker = _Worker(max_jobs)
+            thread = threading.Thread(
+                target=self._dispatch, args=(worker,),
+                name=f'randomizer-dispatch-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _dispatch(self, worker: typing.Optional[_Worker]):
+        try:
+            while True:
+                task = self._tasks.get()
+                if task is None:
+                    return
+                if not task.future.set_running_or_notify_cancel():
+                    continue
+
+                if worker is None or worker.jobs_left <= 0 \
+                        or not worker.process.is_alive():
+                    if worker is not None:
+                        worker.stop()
+                    worker = _Worker(self.max_jobs)
+
+                if task.on_start is not None:
+                    try:
+                        task.on_start()
+                    except Exception as ex:
+                        task.future.set_exception(ex)
+                        continue
+
+                try:
+                    result = worker.run(task.func, task.args, self.timeout)
+                except (WorkerTimeout, WorkerDied) as ex:
+                    logger.error('Restarting randomizer worker: %s', ex)
+                    worker.stop()
+                    worker = None
+                    task.future.set_exception(ex)
+                except Exception as ex:
+                    task.future.set_exception(ex)
+                else:
+                    task.future.set_result(result)
+        finally:
+            if worker is not None:
+                worker.stop()
+
+    def submit(
+            self,
+            func: typing.Callable,
+            *args,
+            on_start: typing.Optional[typing.Callable[[], None]] = None
+    ) -> concurrent.futures.Future:
+        """
+        Queue a job.  on_start is called in the parent when a worker
+        picks up the job.  If it raises, the job fails with its exception
+        instead of running.
+        """
+        if self._shutdown:
+            raise RuntimeError('Randomizer pool has been shut down')
+
+        future = concurrent.futures.Future()
+        self._tasks.put(_Task(future, func, args, on_start))
+        return future
+
+    def shutdown(self):
+        self._shutdown = True
+        for _ in self._threads:
+            self._tasks.put(None)
+        for thread in self._threads:
+            thread.join()
+
+
+_pool: typing.Optional[RandomizerPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> RandomizerPool:
+    """
+    Get this process's randomizer pool, starting it on first use.  The pool
+    must not be started before forking web workers.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = RandomizerPool(
+                size=settings.RDI_JOB_WORKERS,
+                timeout=settings.RDI_JOB_TIMEOUT,
+                max_jobs=settings.RDI_WORKER_MAX_JOBS)
+        return _pool
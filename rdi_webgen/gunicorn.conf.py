@@ -0,0 +1,40 @@
+"""
+Gunicorn configuration for the production container.
+
+The app is loaded in the master process so the generator artifacts and the
+cached pages can be preloaded once and shared copy-on-write by all of the
+forked workers.
+
+GUNICORN_WORKER_CLASS picks the worker class.  The default sync workers
+serve rdi.wsgi.  To serve rdi.asgi with the async views, use
+uvicorn_worker.UvicornWorker (see deploy/docker-compose.asgi.yml).
+"""
+
+import os
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('GUNICORN_WORKERS', '1'))
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'sync')
+preload_app = True
+
+
+def when_ready(server):
+    """
+    Runs in the master process after the app is loaded, before any
+    workers are forked.
+    """
+    from generator import artifacts, presets, views
+    artifacts.preload()
+    presets.preload()
+    views.preload_pages()
+
+
+def post_worker_init(worker):
+    """
+    Start the randomizer worker pool as soon as a web worker is up so the
+    first seed doesn't pay for forking it.  The seed pool filler uses it
+    too.
+    """
+    from generator import seedpool, workerpool
+    workerpool.get_pool()
+    seedpool.start_filler()
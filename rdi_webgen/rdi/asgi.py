@@ -12,5 +12,8 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'rdi.settings')
+# Sync views each need a thread under ASGI, and their downloads are read into
+# memory before they're sent, so serve the async variants
+os.environ.setdefault('RDI_ASYNC_VIEWS', '1')
 
 application = get_asgi_application()
@@ -35,6 +35,25 @@ SECURE_PROXY_SSL_HEADER = ("HTTP_X_FORWARDED_PROTO", "https")
 
 # Application definition
 
+# Stateless profile.  None of the generator views use the database, users,
+# sessions or messages, so this leaves out those apps and their middleware,
+# and there's no database to migrate.  CSRF tokens are kept in a cookie
+# either way.
+RDI_STATELESS = bool(int(os.environ.get('RDI_STATELESS', '0')))
+# Apps, middleware and context processors the stateless profile leaves out
+_STATEFUL_COMPONENTS = {
+    'django.contrib.admin',
+    'django.contrib.auth',
+    'django.contrib.contenttypes',
+    'django.contrib.sessions',
+    'django.contrib.messages',
+    'django.contrib.sessions.middleware.SessionMiddleware',
+    'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'django.contrib.messages.middleware.MessageMiddleware',
+    'django.contrib.auth.context_processors.auth',
+    'django.contrib.messages.context_processors.messages',
+}
+
 INSTALLED_APPS = [
     'django.contrib.admin',
     'django.contrib.auth',
@@ -55,6 +74,13 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+if RDI_STATELESS:
+    INSTALLED_APPS = [
+        app for app in INSTALLED_APPS if app not in _STATEFUL_COMPONENTS]
+    MIDDLEWARE = [
+        middleware for middleware in MIDDLEWARE
+        if middleware not in _STATEFUL_COMPONENTS]
+
 ROOT_URLCONF = 'rdi.urls'
 
 TEMPLATES = [
@@ -72,18 +98,28 @@ TEMPLATES = [
     },
 ]
 
+if RDI_STATELESS:
+    TEMPLATES[0]['OPTIONS']['context_processors'] = [
+        processor
+        for processor in TEMPLATES[0]['OPTIONS']['context_processors']
+        if processor not in _STATEFUL_COMPONENTS]
+
 WSGI_APPLICATION = 'rdi.wsgi.application'
 
 
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+if RDI_STATELESS:
+    # Django's dummy backend, which raises if anything uses the database
+    DATABASES = {}
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+        }
     }
-}
 
 
 # Password validation
@@ -123,7 +159,133 @@ USE_TZ = True
 STATIC_URL = 'static/'
 STATIC_ROOT = BASE_DIR / 'staticfiles'
 
+# Collect the static files under content-hashed names with gzip/brotli
+# copies (see generator/storage.py).  The pages need collectstatic to have
+# run when this is on and DEBUG is off.
+RDI_STATIC_MANIFEST = bool(int(os.environ.get('RDI_STATIC_MANIFEST', '0')))
+
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': (
+            'generator.storage.CompressedManifestStaticFilesStorage'
+            if RDI_STATIC_MANIFEST
+            else 'django.contrib.staticfiles.storage.StaticFilesStorage'),
+    },
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+# Generator settings
+
+# Vanilla ROM and the prepatched artifacts created by tools/prepatch_rom.py
+RDI_VANILLA_ROM_PATH = os.environ.get('RDI_VANILLA_ROM_PATH', './ct.sfc')
+RDI_POST_CONFIG_PATH = os.environ.get('RDI_POST_CONFIG_PATH', 'post_config.pkl')
+RDI_PREPATCHED_ROM_PATH = os.environ.get(
+    'RDI_PREPATCHED_ROM_PATH', 'prepatched_rom.pkl')
+
+# Startup build steps (see generator/buildsteps.py).  The manifest records
+# the inputs of each step so unchanged steps are skipped on the next start.
+RDI_TOOLS_DIR = os.environ.get('RDI_TOOLS_DIR', 'tools')
+RDI_BUILD_MANIFEST = os.environ.get('RDI_BUILD_MANIFEST', 'build_manifest.json')
+RDI_STARTUP_WORKERS = int(
+    os.environ.get('RDI_STARTUP_WORKERS', str(os.cpu_count() or 1)))
+
+# Engine used to create the BPS patch for a seed.
+#   python: in-process encoder (generator.bps)
+#   flips: shell out to the flips CLI
+RDI_PATCH_ENGINE = os.environ.get('RDI_PATCH_ENGINE', 'python')
+# Patch format used when the request doesn't choose one (see
+# generator/patchformats.py): bps, bps-delta or ips
+RDI_PATCH_FORMAT = os.environ.get('RDI_PATCH_FORMAT', 'bps')
+# Offer the raw ROM delta formats (xor, ranges) for trusted clients like a
+# local kiosk.  These hand out the randomized ROM, so keep this off for a
+# public site.
+RDI_TRUSTED_OUTPUT = int(os.environ.get('RDI_TRUSTED_OUTPUT', '0'))
+
+# Seed generation jobs.  Job state and results are kept on the filesystem so
+# every web worker can see them.
+RDI_JOB_DIR = os.environ.get('RDI_JOB_DIR', 'jobs')
+# Number of randomizer worker processes per web worker
+RDI_JOB_WORKERS = int(os.environ.get('RDI_JOB_WORKERS', '2'))
+# Seconds a single seed may take before its worker is killed
+RDI_JOB_TIMEOUT = float(os.environ.get('RDI_JOB_TIMEOUT', '120'))
+# Jobs a randomizer worker runs before it is replaced with a fresh process
+RDI_WORKER_MAX_JOBS = int(os.environ.get('RDI_WORKER_MAX_JOBS', '50'))
+# Seconds to keep finished jobs around for download
+RDI_JOB_RETENTION = int(os.environ.get('RDI_JOB_RETENTION', '3600'))
+# Seconds between each web worker's scans for jobs past their retention
+RDI_JOB_PRUNE_INTERVAL = int(os.environ.get('RDI_JOB_PRUNE_INTERVAL', '60'))
+
+# Most seeds a single batch request may generate
+RDI_BATCH_MAX_SEEDS = int(os.environ.get('RDI_BATCH_MAX_SEEDS', '200'))
+# Access token for /generate_batch, sent as "Authorization: Bearer <token>".
+# The endpoint is off while this is empty.
+RDI_BATCH_TOKEN = os.environ.get('RDI_BATCH_TOKEN', '')
+
+# Cache of generated zips for seeds with a fixed seed value
+RDI_RESULT_CACHE_DIR = os.environ.get('RDI_RESULT_CACHE_DIR', 'result_cache')
+RDI_RESULT_CACHE_MAX_BYTES = int(
+    os.environ.get('RDI_RESULT_CACHE_MAX_BYTES', str(256 * 1024 * 1024)))
+
+# Stage timing summaries served at /metrics.  Each process keeps its most
+# recent RDI_METRICS_WINDOW samples per stage in RDI_METRICS_DIR.
+RDI_METRICS_DIR = os.environ.get('RDI_METRICS_DIR', 'metrics')
+RDI_METRICS_WINDOW = int(os.environ.get('RDI_METRICS_WINDOW', '1000'))
+# Seconds a process's samples are kept after it last recorded one.  The
+# samples of a process that exited are dropped right away.
+RDI_METRICS_RETENTION = int(os.environ.get('RDI_METRICS_RETENTION', '86400'))
+
+# Admission control for seed generation (see generator/admission.py).  The
+# state is kept in a local sqlite file shared by every web worker.
+RDI_ADMISSION_DB = os.environ.get('RDI_ADMISSION_DB', 'admission.sqlite3')
+# Seed requests per client IP: a burst of RDI_RATE_LIMIT_BURST, refilled at
+# RDI_RATE_LIMIT_PER_MINUTE.  Set the rate to 0 to turn the limit off.
+RDI_RATE_LIMIT_PER_MINUTE = float(
+    os.environ.get('RDI_RATE_LIMIT_PER_MINUTE', '6'))
+RDI_RATE_LIMIT_BURST = int(os.environ.get('RDI_RATE_LIMIT_BURST', '10'))
+# Seeds generating at the same time across all web workers (0 for no limit)
+# and admitted seeds that may wait for a slot before requests get a 503
+RDI_MAX_GENERATIONS = int(
+    os.environ.get('RDI_MAX_GENERATIONS', str(os.cpu_count() or 1)))
+RDI_ADMISSION_QUEUE = int(os.environ.get('RDI_ADMISSION_QUEUE', '32'))
+# Retry-After sent with a 503 when the queue is full
+RDI_ADMISSION_RETRY_AFTER = int(
+    os.environ.get('RDI_ADMISSION_RETRY_AFTER', '30'))
+# Seconds a job's admission ticket may wait, or run once it has a slot,
+# before it is reclaimed even if its web worker is still alive.  A job
+# still waiting for a slot after this long fails.
+RDI_ADMISSION_LEASE = int(os.environ.get('RDI_ADMISSION_LEASE', '3600'))
+# Header holding the client's address when running behind a proxy (e.g.
+# X-Real-IP).  REMOTE_ADDR is used when unset.
+RDI_CLIENT_IP_HEADER = os.environ.get('RDI_CLIENT_IP_HEADER', '')
+
+# Serve the async generator views (see generator/asyncviews.py).  rdi/asgi.py
+# turns this on, so it only needs setting to use them some other way.
+RDI_ASYNC_VIEWS = bool(int(os.environ.get('RDI_ASYNC_VIEWS', '0')))
+# Threads per web worker for the blocking part of the async views
+RDI_ASYNC_THREADS = int(os.environ.get('RDI_ASYNC_THREADS', '16'))
+
+# Parsed personalization files and TOML builder validation results kept
+# per process (0 to turn off either cache)
+RDI_PERSONALIZATION_CACHE_SIZE = int(
+    os.environ.get('RDI_PERSONALIZATION_CACHE_SIZE', '256'))
+RDI_VALIDATION_CACHE_SIZE = int(
+    os.environ.get('RDI_VALIDATION_CACHE_SIZE', '1024'))
+
+# Pre-generated seeds per preset (see generator/seedpool.py).  A preset's
+# pool refills from below RDI_SEED_POOL_LOW seeds up to RDI_SEED_POOL_HIGH,
+# which RDI_SEED_POOL_SIZES can override per preset, e.g. "STANDARD=10
+# RACE=0".  The pool is off when every preset's size is 0.
+RDI_SEED_POOL_DIR = os.environ.get('RDI_SEED_POOL_DIR', 'seed_pool')
+RDI_SEED_POOL_LOW = int(os.environ.get('RDI_SEED_POOL_LOW', '2'))
+RDI_SEED_POOL_HIGH = int(os.environ.get('RDI_SEED_POOL_HIGH', '0'))
+RDI_SEED_POOL_SIZES = os.environ.get('RDI_SEED_POOL_SIZES', '')
+# Seconds between checks for presets that need refilling
+RDI_SEED_POOL_INTERVAL = float(os.environ.get('RDI_SEED_POOL_INTERVAL', '10'))
@@ -1,10 +1,17 @@
 """
 This script generates prepatched config and ctrom objects which can be
 used later by the randomizer to speed up seed generation.
+
+The two objects don't depend on each other, so --part can be used to
+create just one of them (e.g. to create both in parallel).
 """
 
+import argparse
+
 from ctrando import common, randomizer
 
+PARTS = ('post_config', 'prepatched_rom')
+
 
 def main():
     """
@@ -12,10 +19,22 @@ def main():
     This will allow future seed generation calls to skip this step
     and speed up the process.
     """
-    base_rom = common.ctrom.CTRom.from_file('./ct.sfc')
-    randomizer.dump_openworld_post_config(base_rom, 'post_config.pkl')
-    randomizer.dump_prepatched_ctrom(
-        vanilla_rom=base_rom, dump_path='prepatched_rom.pkl')
+    parser = argparse.ArgumentParser(
+        description='Create the prepatched randomizer objects')
+    parser.add_argument('--part', choices=PARTS, action='append',
+                        help='Only create this object (default: both)')
+    parser.add_argument('--rom', default='./ct.sfc')
+    parser.add_argument('--post-config', default='post_config.pkl')
+    parser.add_argument('--prepatched-rom', default='prepatched_rom.pkl')
+    args = parser.parse_args()
+    parts = args.part or PARTS
+
+    base_rom = common.ctrom.CTRom.from_file(args.rom)
+    if 'post_config' in parts:
+        randomizer.dump_openworld_post_config(base_rom, args.post_config)
+    if 'prepatched_rom' in parts:
+        randomizer.dump_prepatched_ctrom(
+            vanilla_rom=base_rom, dump_path=args.prepatched_rom)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,207 @@
+"""
+This script vendors the third-party JavaScript and CSS used by the webapp's
+pages, so they're served with the webapp's static files instead of from
+several CDNs.
+
+Every asset is pinned to an exact version and checked against its
+subresource integrity hash when one is pinned.  The scripts and
+stylesheets are bundled in page order into vendor.js and vendor.css.
+smol-toml is an ES module, so it's kept on its own as smol-toml.js.  The
+upstream files are already minified, so bundling only strips their source
+map comments (the maps aren't vendored).
+
+A .manifest.json in the output directory records what the bundles were
+built from.  When the pins haven't changed and the bundles are intact,
+nothing is downloaded, so the script can run on every start once the
+Docker image has built the bundles.
+
+With --strict, an asset without a pinned hash is an error instead of a
+warning.  jQuery, bootstrap4-toggle, bootstrap-select and smol-toml aren't
+pinned yet, so the Docker build runs without it until they are.  After
+changing an asset's URL, --print-pins downloads every asset and prints the
+hash to pin for each.
+
+There's no fallback to the CDNs.  A download or integrity failure fails
+the Docker build, and at startup it fails the vendor_static build step,
+which stops the webapp from starting.  That's on purpose: with the
+manifest static storage, a page whose {% static %} bundle is missing
+fails to render.
+
+    python vendor_static.py generator/static/generator/vendor
+    python vendor_static.py --print-pins
+"""
+
+import argparse
+import base64
+import hashlib
+import json
+import os
+import re
+import sys
+import typing
+import urllib.request
+
+
+class Asset(typing.NamedTuple):
+    url: str
+    # Subresource integrity hash (sha384-<base64>), or None if not pinned
+    integrity: typing.Optional[str] = None
+
+
+# Bundle name -> assets, in the order the pages loaded them
+BUNDLES = {
+    'vendor.js': [
+        Asset('https://ajax.googleapis.com/ajax/libs/jquery/3.4.1/jquery.min.js'),
+        Asset('https://cdnjs.cloudflare.com/ajax/libs/popper.js/1.14.7/umd/popper.min.js',
+              'sha384-UO2eT0CpHqdSJQ6hJty5KVphtPhzWj9WO1clHTMGa3JDZwrnQq4sF86dIHNDz0W1'),
+        Asset('https://stackpath.bootstrapcdn.com/bootstrap/4.3.1/js/bootstrap.min.js',
+              'sha384-JjSmVgyd0p3pXB1rRibZUAYoIIy6OrQ6VrjIEaFf/nJGzIxFDsf4x0xIM+B07jRM'),
+        Asset('https://cdn.jsdelivr.net/gh/gitbrent/bootstrap4-toggle@3.6.1/js/bootstrap4-toggle.min.js'),
+        Asset('https://cdn.jsdelivr.net/npm/bootstrap-select@1.13.9/dist/js/bootstrap-select.min.js'),
+    ],
+    'vendor.css': [
+        Asset('https://stackpath.bootstrapcdn.com/bootstrap/4.3.1/css/bootstrap.min.css',
+              'sha384-ggOyR0iXCbMQv3Xipma34MD+dH/1fQ784/j6cY/iJTQUOhcWr7x9JvoRxT2MZw1T'),
+        Asset('https://cdn.jsdelivr.net/gh/gitbrent/bootstrap4-toggle@3.6.1/css/bootstrap4-toggle.min.css'),
+        Asset('https://cdn.jsdelivr.net/npm/bootstrap-select@1.13.9/dist/css/bootstrap-select.min.css'),
+    ],
+    'smol-toml.js': [
+        # jsDelivr's single file ES module build
+        Asset('https://cdn.jsdelivr.net/npm/smol-toml@1.4.2/+esm'),
+    ],
+}
+
+MANIFEST_NAME = '.manifest.json'
+
+# Source map comments, which Django's manifest storage would try to follow
+SOURCE_MAP_PATTERN = re.compile(
+    rb'^\s*(//[#@] sourceMappingURL=.*|/\*[#@] sourceMappingURL=.*?\*/)\s*$',
+    re.MULTILINE)
+
+
+def get_integrity(data: bytes) -> str:
+    digest = hashlib.sha384(data).digest()
+    return 'sha384-' + base64.b64encode(digest).decode()
+
+
+def download(asset: Asset, strict: bool) -> bytes:
+    """
+    Download an asset and check its integrity hash
+    """
+    request = urllib.request.Request(
+        asset.url, headers={'User-Agent': 'rdi-webgen vendor_static'})
+    with urllib.request.urlopen(request, timeout=60) as response:
+        data = response.read()
+
+    integrity = get_integrity(data)
+    if asset.integrity is None:
+        message = (f'No integrity hash pinned for {asset.url} ({integrity}, '
+                   f'see --print-pins)')
+        if strict:
+            raise RuntimeError(message)
+        print(f'Warning: {message}', file=sys.stderr)
+    elif integrity != asset.integrity:
+        raise RuntimeError(
+            f'Integrity check failed for {asset.url}: expected '
+            f'{asset.integrity}, got {integrity}')
+
+    return data
+
+
+def build_bundle(name: str, assets: list[Asset], strict: bool) -> bytes:
+    """
+    Download a bundle's assets and join them into one file
+    """
+    parts = []
+    for asset in assets:
+        data = SOURCE_MAP_PATTERN.sub(b'', download(asset, strict)).strip()
+        parts.append(f'/* {asset.url} */\n'.encode() + data)
+
+    # The semicolons keep one script's last statement from running into the
+    # next script
+    separator = b'\n;\n' if name.endswith('.js') else b'\n'
+    return separator.join(parts) + b'\n'
+
+
+def load_manifest(output_dir: str) -> dict[str, typing.Any]:
+    try:
+        with open(os.path.join(output_dir, MANIFEST_NAME)) as file:
+            return json.load(file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def is_current(output_dir: str, name: str, assets: list[Asset],
+               manifest: dict[str, typing.Any]) -> bool:
+    """
+    Check whether a bundle was built from the pinned assets and is intact
+    """
+    entry = manifest.get(name)
+    if entry is None or entry['assets'] != [list(asset) for asset in assets]:
+        return False
+
+    try:
+        with open(os.path.join(output_dir, name), 'rb') as file:
+            return hashlib.sha256(file.read()).hexdigest() == entry['sha256']
+    except FileNotFoundError:
+        return False
+
+
+def print_pins():
+    """
+    Print the integrity hash of every asset as downloaded now
+    """
+    for assets in BUNDLES.values():
+        for asset in assets:
+            request = urllib.request.Request(
+                asset.url, headers={'User-Agent': 'rdi-webgen vendor_static'})
+            with urllib.request.urlopen(request, timeout=60) as response:
+                integrity = get_integrity(response.read())
+
+            note = ''
+            if asset.integrity is None:
+                note = '  (not pinned)'
+            elif asset.integrity != integrity:
+                note = f'  (pinned {asset.integrity})'
+            print(f'{asset.url}\n    {integrity}{note}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('output_dir', nargs='?')
+    parser.add_argument('--strict', action='store_true',
+                        help='Fail on assets without a pinned integrity hash')
+    parser.add_argument('--print-pins', action='store_true',
+                        help='Print the hash to pin for each asset and exit')
+    args = parser.parse_args()
+
+    if args.print_pins:
+        print_pins()
+        return
+    if args.output_dir is None:
+        parser.error('the output_dir argument is required')
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    manifest = load_manifest(args.output_dir)
+    for name, assets in BUNDLES.items():
+        if is_current(args.output_dir, name, assets, manifest):
+            continue
+
+        data = build_bundle(name, assets, args.strict)
+        path = os.path.join(args.output_dir, name)
+        with open(f'{path}.tmp', 'wb') as file:
+            file.write(data)
+        os.replace(f'{path}.tmp', path)
+
+        manifest[name] = {
+            'assets': [list(asset) for asset in assets],
+            'sha256': hashlib.sha256(data).hexdigest(),
+        }
+        print(f'Wrote {name} ({len(data)} bytes)')
+
+    with open(os.path.join(args.output_dir, MANIFEST_NAME), 'w') as file:
+        json.dump(manifest, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()